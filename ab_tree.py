@@ -1,11 +1,20 @@
-from typing import Optional, List, Tuple
+from bisect import bisect_left, bisect_right
+from typing import Callable, Iterable, Optional, List, Tuple
 from generic import ATree, Node
 
 
 class ABVertex:
-    """ ABVertex is one node in ABTree """
+    """ ABVertex is one node in ABTree
+
+    keys - sorted nodes of vertex
+    search_keys - keys of nodes in `keys`, searched by bisect
+    children - child vertices, empty for leaf
+    """
+    __slots__ = ("keys", "search_keys", "children", "leaf")
+
     def __init__(self, keys, children, leaf):
         self.keys: 'List[Node]' = keys
+        self.search_keys: list = [n.key for n in keys]
         self.children: 'List[ABVertex]' = children
         self.leaf: bool = leaf
 
@@ -13,146 +22,331 @@ class ABVertex:
         return f"ABVertex({', '.join(str(n.key) for n in self.keys)})"
 
 
+class AggregateABVertex(ABVertex):
+    """ ABVertex of tree with combine function
+
+    agg - values of subtree combined by tree combine function, set by ABTree._update_aggregate
+    """
+    __slots__ = ("agg",)
+
+
+class SizedABVertex(ABVertex):
+    """ ABVertex of tree with sizes
+
+    size - number of keys in subtree of vertex
+    """
+    __slots__ = ("size",)
+
+    def __init__(self, keys, children, leaf):
+        super().__init__(keys, children, leaf)
+        self.size: int = len(keys) + sum(child.size for child in children)
+
+
+class SizedAggregateABVertex(SizedABVertex):
+    """ ABVertex of tree with sizes and combine function """
+    __slots__ = ("agg",)
+
+
 class ABTree(ATree[Node]):
-    def __init__(self, a: int, b: int):
-        self.root = ABVertex(list(), list(), True)
+    """ AB tree with optional subtree sizes and cached aggregates of values in subtrees
+
+    combine - associative function of two values (e.g. operator.add, min, max)
+    identity - identity value of combine (e.g. 0 for operator.add)
+    sizes - vertices keep numbers of keys in their subtrees for O(b log n) select, rank and len
+    vertex_class - class of new vertices, vertices with size and agg slots only if
+    tree has sizes and combine
+    """
+    def __init__(self, a: int, b: int, combine: Optional[Callable] = None, identity=None,
+                 sizes: bool = False):
         self.a = a
         self.b = b
+        self.combine = combine
+        self.identity = identity
+        self.sizes = sizes
+        if sizes:
+            self.vertex_class = SizedABVertex if combine is None else SizedAggregateABVertex
+        else:
+            self.vertex_class = ABVertex if combine is None else AggregateABVertex
+        self.root = self.vertex_class(list(), list(), True)
+        self._update_aggregate(self.root)
+
+    @classmethod
+    def from_sorted(cls, pairs: Iterable[Tuple], a: int, b: int, fill: float = 1.0,
+                    combine: Optional[Callable] = None, identity=None, sizes: bool = False) -> 'ABTree':
+        """ Build tree from (key, value) pairs sorted by key in linear time
+
+        fill - how full vertices are, 1.0 means b-1 keys in vertex (but never less than a-1)
+        The tree is built bottom-up, level by level. Every level is split to
+        vertices separated by one key, separators create the level above.
+        """
+        tree = cls(a, b, combine, identity, sizes)
+        keys: List[Node] = cls._sorted_nodes(pairs, Node)
+        children: List[ABVertex] = []
+        size = max(a - 1, min(b - 1, round(fill * (b - 1))))
+
+        while len(keys) > b - 1:
+            # split keys to vertices with count keys each, there is one separator after each vertex
+            count = -(-(len(keys) + 1) // (size + 1))
+            if (len(keys) + 1) // count < a:
+                count = (len(keys) + 1) // a
+            base, extra = divmod(len(keys) + 1, count)
+
+            separators: List[Node] = []
+            vertices: List[ABVertex] = []
+            start = 0
+            for idx in range(count):
+                end = start + base - 1 + (1 if idx < extra else 0)
+                vertex_children = children[start:end + 1] if children else []
+                vertices.append(tree.vertex_class(keys[start:end], vertex_children, not children))
+                tree._update_aggregate(vertices[-1])
+                if end < len(keys):
+                    separators.append(keys[end])
+                start = end + 1
+            keys, children = separators, vertices
+
+        tree.root = tree.vertex_class(keys, children, not children)
+        tree._update_aggregate(tree.root)
+        return tree
+
+    def _rebuild(self, pairs: Iterable[Tuple]) -> None:
+        self.root = self.from_sorted(pairs, self.a, self.b, combine=self.combine,
+                                     identity=self.identity, sizes=self.sizes).root
+
+    def _update_aggregate(self, vertex: ABVertex) -> None:
+        """ Recompute vertex.agg from its nodes and children, does nothing without combine function """
+        combine = self.combine
+        if combine is None:
+            return
+        agg = self.identity
+        if vertex.leaf:
+            for n in vertex.keys:
+                agg = combine(agg, n.value)
+        else:
+            for n, child in zip(vertex.keys, vertex.children):
+                agg = combine(combine(agg, child.agg), n.value)
+            agg = combine(agg, vertex.children[-1].agg)
+        vertex.agg = agg
+
+    def aggregate(self, lo, hi):
+        """ Return combined values of nodes with lo <= key < hi in O(b log n)
+
+        Values are combined in key order, identity is returned for empty range.
+        """
+        if self.combine is None:
+            raise ValueError("tree was created without combine function")
+        if not lo < hi:
+            return self.identity
+        return self._aggregate(self.root, lo, hi)
+
+    def _aggregate(self, vertex: ABVertex, lo, hi):
+        """ Combine values of vertex subtree with lo <= key < hi, None means unbounded side """
+        if lo is None and hi is None:
+            return vertex.agg
+        combine = self.combine
+        start = 0 if lo is None else bisect_left(vertex.search_keys, lo)
+        end = len(vertex.keys) if hi is None else bisect_left(vertex.search_keys, hi)
+
+        agg = self.identity
+        if vertex.leaf:
+            for n in vertex.keys[start:end]:
+                agg = combine(agg, n.value)
+            return agg
+        if start == end:
+            return self._aggregate(vertex.children[start], lo, hi)
+
+        agg = self._aggregate(vertex.children[start], lo, None)
+        for idx in range(start, end):
+            agg = combine(agg, vertex.keys[idx].value)
+            if idx + 1 < end:
+                agg = combine(agg, vertex.children[idx + 1].agg)
+        return combine(agg, self._aggregate(vertex.children[end], None, hi))
 
     def insert(self, key, value) -> None:
-        new_root, left_vertex, right_vertex = self._insert(key, value, self.root)
-        if new_root is not None:
-            self.root = ABVertex([new_root], [left_vertex, right_vertex], False)
-
-    def _insert(self, key, value, node: ABVertex) -> Tuple[Optional[Node], Optional[ABVertex], Optional[ABVertex]]:
-        """ Insert node to Vertex with given key
-            Return key that should be added to parent vertex and left, right vertices to this key
-            if vertex is overfull
-            Else return None, None, None
+        self._insert_below(key, value, [], self.root)
+
+    def _insert_below(self, key, value, path: 'List[Tuple[ABVertex, int]]', vertex: ABVertex) -> None:
+        """ Insert key to subtree of vertex, path of (vertex, child index) leads from root to vertex
+
+        Overfull vertices are split bottom-up along the path. path is left with
+        its part whose vertices were not split or changed by the new key.
         """
-        if node.leaf:
-            idx = 0
-            for idx, n in enumerate(node.keys):
-                if key == n.key:
-                    # key is alread in tree
-                    return (None, None, None)
-                if key > n.key:
-                    # if loop ends, then i will insert on last position
-                    idx += 1
-                    continue
+        while True:
+            search_keys = vertex.search_keys
+            idx = bisect_left(search_keys, key)
+            if idx < len(search_keys) and search_keys[idx] == key:
+                # key is alread in tree
+                return
+            if vertex.leaf:
                 break
-            new_node = Node(key, value)
-            self._add_node_to_chain(new_node, self._find_lower(self.root, key),
-                                    self._find_bigger(self.root, key))
+            path.append((vertex, idx))
+            vertex = vertex.children[idx]
 
-            node.keys.insert(idx, new_node)
+        # leaf of nonempty tree has a key, the other neighbour is next to it in chain
+        keys = vertex.keys
+        if idx > 0:
+            lower = keys[idx - 1]
+            bigger = lower.nxt
+        elif keys:
+            bigger = keys[0]
+            lower = bigger.prev
         else:
-            idx = 0
-            for n in node.keys:
-                if key > n.key:
-                    idx += 1
-            mid_node, left_vertex, right_vertex = self._insert(key, value, node.children[idx])
-            # mid_node != None then child vertex has got splitted
-            if mid_node is not None:
-                node.children[idx] = left_vertex             # type: ignore
-                node.children.insert(idx + 1, right_vertex)  # type: ignore
-                node.keys.insert(idx, mid_node)
-
-        if len(node.keys) == self.b:
-            mid = len(node.keys) // 2
-            mid_node = node.keys[mid]
-            left_vertex = ABVertex(node.keys[:mid], node.children[:mid+1], node.leaf)
-            right_vertex = ABVertex(node.keys[mid+1:], node.children[mid+1:], node.leaf)
-
-            return (mid_node, left_vertex, right_vertex)
-        return (None, None, None)
-
-    def _find_bigger(self, node: ABVertex, key) -> Optional[Node]:
+            lower = bigger = None
+        new_node = Node(key, value)
+        self._add_node_to_chain(new_node, lower, bigger)
+        keys.insert(idx, new_node)
+        search_keys.insert(idx, key)
+        if self.sizes:
+            vertex.size += 1
+
+        while len(vertex.keys) == self.b:
+            mid_node, left_vertex, right_vertex = self._split_vertex(vertex)
+            if not path:
+                self.root = self.vertex_class([mid_node], [left_vertex, right_vertex], False)
+                self._update_aggregate(self.root)
+                return
+            vertex, idx = path.pop()
+            vertex.children[idx] = left_vertex
+            vertex.children.insert(idx + 1, right_vertex)
+            vertex.keys.insert(idx, mid_node)
+            vertex.search_keys.insert(idx, mid_node.key)
+            if self.sizes:
+                vertex.size += 1
+        self._update_aggregate(vertex)
+        if self.sizes or self.combine is not None:
+            for ancestor, _ in reversed(path):
+                if self.sizes:
+                    ancestor.size += 1
+                self._update_aggregate(ancestor)
+
+    def _split_vertex(self, vertex: ABVertex) -> Tuple[Node, ABVertex, ABVertex]:
+        """ Split vertex by its middle key, return the key and left, right vertices """
+        mid = len(vertex.keys) // 2
+        left_vertex = self.vertex_class(vertex.keys[:mid], vertex.children[:mid+1], vertex.leaf)
+        right_vertex = self.vertex_class(vertex.keys[mid+1:], vertex.children[mid+1:], vertex.leaf)
+        self._update_aggregate(left_vertex)
+        self._update_aggregate(right_vertex)
+        return (vertex.keys[mid], left_vertex, right_vertex)
+
+    def __len__(self) -> int:
+        if not self.sizes:
+            return super().__len__()
+        return self.root.size
+
+    def select(self, k: int) -> Node:
+        if not self.sizes:
+            return super().select(k)
+        vertex = self.root
+        if not 0 <= k < vertex.size:
+            raise IndexError("tree index out of range")
+        while not vertex.leaf:
+            for idx, child in enumerate(vertex.children):
+                if k < child.size:
+                    vertex = child
+                    break
+                k -= child.size
+                if k == 0:
+                    return vertex.keys[idx]
+                k -= 1
+        return vertex.keys[k]
+
+    def rank(self, key) -> int:
+        if not self.sizes:
+            return super().rank(key)
+        ret = 0
+        vertex = self.root
+        while True:
+            idx = bisect_left(vertex.search_keys, key)
+            ret += idx
+            if vertex.leaf:
+                return ret
+            for child in vertex.children[:idx]:
+                ret += child.size
+            vertex = vertex.children[idx]
+
+    def _find_bigger(self, vertex: ABVertex, key) -> Optional[Node]:
         """ Find the node with lowest bigger key """
-        if node.leaf:
-            for n in node.keys:
-                if key < n.key:
-                    return n
-            return None
-        else:
-            ret = None
-            for idx, n in enumerate(node.keys):
-                if key < n.key:
-                    ret = self._find_bigger(node.children[idx], key)
-                    return ret if ret is not None else node.keys[idx]
+        ret = None
+        while True:
+            idx = bisect_right(vertex.search_keys, key)
+            if idx < len(vertex.keys):
+                ret = vertex.keys[idx]
+            if vertex.leaf:
+                return ret
+            vertex = vertex.children[idx]
 
-            return self._find_bigger(node.children[len(node.children) - 1], key)
+    def _find_bigger_or_equal(self, vertex: ABVertex, key) -> Optional[Node]:
+        """ Find the node with the lowest key which is not smaller than key """
+        ret = None
+        while True:
+            idx = bisect_left(vertex.search_keys, key)
+            if idx < len(vertex.keys):
+                ret = vertex.keys[idx]
+                if vertex.search_keys[idx] == key:
+                    return ret
+            if vertex.leaf:
+                return ret
+            vertex = vertex.children[idx]
 
-    def _find_lower(self, node: ABVertex, key) -> Optional[Node]:
+    def _find_lower(self, vertex: ABVertex, key) -> Optional[Node]:
         """ Find the node with the largest smaller key """
-        if node.leaf:
-            ret = None
-            for n in node.keys:
-                if key > n.key:
-                    ret = n
-            return ret
-        else:
-            ret = None
-            for idx, n in enumerate(node.keys):
-                if key < n.key:
-                    ret = self._find_lower(node.children[idx], key)
-                    break
-            if key > node.keys[len(node.keys) - 1].key:
-                idx = len(node.children) - 1
-                ret = self._find_lower(node.children[idx], key)
-            if idx != 0:
-                return ret if ret is not None else node.keys[idx - 1]
-            else:
+        ret = None
+        while True:
+            idx = bisect_left(vertex.search_keys, key)
+            if idx > 0:
+                ret = vertex.keys[idx - 1]
+            if vertex.leaf:
                 return ret
+            vertex = vertex.children[idx]
 
     def find(self, key):
-        def _find(key, node: ABVertex) -> Optional[Node]:
-            for idx, n in enumerate(node.keys):
-                if n.key == key:
-                    return n
-                else:
-                    if n.key > key and not node.leaf:
-                        return _find(key, node.children[idx])
-
-            if node.leaf:
+        vertex = self.root
+        while True:
+            search_keys = vertex.search_keys
+            idx = bisect_left(search_keys, key)
+            if idx < len(search_keys) and search_keys[idx] == key:
+                return vertex.keys[idx]
+            if vertex.leaf:
                 return None
-            return _find(key, node.children[len(node.children) - 1])
-
-        return _find(key, self.root)
+            vertex = vertex.children[idx]
 
     def delete(self, key) -> None:
-        if self._delete(key, self.root) and len(self.root.children) > 0:
+        self._delete(key, self.root)
+        if len(self.root.keys) == 0 and not self.root.leaf:
             self.root = self.root.children[0]
 
     def _delete(self, key, vertex: ABVertex) -> bool:
         """ Delete vertex with given key, return True if vertex is underfull"""
-        underfull_vertex = False
-        key_deleted = False
-        for idx, node in enumerate(vertex.keys):
-            if node.key == key:
-                self._remove_node_from_chain(node)
-
-                if vertex.leaf:
-                    vertex.keys.remove(node)
-                    return len(vertex.keys) == self.a - 2
-                else:
-                    # if node is not leaf, then there must prev node
-                    replace_node = node.prev
-                    underfull_vertex = self._delete(replace_node.key, vertex.children[idx])
-                    self._add_node_to_chain(replace_node, replace_node.prev, replace_node.nxt)
-
-                    vertex.keys[idx] = replace_node
-                    key_deleted = True
-                break
-            if node.key > key and not vertex.leaf:
-                underfull_vertex = self._delete(key, vertex.children[idx])
-                key_deleted = True
-                break
+        idx = bisect_left(vertex.search_keys, key)
+        if idx < len(vertex.keys) and vertex.search_keys[idx] == key:
+            node = vertex.keys[idx]
+            self._remove_node_from_chain(node)
+
+            if vertex.leaf:
+                del vertex.keys[idx]
+                del vertex.search_keys[idx]
+                if self.sizes:
+                    vertex.size -= 1
+                self._update_aggregate(vertex)
+                return len(vertex.keys) == self.a - 2
+
+            # if node is not leaf, then there must prev node
+            replace_node = node.prev
+            underfull_vertex = self._delete(replace_node.key, vertex.children[idx])
+            self._add_node_to_chain(replace_node, replace_node.prev, replace_node.nxt)
 
-        if len(vertex.keys) != 0 and vertex.keys[-1].key < key and \
-                not key_deleted and not vertex.leaf:
-            idx = len(vertex.children) - 1
-            underfull_vertex = self._delete(key, vertex.children[idx])
+            vertex.keys[idx] = replace_node
+            vertex.search_keys[idx] = replace_node.key
+            if self.sizes:
+                vertex.size -= 1
+        elif vertex.leaf:
+            # key is not in tree
+            return False
+        else:
+            child = vertex.children[idx]
+            child_size = child.size if self.sizes else 0
+            underfull_vertex = self._delete(key, child)
+            if self.sizes and child.size != child_size:
+                vertex.size -= 1
 
         if underfull_vertex:
             if idx != 0:
@@ -160,6 +354,7 @@ class ABTree(ATree[Node]):
             else:
                 self._solve_underfull(vertex.children[idx], vertex.children[idx + 1], True, vertex, idx)
 
+        self._update_aggregate(vertex)
         return len(vertex.keys) == self.a - 2
 
     def _solve_underfull(self, underfull_vertex: ABVertex, neighbour_vertex: ABVertex,
@@ -170,38 +365,192 @@ class ABTree(ATree[Node]):
             if not underfull_vertex_is_left:
                 underfull_vertex, neighbour_vertex = neighbour_vertex, underfull_vertex
             underfull_vertex.keys.extend([parent_vertex.keys.pop(parent_idx), *neighbour_vertex.keys])
+            underfull_vertex.search_keys.extend([parent_vertex.search_keys.pop(parent_idx),
+                                                 *neighbour_vertex.search_keys])
             underfull_vertex.children.extend(neighbour_vertex.children)
+            if self.sizes:
+                underfull_vertex.size += neighbour_vertex.size + 1
             parent_vertex.children.pop(parent_idx + 1)
+            self._update_aggregate(underfull_vertex)
         else:
             if underfull_vertex_is_left:
+                moved_size = 1
                 underfull_vertex.keys.append(parent_vertex.keys[parent_idx])
+                underfull_vertex.search_keys.append(parent_vertex.search_keys[parent_idx])
                 if not underfull_vertex.leaf:
                     underfull_vertex.children.append(neighbour_vertex.children.pop(0))
+                    if self.sizes:
+                        moved_size += underfull_vertex.children[-1].size
                 parent_vertex.keys[parent_idx] = neighbour_vertex.keys.pop(0)
+                parent_vertex.search_keys[parent_idx] = neighbour_vertex.search_keys.pop(0)
             else:
+                moved_size = 1
                 underfull_vertex.keys.insert(0, parent_vertex.keys[parent_idx])
+                underfull_vertex.search_keys.insert(0, parent_vertex.search_keys[parent_idx])
                 if not underfull_vertex.leaf:
                     underfull_vertex.children.insert(0, neighbour_vertex.children.pop(-1))
+                    if self.sizes:
+                        moved_size += underfull_vertex.children[0].size
                 parent_vertex.keys[parent_idx] = neighbour_vertex.keys.pop(-1)
+                parent_vertex.search_keys[parent_idx] = neighbour_vertex.search_keys.pop(-1)
+            if self.sizes:
+                underfull_vertex.size += moved_size
+                neighbour_vertex.size -= moved_size
+            self._update_aggregate(underfull_vertex)
+            self._update_aggregate(neighbour_vertex)
 
-    def findmin(self):
-        def _findmin(vertex: ABVertex) -> Optional[Node]:
-            if vertex.leaf:
-                return vertex.keys[0] if len(vertex.keys) != 0 else None
+    def _settings(self) -> tuple:
+        return (self.a, self.b, self.combine, self.identity, self.sizes)
+
+    def _empty_copy(self) -> 'ABTree':
+        return type(self)(*self._settings())
+
+    def _height(self, vertex: ABVertex) -> int:
+        """ Return number of edges from vertex to leaves """
+        height = 0
+        while not vertex.leaf:
+            vertex = vertex.children[0]
+            height += 1
+        return height
+
+    def _split_root(self, key) -> Tuple[ABVertex, ABVertex]:
+        """ Vertices on search path of key are cut to parts with smaller and bigger keys
+
+        Parts are joined bottom-up with the keys separating them from the path,
+        joins cost O(b * height difference) each, which sums up to O(b log n).
+        """
+        smaller: List[Tuple[ABVertex, int, Node]] = []
+        bigger: List[Tuple[Node, ABVertex, int]] = []
+        vertex = self.root
+        height = self._height(vertex)
+        while not vertex.leaf:
+            idx = bisect_left(vertex.search_keys, key)
+            keys, children = vertex.keys, vertex.children
+            if idx > 0:
+                smaller.append((*self._part(keys[:idx - 1], children[:idx], height), keys[idx - 1]))
+            if idx < len(keys):
+                bigger.append((keys[idx], *self._part(keys[idx + 1:], children[idx + 1:], height)))
+            vertex = children[idx]
+            height -= 1
+
+        idx = bisect_left(vertex.search_keys, key)
+        left = self.vertex_class(vertex.keys[:idx], [], True)
+        right = self.vertex_class(vertex.keys[idx:], [], True)
+        self._update_aggregate(left)
+        self._update_aggregate(right)
+        left_height = right_height = 0
+        for subtree, subtree_height, node in reversed(smaller):
+            left, left_height = self._join_vertices(subtree, subtree_height, node, left, left_height)
+        for node, subtree, subtree_height in reversed(bigger):
+            right, right_height = self._join_vertices(right, right_height, node, subtree, subtree_height)
+        return left, right
+
+    def _part(self, keys: List[Node], children: List[ABVertex], height: int) -> Tuple[ABVertex, int]:
+        """ Make vertex of given height from part of vertex, return it and its height
+
+        Part without keys is its only child.
+        """
+        if not keys:
+            return children[0], height - 1
+        vertex = self.vertex_class(keys, children, False)
+        self._update_aggregate(vertex)
+        return vertex, height
+
+    def _join_roots(self, left_root: ABVertex, key, value, right_root: ABVertex) -> Node:
+        node = Node(key, value)
+        self.root, _ = self._join_vertices(left_root, self._height(left_root),
+                                           node, right_root, self._height(right_root))
+        return node
+
+    def _join_vertices(self, left: ABVertex, left_height: int, node: Node,
+                       right: ABVertex, right_height: int) -> Tuple[ABVertex, int]:
+        """ Join subtrees with node between them, return new root and its height
+
+        Lower subtree is hung next to the spine vertex of the same height in the
+        higher subtree. Subtree roots may have less than a-1 keys, such root is
+        merged with the spine vertex. Overfull vertices are split on the way up.
+        """
+        path: List[ABVertex] = []
+        height = max(left_height, right_height)
+        for _ in range(left_height - right_height):
+            path.append(left)
+            left = left.children[-1]
+        for _ in range(right_height - left_height):
+            path.append(right)
+            right = right.children[0]
+
+        # (key, left vertex, right vertex) to hang to parent, key is None if there is only one vertex
+        carry: Tuple[Optional[Node], ABVertex, Optional[ABVertex]]
+        if len(left.keys) >= self.a - 1 and len(right.keys) >= self.a - 1:
+            carry = (node, left, right)
+        else:
+            carry = self._split_overfull(self.vertex_class(left.keys + [node] + right.keys,
+                                                  left.children + right.children, left.leaf))
+
+        for vertex in reversed(path):
+            mid_node, left_vertex, right_vertex = carry
+            idx = len(vertex.keys) if left_height > right_height else 0
+            if mid_node is None:
+                vertex.children[idx] = left_vertex
             else:
-                return _findmin(vertex.children[0])
+                vertex.children[idx:idx + 1] = [left_vertex, right_vertex]  # type: ignore
+                vertex.keys.insert(idx, mid_node)
+                vertex.search_keys.insert(idx, mid_node.key)
+            if self.sizes:
+                vertex.size = len(vertex.keys) + sum(child.size for child in vertex.children)
+            carry = self._split_overfull(vertex)
+
+        mid_node, left_vertex, right_vertex = carry
+        if mid_node is None:
+            return left_vertex, height
+        root = self.vertex_class([mid_node], [left_vertex, right_vertex], False)
+        self._update_aggregate(root)
+        return root, height + 1
 
-        return _findmin(self.root)
+    def _split_overfull(self, vertex: ABVertex) -> Tuple[Optional[Node], ABVertex, Optional[ABVertex]]:
+        """ Split vertex with at least b keys, return (key, left, right) or (None, vertex, None) """
+        if len(vertex.keys) >= self.b:
+            return self._split_vertex(vertex)
+        self._update_aggregate(vertex)
+        return (None, vertex, None)
+
+    def findmin(self):
+        vertex = self.root
+        while not vertex.leaf:
+            vertex = vertex.children[0]
+        return vertex.keys[0] if len(vertex.keys) != 0 else None
 
     def findmax(self):
-        def _findmax(vertex: ABVertex) -> Optional[Node]:
-            mx_idx = len(vertex.children) - 1
+        vertex = self.root
+        while not vertex.leaf:
+            vertex = vertex.children[-1]
+        return vertex.keys[-1] if len(vertex.keys) != 0 else None
+
+    def validate(self) -> bool:
+        def _validate(vertex: ABVertex, lower, bigger, root=False) -> Tuple[int, bool]:
+            """ Return depth of leaves and validity of subtree with keys between lower and bigger """
+            keys = vertex.search_keys
+            valid = keys == [n.key for n in vertex.keys] and \
+                all(keys[i] < keys[i + 1] for i in range(len(keys) - 1)) and \
+                (lower is None or len(keys) == 0 or lower < keys[0]) and \
+                (bigger is None or len(keys) == 0 or keys[-1] < bigger) and \
+                len(keys) <= self.b - 1 and (root or len(keys) >= self.a - 1) and \
+                (not self.sizes or vertex.size == len(keys) + sum(child.size for child in vertex.children))
             if vertex.leaf:
-                return vertex.keys[mx_idx] if len(vertex.keys) != 0 else None
-            else:
-                return _findmax(vertex.children[mx_idx])
+                return (1, valid and len(vertex.children) == 0)
+            if len(vertex.children) != len(keys) + 1 or len(keys) == 0:
+                return (-1, False)
+
+            bounds = [lower, *keys, bigger]
+            depths = set()
+            for idx, child in enumerate(vertex.children):
+                depth, child_valid = _validate(child, bounds[idx], bounds[idx + 1])
+                depths.add(depth)
+                valid = valid and child_valid
+            return (depths.pop() + 1, valid and len(depths) == 0)
 
-        return _findmax(self.root)
+        _, ret = _validate(self.root, None, None, True)
+        return ret
 
     def __repr__(self):
         return self.makerepr(self.root)
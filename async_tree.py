@@ -0,0 +1,185 @@
+""" Asyncio facade of trees with request coalescing """
+
+from bisect import bisect_left
+from concurrent.futures import Executor
+from generic import ATree
+from operator import itemgetter
+from typing import AsyncIterator, List, Optional, Tuple
+import asyncio
+import time
+
+
+GET = 0
+PUT = 1
+DELETE = 2
+
+
+class LatencyHistogram:
+    """ Histogram of latencies in seconds with logarithmic buckets
+
+    Bucket i counts latencies up to base * growth**i, the last bucket counts
+    also all bigger latencies.
+    """
+    def __init__(self, base: float = 1e-6, growth: float = 1.25, buckets: int = 100):
+        self.bounds = [base * growth ** i for i in range(buckets)]
+        self.counts = [0] * buckets
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, latency: float) -> None:
+        self.counts[min(bisect_left(self.bounds, latency), len(self.counts) - 1)] += 1
+        self.count += 1
+        self.sum += latency
+
+    def percentile(self, p: float) -> Optional[float]:
+        """ Return upper bound of bucket with p-th percentile latency or None (no latency recorded) """
+        if self.count == 0:
+            return None
+        rank = max(1, -(-p * self.count // 100))
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.bounds[-1]
+
+
+class AsyncTreeStore:
+    """ Asyncio facade of tree, all methods must be called from one event loop
+
+    get, put and delete requests issued in one loop tick are coalesced to one
+    batch processed in the next tick. Requests are applied in order, every run
+    of gets between writes is answered at once in key order. put overwrites
+    value of existing key.
+
+    range with more than scan_threshold keys runs in executor (None means default
+    executor of the loop), writes wait until running scans finish. Other ranges
+    read the tree directly. Range sees the tree as it is when it is called.
+
+    latency - LatencyHistogram of every operation, measured by the caller side
+    batches - number of processed batches
+    """
+    def __init__(self, tree: ATree, scan_threshold: int = 1024, executor: Optional[Executor] = None):
+        self.tree = tree
+        self.scan_threshold = scan_threshold
+        self.executor = executor
+        self.latency = {name: LatencyHistogram() for name in ("get", "put", "delete", "range")}
+        self.batches = 0
+        # (operation, key, value, future) in order of arrival
+        self._pending: List[Tuple[int, object, object, asyncio.Future]] = []
+        self._flush_scheduled = False
+        self._scans = 0
+
+    async def get(self, key):
+        """ Return value of key or None """
+        return await self._request("get", GET, key)
+
+    async def put(self, key, value) -> None:
+        await self._request("put", PUT, key, value)
+
+    async def delete(self, key) -> None:
+        await self._request("delete", DELETE, key)
+
+    async def _request(self, name: str, operation: int, key, value=None):
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((operation, key, value, future))
+        self._schedule_flush()
+        try:
+            return await future
+        finally:
+            self.latency[name].record(time.perf_counter() - start)
+
+    def _schedule_flush(self) -> None:
+        if self._pending and not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self) -> None:
+        """ Process pending requests, stop before the first write if any scan is running """
+        self._flush_scheduled = False
+        pending, self._pending = self._pending, []
+        self.batches += 1
+        idx = 0
+        try:
+            while idx < len(pending):
+                if pending[idx][0] == GET:
+                    end = idx + 1
+                    while end < len(pending) and pending[end][0] == GET:
+                        end += 1
+                    self._get_batch(pending[idx:end])
+                    idx = end
+                elif self._scans:
+                    # scan completion schedules the rest
+                    self._pending = pending[idx:]
+                    return
+                else:
+                    self._write(*pending[idx])
+                    idx += 1
+        except Exception as e:
+            # errors of single requests are set by _get_batch and _write, this
+            # only keeps callers of the rest of the batch from waiting forever
+            for _, _, _, future in pending[idx:]:
+                if not future.done():
+                    future.set_exception(e)
+
+    def _get_batch(self, requests: List[Tuple]) -> None:
+        """ Answer gets in key order, the same key is searched only once
+
+        Keys which cannot be sorted (mixed types) are answered in order of
+        arrival. Exception of find is set only to the future of its get.
+        """
+        try:
+            requests = sorted(requests, key=itemgetter(1))
+        except Exception:
+            pass
+        # node is the result of last_key if searched is True
+        searched = False
+        last_key = node = None
+        for _, key, _, future in requests:
+            if future.done():
+                continue
+            try:
+                if not searched or key != last_key:
+                    searched = False
+                    node = self.tree.find(key)
+                    last_key, searched = key, True
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            future.set_result(None if node is None else node.value)
+
+    def _write(self, operation: int, key, value, future: asyncio.Future) -> None:
+        try:
+            if operation == PUT:
+                # delete keeps cached aggregates right, node value is not changed in place
+                if self.tree.find(key) is not None:
+                    self.tree.delete(key)
+                self.tree.insert(key, value)
+            else:
+                self.tree.delete(key)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(None)
+
+    async def range(self, lo, hi) -> AsyncIterator[Tuple]:
+        """ Yield (key, value) pairs with lo <= key < hi in increasing order """
+        start = time.perf_counter()
+        if self.tree.count_range(lo, hi) <= self.scan_threshold:
+            items = self._scan(lo, hi)
+        else:
+            self._scans += 1
+            try:
+                items = await asyncio.get_running_loop().run_in_executor(self.executor, self._scan, lo, hi)
+            finally:
+                self._scans -= 1
+                self._schedule_flush()
+        self.latency["range"].record(time.perf_counter() - start)
+        for item in items:
+            yield item
+
+    def _scan(self, lo, hi) -> List[Tuple]:
+        return [(node.key, node.value) for node in self.tree.range(lo, hi)]
@@ -1,9 +1,10 @@
-from typing import Optional, Type
+from typing import Callable, Iterable, List, Optional, Tuple
 from generic import ABinarySearchTree, BinaryNode
 
 
 class AvlNode(BinaryNode):
     """ Object extends BinaryNode specific for AvlTree """
+    __slots__ = ()
     nxt: 'AvlNode'
     prev: 'AvlNode'
 
@@ -20,87 +21,291 @@ class AvlNode(BinaryNode):
         return self.left.depth - self.right.depth
 
 
+class AggregateAvlNode(AvlNode):
+    """ AvlNode of tree with combine function
+
+    agg - values of subtree combined by tree combine function
+    """
+    __slots__ = ("agg",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.agg = self.value
+
+
+class SizedAvlNode(AvlNode):
+    """ AvlNode of tree with sizes
+
+    size - number of nodes in subtree with this node as root
+    """
+    __slots__ = ("size",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.size = 0 if self.external else 1
+
+    def update(self):
+        self.depth = max(self.left.depth, self.right.depth) + 1
+        self.size = self.left.size + self.right.size + 1
+
+
+class SizedAggregateAvlNode(SizedAvlNode):
+    """ AvlNode of tree with sizes and combine function """
+    __slots__ = ("agg",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.agg = self.value
+
+
 class AvlTree(ABinarySearchTree):
-    EXTERNAL_NODE = AvlNode(0, depth=0, external=True)
+    # external node has size 0 for trees with sizes
+    EXTERNAL_NODE = SizedAvlNode(0, depth=0, external=True)
     EXTERNAL_NODE.left = EXTERNAL_NODE
     EXTERNAL_NODE.right = EXTERNAL_NODE
 
-    def __init__(self):
+    def __init__(self, combine: Optional[Callable] = None, identity=None, sizes: bool = False):
         self.root = self.EXTERNAL_NODE
+        self.combine = combine
+        self.identity = identity
+        self.sizes = sizes
+        if sizes:
+            self.node_class = SizedAvlNode if combine is None else SizedAggregateAvlNode
+        else:
+            self.node_class = AvlNode if combine is None else AggregateAvlNode
+
+    @classmethod
+    def from_sorted(cls, pairs: Iterable[Tuple], combine: Optional[Callable] = None,
+                    identity=None, sizes: bool = False) -> 'AvlTree':
+        """ Build balanced tree from (key, value) pairs sorted by key in linear time """
+        tree = cls(combine, identity, sizes)
+        nodes = cls._sorted_nodes(
+            pairs, lambda key, value: tree.node_class(key, value, left=tree.EXTERNAL_NODE, right=tree.EXTERNAL_NODE))
+
+        def _build(lo: int, hi: int) -> AvlNode:
+            if lo == hi:
+                return tree.EXTERNAL_NODE
+            mid = (lo + hi) // 2
+            node = nodes[mid]
+            node.left = _build(lo, mid)
+            node.right = _build(mid + 1, hi)
+            tree._update(node)
+            return node
+
+        tree.root = _build(0, len(nodes))
+        return tree
+
+    def _rebuild(self, pairs: Iterable[Tuple]) -> None:
+        self.root = self.from_sorted(pairs, *self._settings()).root
 
     def insert(self, key, value) -> None:
-        self.root = self._insert(key, value, self.root)
+        self._insert_below(key, value, [], self.root)
 
-    def _insert(self, key, value, node: AvlNode) -> AvlNode:
-        if node.external:
-            new_node = AvlNode(key, value, left=self.EXTERNAL_NODE, right=self.EXTERNAL_NODE)
-            self._add_node_to_chain(new_node, self._find_lower(self.root, key),
-                                    self._find_bigger(self.root, key))
+    def _insert_below(self, key, value, path: 'List[Tuple[AvlNode, bool]]', node: AvlNode) -> None:
+        """ Insert key to subtree of node, path leads from root to node
 
-            return new_node
+        path is left with its part which was not changed by rebalancing.
+        """
+        # one comparison per level
+        while not node.external:
+            if key < node.key:
+                path.append((node, True))
+                node = node.left
+            else:
+                path.append((node, False))
+                node = node.right
 
-        if key == node.key:
+        # neighbours of the new node, lower is the last node not bigger than key
+        lower = bigger = None
+        if path:
+            parent, left = path[-1]
+            if left:
+                lower, bigger = parent.prev, parent
+            else:
+                lower, bigger = parent, parent.nxt
+        if lower is not None and lower.key == key:
             # key is alread in tree - nothing to do
-            return node
-        elif key < node.key:
-            node.left = self._insert(key, value, node.left)
+            return
+
+        new_node = self.node_class(key, value, left=self.EXTERNAL_NODE, right=self.EXTERNAL_NODE)
+        self._add_node_to_chain(new_node, lower, bigger)
+        self._rebalance_path(path, new_node)
+
+    def _insert_sorted(self, pairs: List[Tuple]) -> None:
+        """ Insert pairs with increasing keys along shared prefixes of their search paths
+
+        Search of a key starts in the deepest subtree on the search path of the
+        previous key which can hold the key, not in the root.
+        """
+        path: List[Tuple[AvlNode, bool]] = []
+        for key, value in pairs:
+            self._insert_below(key, value, path, self._climb(path, key))
+
+    def _delete_sorted(self, keys: List) -> None:
+        """ Delete sorted keys, search of a key starts like in _insert_sorted """
+        path: List[Tuple[AvlNode, bool]] = []
+        for key in keys:
+            self._delete_below(key, path, self._climb(path, key))
+
+    def _climb(self, path: 'List[Tuple[AvlNode, bool]]', key) -> AvlNode:
+        """ Cut path of a smaller key to the deepest subtree which can hold key, return its root
+
+        All keys right of the path are bigger than the smaller key, so the
+        subtree is the left child of the deepest node where path goes left and
+        whose key is bigger than key.
+        """
+        while path:
+            node, left = path[-1]
+            if left and key < node.key:
+                return node.left
+            path.pop()
+        return self.root
+
+    def delete(self, key) -> None:
+        self._delete_below(key, [], self.root)
+
+    def _delete_below(self, key, path: 'List[Tuple[AvlNode, bool]]', node: AvlNode) -> None:
+        """ Delete key from subtree of node, path leads from root to node
+
+        path is left with its part which was not changed by rebalancing.
+        """
+        candidate, candidate_depth = None, 0
+        while not node.external:
+            if key < node.key:
+                path.append((node, True))
+                node = node.left
+            else:
+                candidate, candidate_depth = node, len(path)
+                path.append((node, False))
+                node = node.right
+
+        if candidate is None or candidate.key != key:
+            return
+        node = candidate
+        del path[candidate_depth:]
+        self._remove_node_from_chain(node)
+
+        if node.left == self.EXTERNAL_NODE:
+            self._rebalance_path(path, node.right)
+        elif node.right == self.EXTERNAL_NODE:
+            self._rebalance_path(path, node.left)
         else:
-            node.right = self._insert(key, value, node.right)
+            # node is replaced by the biggest node of left subtree (node.prev)
+            replace_node = node.prev
+            node_idx = len(path)
+            path.append((replace_node, True))
+            parent = node.left
+            while parent is not replace_node:
+                path.append((parent, False))
+                parent = parent.right
+            child = replace_node.left
 
-        left_depth = node.left.depth
-        right_depth = node.right.depth
+            replace_node.left = node.left
+            replace_node.right = node.right
+            replace_node.depth = node.depth
+            if self.sizes:
+                replace_node.size = node.size
+            self._link(path[:node_idx], replace_node)
+            self._rebalance_path(path, child)
 
-        if abs(left_depth - right_depth) <= 1:
-            # everything is OK
-            pass
+    def _link(self, path: 'List[Tuple[AvlNode, bool]]', node: AvlNode) -> None:
+        """ Hang node as the child of the last node in path (or as root) """
+        if not path:
+            self.root = node
         else:
-            if left_depth > right_depth:
-                if node.left.balance == 1:
-                    node = self._rotation(node, left_rotation=False)
-                elif node.left.balance == -1:
-                    node = self._double_rotation(node, left_side=True)
-                else:
-                    # this state cannot accur
-                    pass
+            parent, left = path[-1]
+            if left:
+                parent.left = node
             else:
-                if node.right.balance == -1:
-                    node = self._rotation(node, left_rotation=True)
-                elif node.right.balance == 1:
-                    node = self._double_rotation(node, left_side=False)
-                else:
-                    # this state cannot accur
-                    pass
+                parent.right = node
 
-        node.update()
-        return node
+    def _rebalance_path(self, path: 'List[Tuple[AvlNode, bool]]', node: AvlNode) -> None:
+        """ Hang node in place of the subtree at the end of path and rebalance path bottom-up
 
-    def delete(self, key) -> None:
-        self.root = self._delete(key, self.root)
+        path - list of (node, went_left) from root, where went_left says which child
+        of node is on the path
+        Rebalancing stops as soon as a subtree keeps its root and depth, only sizes
+        and aggregates change above (if tree has any).
+        """
+        while path:
+            parent, left = path.pop()
+            old_depth = parent.depth
+            if left:
+                parent.left = node
+            else:
+                parent.right = node
 
-    def _delete(self, key, node: AvlNode) -> AvlNode:
-        if node.external:
-            return node
-        if node.key == key:
-            self._remove_node_from_chain(node)
+            node = self._rebalance(parent)
+            if node is parent and node.depth == old_depth:
+                if self.sizes or self.combine is not None:
+                    for parent, _ in reversed(path):
+                        self._update(parent)
+                return
 
-            if node.left == self.EXTERNAL_NODE:
-                return node.right
-            elif node.right == self.EXTERNAL_NODE:
-                return node.left
+        self.root = node
+
+    def _settings(self) -> tuple:
+        return (self.combine, self.identity, self.sizes)
+
+    def _empty_copy(self) -> 'AvlTree':
+        return type(self)(*self._settings())
+
+    def _split_root(self, key) -> Tuple[AvlNode, AvlNode]:
+        """ Nodes on search path of key are joined bottom-up with their subtrees off the path
+
+        Joins cost O(depth difference) each, which sums up to O(log n).
+        """
+        smaller: List[Tuple[AvlNode, AvlNode]] = []
+        bigger: List[Tuple[AvlNode, AvlNode]] = []
+        node = self.root
+        while not node.external:
+            if node.key < key:
+                smaller.append((node, node.left))
+                node = node.right
             else:
-                replace_node = node.prev
-                node.left = self._delete(replace_node.key, node.left)
+                bigger.append((node, node.right))
+                node = node.left
 
-                self._add_node_to_chain(replace_node, replace_node.prev, replace_node.nxt)
-                replace_node.left = node.left
-                replace_node.right = node.right
-                node = replace_node
+        left = right = self.EXTERNAL_NODE
+        for node, subtree in reversed(smaller):
+            left = self._join_nodes(subtree, node, left)
+        for node, subtree in reversed(bigger):
+            right = self._join_nodes(right, node, subtree)
+        return left, right
 
-        elif node.key > key:
-            node.left = self._delete(key, node.left)
-        else:
-            node.right = self._delete(key, node.right)
+    def _join_roots(self, left_root: AvlNode, key, value, right_root: AvlNode) -> AvlNode:
+        node = self.node_class(key, value)
+        self.root = self._join_nodes(left_root, node, right_root)
+        return node
+
+    def _join_nodes(self, left: AvlNode, node: AvlNode, right: AvlNode) -> AvlNode:
+        """ Join subtrees with node between them, return new root of subtree
 
+        Node is hung on the spine of the deeper subtree at the depth of the other one
+        and the spine is rebalanced bottom-up.
+        """
+        path: List[Tuple[AvlNode, bool]] = []
+        if left.depth > right.depth + 1:
+            while left.depth > right.depth + 1:
+                path.append((left, False))
+                left = left.right
+        elif right.depth > left.depth + 1:
+            while right.depth > left.depth + 1:
+                path.append((right, True))
+                right = right.left
+
+        node.left, node.right = left, right
+        self._update(node)
+        for parent, went_left in reversed(path):
+            if went_left:
+                parent.left = node
+            else:
+                parent.right = node
+            node = self._rebalance(parent)
+        return node
+
+    def _rebalance(self, node: AvlNode) -> AvlNode:
+        """ Fix balance of node with balanced subtrees, return new root of subtree """
         left_depth = node.left.depth
         right_depth = node.right.depth
         if abs(left_depth - right_depth) <= 1:
@@ -118,9 +323,15 @@ class AvlTree(ABinarySearchTree):
                 else:
                     node = self._double_rotation(node, left_side=False)
 
-        node.update()
+        self._update(node)
         return node
 
+    def _update(self, node: AvlNode) -> None:
+        """ Update depth, size and aggregate of node from its children """
+        node.update()
+        if self.combine is not None:
+            self._update_aggregate(node)
+
     def _rotation(self, subtree_root: AvlNode, left_rotation=True) -> AvlNode:
         """Makes single rotation, update node depth, return new root of subtree"""
         if left_rotation:
@@ -128,8 +339,8 @@ class AvlTree(ABinarySearchTree):
             subtree_root.right = right_node.left
             right_node.left = subtree_root
 
-            subtree_root.update()
-            right_node.update()
+            self._update(subtree_root)
+            self._update(right_node)
 
             return right_node
         else:
@@ -137,8 +348,8 @@ class AvlTree(ABinarySearchTree):
             subtree_root.left = left_node.right
             left_node.right = subtree_root
 
-            subtree_root.update()
-            left_node.update()
+            self._update(subtree_root)
+            self._update(left_node)
 
             return left_node
 
@@ -150,3 +361,12 @@ class AvlTree(ABinarySearchTree):
         else:
             subtree_root.right = self._rotation(subtree_root.right, left_rotation=False)
             return self._rotation(subtree_root)
+
+    def validate(self) -> bool:
+        def _validate(node: AvlNode) -> bool:
+            if node.external:
+                return True
+            return node.depth == max(node.left.depth, node.right.depth) + 1 and \
+                (not self.sizes or node.size == node.left.size + node.right.size + 1) and \
+                abs(node.balance) <= 1 and _validate(node.left) and _validate(node.right)
+        return self.EXTERNAL_NODE.depth == 0 and _validate(self.root)
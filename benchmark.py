@@ -0,0 +1,1106 @@
+#!/usr/bin/env python3
+""" Benchmarks for tree structures
+
+Every benchmark is one subcommand, run `./benchmark.py --help` for list.
+Benchmarks which replay operations use pregenerated tests from `dataset`
+directory (see `dataset/genTests.py`).
+"""
+
+from ab_tree import ABTree
+from async_tree import AsyncTreeStore
+from cache import CachedTree
+from concurrent_tree import ConcurrentTree
+from finger import FingerTree
+from avl import AvlTree, AvlNode
+from bplus_tree import BPlusTree
+from functools import partial
+from operator import add
+from persistent import PersistentAvlTree, PersistentRBTree
+from pooled_avl import PooledAvlTree
+from rb_tree import RBTree
+from sharded import ShardedTree
+import argparse
+import asyncio
+import avl
+import gc
+import json
+import os
+import platform
+import random
+import replay
+import snapshot
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import wal
+
+
+TREES = {
+    "avl": lambda: AvlTree(),
+    "rb": lambda: RBTree(),
+    "ab(2,4)": lambda: ABTree(2, 4),
+}
+
+
+class CountingKey:
+    """ Key wrapper which counts every comparison made on keys """
+    comparisons = 0
+
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        CountingKey.comparisons += 1
+        return self.key == other.key
+
+    def __lt__(self, other):
+        CountingKey.comparisons += 1
+        return self.key < other.key
+
+    def __gt__(self, other):
+        CountingKey.comparisons += 1
+        return self.key > other.key
+
+    def __le__(self, other):
+        CountingKey.comparisons += 1
+        return self.key <= other.key
+
+    def __ge__(self, other):
+        CountingKey.comparisons += 1
+        return self.key >= other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return repr(self.key)
+
+
+def load_operations(test_num):
+    """ Return list of (operation, key) pairs from `dataset/test<test_num>.in` """
+    operations = []
+    with open(f"dataset/test{test_num}.in", "r") as fin:
+        num_operations = int(fin.readline())
+        for _ in range(num_operations):
+            _input = fin.readline().split()
+            if len(_input) == 1:
+                _input.append("0")
+            operation, key = map(int, _input)
+            operations.append((operation, key))
+    return operations
+
+
+def bench_insert_comparisons(args):
+    """ Count key comparisons per insert
+
+    `descent` is the comparison count of the current insert, `legacy` adds
+    comparisons of `_find_lower` and `_find_bigger` searches from the root,
+    which insert did before predecessor and successor were taken from the path.
+    """
+    print(f"{'test':>6} {'tree':>8} {'inserts':>8} {'descent':>9} {'legacy':>9}")
+    for test_num in args.tests:
+        operations = load_operations(test_num)
+        for name, make_tree in TREES.items():
+            tree = make_tree()
+            inserts = descent = searches = 0
+            for operation, key in operations:
+                key = CountingKey(key)
+                if operation == 0:
+                    CountingKey.comparisons = 0
+                    tree._find_lower(tree.root, key)
+                    tree._find_bigger(tree.root, key)
+                    searches += CountingKey.comparisons
+
+                    CountingKey.comparisons = 0
+                    tree.insert(key, key)
+                    descent += CountingKey.comparisons
+                    inserts += 1
+                elif operation == 1:
+                    tree.find(key)
+                elif operation == 2:
+                    tree.delete(key)
+
+            print(f"{test_num:>6} {name:>8} {inserts:>8} "
+                  f"{descent / inserts:>9.2f} {(descent + searches) / inserts:>9.2f}")
+
+
+def bench_operations(args):
+    """ Measure time per insert, find and delete of random keys """
+    print(f"{'keys':>9} {'tree':>8} {'insert us':>10} {'find us':>10} {'delete us':>10}")
+    for size in args.sizes:
+        keys = random.Random(args.seed).sample(range(size * 4), size)
+        for name, make_tree in TREES.items():
+            tree = make_tree()
+            times = []
+
+            start = time.perf_counter()
+            for key in keys:
+                tree.insert(key, key)
+            times.append(time.perf_counter() - start)
+
+            for operation in (tree.find, tree.delete):
+                start = time.perf_counter()
+                for key in keys:
+                    operation(key)
+                times.append(time.perf_counter() - start)
+            times = [t / size * 1e6 for t in times]
+
+            print(f"{size:>9} {name:>8} " + ' '.join(f"{t:>10.2f}" for t in times))
+
+
+def bench_ab_sweep(args):
+    """ Measure insert, find and delete throughput of ABTree for growing (a, b) """
+    keys = random.Random(args.seed).sample(range(args.size * 4), args.size)
+    print(f"{'(a, b)':>10} {'insert op/s':>12} {'find op/s':>12} {'delete op/s':>12}")
+    a = 2
+    while a <= args.max_a:
+        tree = ABTree(a, 2 * a)
+        times = []
+
+        start = time.perf_counter()
+        for key in keys:
+            tree.insert(key, key)
+        times.append(time.perf_counter() - start)
+
+        for operation in (tree.find, tree.delete):
+            start = time.perf_counter()
+            for key in keys:
+                operation(key)
+            times.append(time.perf_counter() - start)
+
+        print(f"{f'({a}, {2 * a})':>10} " + ' '.join(f"{args.size / t:>12.0f}" for t in times))
+        a *= 2
+
+
+def bench_batch(args):
+    """ Compare insert_many/delete_many with loop of single operations
+
+    The tree has --size keys, batches have size --size * ratio. Garbage of the
+    previous run is collected before every run, the fastest of --repeats runs
+    is reported.
+    """
+    print(f"{'tree':>8} {'ratio':>6} {'loop ins s':>11} {'batch ins s':>12} "
+          f"{'loop del s':>11} {'batch del s':>12}")
+    rnd = random.Random(args.seed)
+    for name, make_tree in TREES.items():
+        for ratio in args.ratios:
+            batch_size = max(1, int(args.size * ratio))
+            keys = rnd.sample(range((args.size + batch_size) * 4), args.size + batch_size)
+            tree_pairs = sorted((key, key) for key in keys[:args.size])
+            batch = [(key, key) for key in keys[args.size:]]
+
+            times = [float("inf")] * 4
+            for _ in range(args.repeats):
+                for use_batch in (False, True):
+                    tree = make_tree()
+                    tree._rebuild(tree_pairs)
+                    gc.collect()
+                    start = time.perf_counter()
+                    if use_batch:
+                        tree.insert_many(batch)
+                    else:
+                        for key, value in batch:
+                            tree.insert(key, value)
+                    insert_time = time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    if use_batch:
+                        tree.delete_many(key for key, _ in batch)
+                    else:
+                        for key, _ in batch:
+                            tree.delete(key)
+                    delete_time = time.perf_counter() - start
+                    times[2 * use_batch] = min(times[2 * use_batch], insert_time)
+                    times[2 * use_batch + 1] = min(times[2 * use_batch + 1], delete_time)
+
+            print(f"{name:>8} {ratio:>6} {times[0]:>11.3f} {times[2]:>12.3f} "
+                  f"{times[1]:>11.3f} {times[3]:>12.3f}")
+
+
+def bench_bplus(args):
+    """ Compare BPlusTree with ABTree of the same (a, b) on point and range workloads
+
+    Point: ops/s of insert, find and delete of random keys. Range: keys/s of
+    --queries scans of --scan keys walked by `range` nodes, BPlusTree also by `items`.
+    """
+    rnd = random.Random(args.seed)
+    keys = rnd.sample(range(args.size * 4), args.size)
+    starts = [rnd.randrange(args.size * 4) for _ in range(args.queries)]
+    width = args.scan * 4
+
+    print(f"{'tree':>14} {'insert op/s':>12} {'find op/s':>12} {'delete op/s':>12} "
+          f"{'range key/s':>12} {'items key/s':>12}")
+    for a, b in args.ab:
+        for name, tree_class in (("ab", ABTree), ("b+", BPlusTree)):
+            tree = tree_class(a, b)
+            times = []
+            start = time.perf_counter()
+            for key in keys:
+                tree.insert(key, key)
+            times.append(args.size / (time.perf_counter() - start))
+            start = time.perf_counter()
+            for key in keys:
+                tree.find(key)
+            times.append(args.size / (time.perf_counter() - start))
+
+            scans = [("range", tree.range)] + ([("items", tree.items)] if tree_class is BPlusTree else [])
+            scan_times = {}
+            for scan_name, scan in scans:
+                walked = 0
+                start = time.perf_counter()
+                for lo in starts:
+                    for _ in scan(lo, lo + width):
+                        walked += 1
+                scan_times[scan_name] = walked / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for key in keys:
+                tree.delete(key)
+            times.append(args.size / (time.perf_counter() - start))
+            scan_columns = ' '.join(f"{scan_times[scan_name]:>12.0f}" if scan_name in scan_times else f"{'-':>12}"
+                                    for scan_name in ("range", "items"))
+            print(f"{f'{name}({a},{b})':>14} " + ' '.join(f"{t:>12.0f}" for t in times) + f" {scan_columns}")
+
+
+def bench_find_many(args):
+    """ Compare loop of single finds with one find_many of NumpyBPlusTree (needs numpy)
+
+    --size keys are searched in tree of --size keys, half of them are missing.
+    Sorted batch skips the argsort of find_many.
+    """
+    import numpy as np
+    from numpy_tree import NumpyBPlusTree
+
+    rnd = random.Random(args.seed)
+    keys = sorted(rnd.sample(range(args.size * 2), args.size))
+    queries = np.array([rnd.randrange(args.size * 2) for _ in range(args.size)], dtype=np.int64)
+    sorted_queries = np.sort(queries)
+
+    print(f"{'tree':>14} {'find op/s':>12} {'many op/s':>12} {'sorted op/s':>12} {'speedup':>8}")
+    for a, b in args.ab:
+        tree = NumpyBPlusTree.from_sorted(((key, key) for key in keys), a, b)
+        find = tree.find
+        start = time.perf_counter()
+        for key in queries.tolist():
+            find(key)
+        single = args.size / (time.perf_counter() - start)
+        start = time.perf_counter()
+        tree.find_many(queries)
+        many = args.size / (time.perf_counter() - start)
+        start = time.perf_counter()
+        tree.find_many(sorted_queries)
+        many_sorted = args.size / (time.perf_counter() - start)
+        print(f"{f'numpy({a},{b})':>14} {single:>12.0f} {many:>12.0f} {many_sorted:>12.0f} {many / single:>8.1f}")
+
+
+def bench_cache(args):
+    """ Compare finds of plain trees and CachedTree on suite zipfian workload
+
+    find - only zipfian finds, mixed - every --write-every find is followed by
+    insert and delete of random keys (cache entries are invalidated).
+    """
+    rnd = random.Random(args.seed)
+    inserts, finds, _ = suite_workload("zipfian", args.size, rnd)
+    writes = [rnd.randrange(args.size * 2) for _ in range(len(finds) // args.write_every + 1)]
+    trees = {"avl": AvlTree, "rb": RBTree, "ab(16,32)": lambda: ABTree(16, 32), "b+(16,32)": lambda: BPlusTree(16, 32)}
+    caches = [("-", 0)] + [(policy, size) for policy in ("lru", "clock") for size in args.cache_sizes]
+
+    print(f"{'tree':>10} {'cache':>6} {'size':>6} {'find op/s':>12} {'mixed op/s':>12} {'hit ratio':>10}")
+    for tree_name, make_tree in trees.items():
+        for policy, size in caches:
+            results = []
+            for mixed in (False, True):
+                tree = make_tree()
+                for key in inserts:
+                    tree.insert(key, key)
+                if size:
+                    tree = CachedTree(tree, size, policy)
+                find, insert, delete = tree.find, tree.insert, tree.delete
+                start = time.perf_counter()
+                if mixed:
+                    for idx, key in enumerate(finds):
+                        find(key)
+                        if idx % args.write_every == 0:
+                            key = writes[idx // args.write_every]
+                            insert(key, key)
+                            delete(key + 1)
+                else:
+                    for key in finds:
+                        find(key)
+                results.append(len(finds) / (time.perf_counter() - start))
+                if not mixed:
+                    hit_ratio = f"{tree.hit_ratio:.3f}" if size else "-"
+            print(f"{tree_name:>10} {policy:>6} {size:>6} {results[0]:>12.0f} {results[1]:>12.0f} {hit_ratio:>10}")
+
+
+def bench_finger(args):
+    """ Compare finds and inserts from the root with FingerTree on streams of keys
+
+    sequential - increasing keys, near - random walk with steps up to --step keys,
+    random - random keys. Tree holds even keys, so half of searched keys are
+    missing and half of inserted keys are new.
+    """
+    rnd = random.Random(args.seed)
+    streams = {"sequential": list(range(args.size * 2))}
+    position, near = args.size, []
+    for _ in range(args.size * 2):
+        position = min(args.size * 2 - 1, max(0, position + rnd.randint(-args.step, args.step)))
+        near.append(position)
+    streams["near"] = near
+    streams["random"] = [rnd.randrange(args.size * 2) for _ in range(args.size * 2)]
+    pairs = [(x, x) for x in range(0, args.size * 2, 2)]
+    trees = {
+        "avl": lambda: AvlTree.from_sorted(pairs),
+        "rb": lambda: RBTree.from_sorted(pairs),
+        "ab(16,32)": lambda: ABTree.from_sorted(pairs, 16, 32),
+    }
+
+    print(f"{'stream':>10} {'tree':>10} {'op':>7} {'tree op/s':>12} {'finger op/s':>12} {'speedup':>8}")
+    for stream, keys in streams.items():
+        for tree_name, make_tree in trees.items():
+            for op in ("find", "insert"):
+                times = []
+                for wrap in (lambda tree: tree, FingerTree):
+                    best = float("inf")
+                    for _ in range(args.repeats):
+                        tree = wrap(make_tree())
+                        operation = getattr(tree, op)
+                        gc.collect()
+                        if op == "find":
+                            start = time.perf_counter()
+                            for key in keys:
+                                operation(key)
+                        else:
+                            start = time.perf_counter()
+                            for key in keys:
+                                operation(key, key)
+                        best = min(best, time.perf_counter() - start)
+                    times.append(len(keys) / best)
+                print(f"{stream:>10} {tree_name:>10} {op:>7} {times[0]:>12.0f} {times[1]:>12.0f} "
+                      f"{times[1] / times[0]:>8.2f}")
+
+
+def _find_two_comparisons(tree, key):
+    """ Search of binary tree comparing == and then < on every level, as trees did before """
+    node = tree.root
+    while not node.external:
+        if node.key == key:
+            return node
+        node = node.left if key < node.key else node.right
+    return None
+
+
+def bench_keys(args):
+    """ Compare find with one comparison per level against == and < per level for int, str and tuple keys
+
+    str keys share a long prefix and tuple keys have few distinct first fields,
+    so their comparisons are slow.
+    """
+    rnd = random.Random(args.seed)
+    numbers = rnd.sample(range(args.size * 4), args.size)
+    workloads = {
+        "int": [x for x in numbers],
+        "str": [f"customer/eu-west/{x:012d}" for x in numbers],
+        "tuple": [(x % 4, x // 4 % 16, x) for x in numbers],
+    }
+    trees = {"avl": AvlTree, "rb": RBTree}
+
+    print(f"{'keys':>6} {'tree':>6} {'two cmp op/s':>13} {'one cmp op/s':>13} {'speedup':>8}")
+    for name, keys in workloads.items():
+        queries = keys[:]
+        rnd.shuffle(queries)
+        for tree_name, make_tree in trees.items():
+            tree = make_tree()
+            for key in keys:
+                tree.insert(key, None)
+            gc.collect()
+            best = [float("inf"), float("inf")]
+            for _ in range(args.repeats):
+                # both searches alternate, so noise hits them alike
+                for idx, find in enumerate((partial(_find_two_comparisons, tree), tree.find)):
+                    start = time.perf_counter()
+                    for key in queries:
+                        find(key)
+                    best[idx] = min(best[idx], time.perf_counter() - start)
+            times = [args.size / elapsed for elapsed in best]
+            print(f"{name:>6} {tree_name:>6} {times[0]:>13.0f} {times[1]:>13.0f} {times[1] / times[0]:>8.2f}")
+
+
+def bench_aggregate(args):
+    """ Compare aggregate (sum of values) with walk along the chain for growing windows """
+    trees = {
+        "avl": AvlTree.from_sorted(((x, x) for x in range(args.size)), add, 0),
+        "rb": RBTree.from_sorted(((x, x) for x in range(args.size)), add, 0),
+        "ab(2,4)": ABTree.from_sorted(((x, x) for x in range(args.size)), 2, 4, combine=add, identity=0),
+    }
+    rnd = random.Random(args.seed)
+    print(f"{'tree':>8} {'window':>9} {'aggregate us':>13} {'chain walk us':>14}")
+    for name, tree in trees.items():
+        window = 10
+        while window <= args.size:
+            starts = [rnd.randint(0, args.size - window) for _ in range(args.queries)]
+            start = time.perf_counter()
+            for lo in starts:
+                tree.aggregate(lo, lo + window)
+            aggregate_time = time.perf_counter() - start
+
+            walks = max(1, min(args.queries, args.queries * 1000 // window))
+            start = time.perf_counter()
+            for lo in starts[:walks]:
+                sum(node.value for node in tree.range(lo, lo + window))
+            walk_time = time.perf_counter() - start
+
+            print(f"{name:>8} {window:>9} {aggregate_time / args.queries * 1e6:>13.2f} "
+                  f"{walk_time / walks * 1e6:>14.2f}")
+            window *= 10
+
+
+class DictAvlNode(AvlNode):
+    """ AvlNode with per-instance __dict__ like nodes without __slots__ """
+
+
+def bench_memory(args):
+    """ Measure memory per key of AvlTree node layouts with tracemalloc
+
+    dict - node objects with __dict__, slots - AvlNode, sizes - SizedAvlNode,
+    pooled - PooledAvlTree.
+    Memory of keys is not counted, they are allocated before measurement.
+    """
+    print(f"{'keys':>9} {'layout':>8} {'bytes/key':>10}")
+    for size in args.sizes:
+        keys = random.Random(args.seed).sample(range(size * 4), size)
+        for layout in ("dict", "slots", "sizes", "pooled"):
+            if layout == "dict":
+                avl.AvlNode = DictAvlNode  # type: ignore[misc]
+            tracemalloc.start()
+            try:
+                if layout == "pooled":
+                    tree = PooledAvlTree()
+                else:
+                    tree = AvlTree(sizes=layout == "sizes")
+                for key in keys:
+                    tree.insert(key, key)
+                memory, _ = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+                avl.AvlNode = AvlNode  # type: ignore[misc]
+            del tree
+
+            print(f"{size:>9} {layout:>8} {memory / size:>10.1f}")
+
+
+def bench_snapshot(args):
+    """ Compare warm restart by replaying inserts with snapshot load and memory mapping
+
+    mmap is time to open MappedTree and find every key.
+    """
+    keys = random.Random(args.seed).sample(range(args.size * 4), args.size)
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    print(f"{'tree':>8} {'replay s':>9} {'save s':>9} {'load s':>9} {'mmap s':>9} {'MB':>7}")
+    try:
+        for name, make_tree in TREES.items():
+            times = []
+            start = time.perf_counter()
+            tree = make_tree()
+            for key in keys:
+                tree.insert(key, key)
+            times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            snapshot.save(tree, path)
+            times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            snapshot.load(path)
+            times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            with snapshot.MappedTree(path) as mapped:
+                for key in keys:
+                    mapped.find(key)
+            times.append(time.perf_counter() - start)
+
+            print(f"{name:>8} " + ' '.join(f"{t:>9.3f}" for t in times) +
+                  f" {os.path.getsize(path) / 2**20:>7.1f}")
+    finally:
+        os.remove(path)
+
+
+def bench_wal(args):
+    """ Measure inserts and deletes per second with write-ahead log
+
+    off - tree without log, no fsync - log flushed to OS only,
+    group N - fsync once per N records.
+    """
+    keys = random.Random(args.seed).sample(range(args.size * 4), args.size)
+    setups = [("off", None), ("no fsync", dict(fsync=False))]
+    setups += [(f"group {size}", dict(group_size=size, group_window=1.0)) for size in args.groups]
+    print(f"{'log':>10} {'op/s':>10} {'syncs':>7}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, options in setups:
+            path = os.path.join(directory, f"{name}.log")
+            tree = AvlTree() if options is None else wal.WalTree(AvlTree(), path, **options)
+            start = time.perf_counter()
+            for key in keys:
+                tree.insert(key, key)
+            for key in keys[::2]:
+                tree.delete(key)
+            if options is not None:
+                tree.close()
+            elapsed = time.perf_counter() - start
+            syncs = tree.syncs if options is not None else 0
+            print(f"{name:>10} {len(keys) * 1.5 / elapsed:>10.0f} {syncs:>7}")
+
+
+def bench_concurrent(args):
+    """ Measure finds and writes per second of ConcurrentTree with one writer and growing readers
+
+    locked - AvlTree behind reader-writer lock, snapshot - PersistentAvlTree without read lock.
+    """
+    print(f"{'mode':>9} {'readers':>8} {'find/s':>10} {'write/s':>10}")
+    for mode in ("locked", "snapshot"):
+        for readers in args.readers:
+            pairs = [(x, x) for x in range(0, args.size * 2, 2)]
+            if mode == "snapshot":
+                version = PersistentAvlTree()
+                for key, value in pairs:
+                    version = version.insert(key, value)
+                tree = ConcurrentTree(version, snapshot_reads=True)
+            else:
+                tree = ConcurrentTree(AvlTree.from_sorted(pairs))
+            done = threading.Event()
+            counts = [0] * (readers + 1)
+
+            def writer():
+                rnd = random.Random(args.seed)
+                while not done.is_set():
+                    key = rnd.randrange(args.size * 2)
+                    if key % 2:
+                        tree.insert(key, key)
+                    else:
+                        tree.delete(key + 1)
+                    counts[0] += 1
+
+            def reader(idx):
+                rnd = random.Random(args.seed + idx)
+                while not done.is_set():
+                    tree.find(rnd.randrange(args.size * 2))
+                    counts[idx] += 1
+
+            threads = [threading.Thread(target=writer)]
+            threads += [threading.Thread(target=reader, args=(idx,)) for idx in range(1, readers + 1)]
+            for thread in threads:
+                thread.start()
+            time.sleep(args.duration)
+            done.set()
+            for thread in threads:
+                thread.join()
+
+            print(f"{mode:>9} {readers:>8} {sum(counts[1:]) / args.duration:>10.0f} "
+                  f"{counts[0] / args.duration:>10.0f}")
+
+
+def bench_persistent(args):
+    """ Measure memory per version and operation latency of persistent trees
+
+    version - memory of new version made by one insert into tree with --size keys,
+    copy - memory of AvlTree copy built by from_sorted, what a version costs without sharing.
+    """
+    rnd = random.Random(args.seed)
+    keys = rnd.sample(range(args.size * 4), args.size)
+    print(f"{'tree':>8} {'version B':>10} {'copy B':>10} {'insert us':>10} {'find us':>10} {'delete us':>10}")
+    for name, make_tree, make_mutable in [("avl", PersistentAvlTree, AvlTree), ("rb", PersistentRBTree, RBTree)]:
+        tree = make_tree()
+        times = []
+        start = time.perf_counter()
+        for key in keys:
+            tree = tree.insert(key, key)
+        times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for key in keys:
+            tree.find(key)
+        times.append(time.perf_counter() - start)
+
+        versions = []
+        new_keys = rnd.sample(range(args.size * 4, args.size * 8), args.versions)
+        tracemalloc.start()
+        try:
+            for key in new_keys:
+                versions.append(tree.insert(key, key))
+            version_memory, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            start_memory, _ = tracemalloc.get_traced_memory()
+            copy = make_mutable.from_sorted((node.key, node.value) for node in tree)
+            copy_memory = tracemalloc.get_traced_memory()[0] - start_memory
+        finally:
+            tracemalloc.stop()
+        del versions, copy
+
+        start = time.perf_counter()
+        for key in keys:
+            tree = tree.delete(key)
+        times.append(time.perf_counter() - start)
+
+        print(f"{name:>8} {version_memory / args.versions:>10.0f} {copy_memory:>10.0f} " +
+              ' '.join(f"{t / args.size * 1e6:>10.2f}" for t in times))
+
+
+def bench_async(args):
+    """ Measure p50/p99 latency of AsyncTreeStore under synthetic load
+
+    --clients tasks send requests in a loop: 70 % get, 25 % put, 4 % short
+    range and 1 % long range (run in executor).
+    """
+    async def client(store, seed):
+        rnd = random.Random(seed)
+        for _ in range(args.requests):
+            key = rnd.randrange(args.size * 2)
+            choice = rnd.random()
+            if choice < 0.7:
+                await store.get(key)
+            elif choice < 0.95:
+                await store.put(key, key)
+            elif choice < 0.99:
+                async for _ in store.range(key, key + 100):
+                    pass
+            else:
+                async for _ in store.range(key, key + args.scan_threshold * 16):
+                    pass
+
+    async def run(make_tree):
+        store = AsyncTreeStore(make_tree(), scan_threshold=args.scan_threshold)
+        store.tree._rebuild((x, x) for x in range(0, args.size * 2, 2))
+        start = time.perf_counter()
+        await asyncio.gather(*(client(store, args.seed + idx) for idx in range(args.clients)))
+        return store, time.perf_counter() - start
+
+    print(f"{'tree':>8} {'op':>7} {'count':>8} {'p50 us':>9} {'p99 us':>9} {'req/s':>9}")
+    for name, make_tree in TREES.items():
+        store, elapsed = asyncio.run(run(make_tree))
+        for op, histogram in store.latency.items():
+            if histogram.count:
+                print(f"{name:>8} {op:>7} {histogram.count:>8} {histogram.percentile(50) * 1e6:>9.1f} "
+                      f"{histogram.percentile(99) * 1e6:>9.1f} {histogram.count / elapsed:>9.0f}")
+        print(f"{name:>8} batches {store.batches:>8}")
+
+
+def bench_sharded(args):
+    """ Measure ShardedTree throughput for growing number of workers
+
+    Inserts, finds and deletes of `dataset/test<test>.in` are sent in batches of
+    --batch operations. The first half warms the shards up and they are
+    rebalanced, the second half is timed. Speedup needs one CPU per worker.
+    """
+    operations = [(operation, key, key) for operation, key in load_operations(args.test) if operation < 3]
+    warmup, timed = operations[:len(operations) // 2], operations[len(operations) // 2:]
+    trees = {"avl": (AvlTree, ()), "rb": (RBTree, ()), "ab(2,4)": (ABTree, (2, 4))}
+
+    print(f"{'tree':>8} {'workers':>8} {'ops/s':>10} {'speedup':>8}")
+    for name, (tree_class, tree_args) in trees.items():
+        base = None
+        for workers in args.workers:
+            with ShardedTree(workers, tree_class, tree_args, rebalance_every=len(operations)) as tree:
+                for idx in range(0, len(warmup), args.batch):
+                    tree.apply(warmup[idx:idx + args.batch])
+                tree.rebalance()
+
+                start = time.perf_counter()
+                for idx in range(0, len(timed), args.batch):
+                    tree.apply(timed[idx:idx + args.batch])
+                throughput = len(timed) / (time.perf_counter() - start)
+            base = base or throughput
+            print(f"{name:>8} {workers:>8} {throughput:>10.0f} {throughput / base:>8.2f}")
+
+
+def bench_replay(args):
+    """ Compare replay of text test with replay of its binary version
+
+    text - `load_operations` parsing plus applying the operations, binary -
+    `replay.replay` reading chunks, parse - time of parsing only.
+    The binary file is converted from the text test if it does not exist.
+    """
+    text_path, binary_path = f"dataset/test{args.test}.in", f"dataset/test{args.test}.ops"
+    if not os.path.exists(binary_path):
+        replay.convert_text(text_path, binary_path)
+
+    print(f"{'tree':>8} {'parse s':>9} {'text s':>9} {'binary s':>9}")
+    for name, make_tree in TREES.items():
+        start = time.perf_counter()
+        operations = load_operations(args.test)
+        parse = time.perf_counter() - start
+        tree = make_tree()
+        for operation, key in operations:
+            if operation == 0:
+                tree.insert(key, key)
+            elif operation == 1:
+                tree.find(key)
+            elif operation == 2:
+                tree.delete(key)
+            else:
+                node = tree.findmin() if operation == 3 else tree.findmax()
+                while node is not None:
+                    node = node.nxt if operation == 3 else node.prev
+        text = time.perf_counter() - start
+
+        start = time.perf_counter()
+        replay.replay(make_tree(), binary_path)
+        binary = time.perf_counter() - start
+        print(f"{name:>8} {parse:>9.3f} {text:>9.3f} {binary:>9.3f}")
+
+
+STREAMS = ("sequential", "random", "zipfian", "adversarial")
+
+
+def suite_workload(stream, size, rnd):
+    """ Return (inserts, finds, deletes) key lists of one suite workload
+
+    sequential - increasing keys
+    random - keys, finds and deletes in random order
+    zipfian - random inserts and deletes, finds hit key of popularity rank r
+        with probability proportional to 1 / r
+    adversarial - inserts alternate the smallest and the biggest key (both spines
+        of the tree are rebalanced), finds go deepest first, deletes in increasing
+        order (minimum of the tree is always deleted)
+    """
+    keys = list(range(0, size * 2, 2))
+    if stream == "sequential":
+        return keys, keys, keys
+    if stream == "adversarial":
+        zigzag = [keys[idx // 2] if idx % 2 == 0 else keys[-1 - idx // 2] for idx in range(size)]
+        return zigzag, zigzag[::-1], keys
+
+    inserts = keys[:]
+    rnd.shuffle(inserts)
+    if stream == "random":
+        finds, deletes = keys[:], keys[:]
+        rnd.shuffle(finds)
+        rnd.shuffle(deletes)
+        return inserts, finds, deletes
+    if stream == "zipfian":
+        cum_weights, total = [], 0.0
+        for rank in range(1, size + 1):
+            total += 1 / rank
+            cum_weights.append(total)
+        # inserts are shuffled, so popularity does not depend on key order
+        finds = rnd.choices(inserts, cum_weights=cum_weights, k=size)
+        deletes = keys[:]
+        rnd.shuffle(deletes)
+        return inserts, finds, deletes
+    raise ValueError(f"unknown stream {stream}")
+
+
+def suite_trees(ab_settings):
+    trees = {"avl": lambda: AvlTree(), "rb": lambda: RBTree()}
+    for a, b in ab_settings:
+        trees[f"ab({a},{b})"] = lambda a=a, b=b: ABTree(a, b)
+    return trees
+
+
+def suite_times(make_tree, inserts, finds, deletes):
+    """ Return seconds of inserts, finds and deletes of one run of workload """
+    tree = make_tree()
+    times = []
+    start = time.perf_counter()
+    for key in inserts:
+        tree.insert(key, key)
+    times.append(time.perf_counter() - start)
+    for operation, keys in ((tree.find, finds), (tree.delete, deletes)):
+        start = time.perf_counter()
+        for key in keys:
+            operation(key)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def suite_run(make_tree, inserts, finds, deletes, runs, detailed):
+    """ Return result of one workload, memory and comparisons are None if not detailed
+
+    runs - times of phases of measured runs (suite_times), every phase takes
+    the fastest run. Noise of other processes only adds time, so the minimum
+    is the most stable estimate.
+    """
+    times = [min(phase) for phase in zip(*runs)]
+    result = {
+        "ops_per_sec": (len(inserts) + len(finds) + len(deletes)) / sum(times),
+        "insert_ops_per_sec": len(inserts) / times[0],
+        "find_ops_per_sec": len(finds) / times[1],
+        "delete_ops_per_sec": len(deletes) / times[2],
+        "ops_per_sec_runs": [(len(inserts) + len(finds) + len(deletes)) / sum(run) for run in runs],
+        "peak_bytes_per_key": None,
+        "comparisons_per_op": None,
+    }
+    if not detailed:
+        return result
+
+    # peak of traced memory while the tree is built, keys are allocated before
+    tree = make_tree()
+    tracemalloc.start()
+    try:
+        for key in inserts:
+            tree.insert(key, key)
+        result["peak_bytes_per_key"] = tracemalloc.get_traced_memory()[1] / len(inserts)
+    finally:
+        tracemalloc.stop()
+    del tree
+
+    tree = make_tree()
+    counted = {key: CountingKey(key) for key in inserts}
+    CountingKey.comparisons = 0
+    for key in inserts:
+        tree.insert(counted[key], key)
+    for key in finds:
+        tree.find(counted[key])
+    for key in deletes:
+        tree.delete(counted[key])
+    result["comparisons_per_op"] = CountingKey.comparisons / (len(inserts) + len(finds) + len(deletes))
+    return result
+
+
+def calibration_speed(repeats):
+    """ Return iterations per second of fixed pure Python loop (the fastest of repeats)
+
+    It does not use the trees, so it measures only the speed of the machine.
+    """
+    iterations = 200000
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        total = 0
+        for x in range(iterations):
+            total += x % 7
+        best = min(best, time.perf_counter() - start)
+    return iterations / best
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(args):
+    """ Run every tree on every key stream and size, optionally save results to JSON
+
+    Every workload inserts size keys, does size finds and deletes all keys.
+    Throughput is measured on plain int keys, the fastest of --repeats runs
+    after --warmup unmeasured runs, repeats of one stream and size go round
+    all trees. Peak memory (tracemalloc) and
+    key comparisons (CountingKey) are measured in separate runs for sizes up
+    to --detail-max, because both slow the tree down a lot.
+    With --compare, throughput is compared to results of an earlier run, ratios
+    are divided by the ratio of calibration loop speeds (the speed of the
+    machine may change between runs) and slowdowns over --threshold are marked
+    as regressions if the best run is also slower than all runs of the baseline.
+    """
+    trees = suite_trees(args.ab)
+    calibration = calibration_speed(args.repeats)
+    results = []
+    print(f"{'tree':>10} {'stream':>12} {'keys':>9} {'ops/s':>10} {'bytes/key':>10} {'cmp/op':>7}")
+    for size in args.sizes:
+        for stream in args.streams:
+            inserts, finds, deletes = suite_workload(stream, size, random.Random(args.seed))
+            for _ in range(args.warmup):
+                for make_tree in trees.values():
+                    suite_times(make_tree, inserts, finds, deletes)
+            # repeats go round all trees, so a slow period of the machine is spread over them
+            runs: dict = {name: [] for name in trees}
+            for _ in range(args.repeats):
+                for name, make_tree in trees.items():
+                    runs[name].append(suite_times(make_tree, inserts, finds, deletes))
+
+            for name, make_tree in trees.items():
+                result = {"tree": name, "stream": stream, "size": size}
+                result.update(suite_run(make_tree, inserts, finds, deletes, runs[name], size <= args.detail_max))
+                results.append(result)
+
+                memory = result["peak_bytes_per_key"]
+                comparisons = result["comparisons_per_op"]
+                print(f"{name:>10} {stream:>12} {size:>9} {result['ops_per_sec']:>10.0f} "
+                      f"{'-' if memory is None else f'{memory:.1f}':>10} "
+                      f"{'-' if comparisons is None else f'{comparisons:.2f}':>7}")
+
+    # the faster of measurements before and after the suite
+    calibration = max(calibration, calibration_speed(args.repeats))
+    if args.output:
+        with open(args.output, "w") as fout:
+            json.dump({"commit": git_commit(), "python": platform.python_version(),
+                       "seed": args.seed, "warmup": args.warmup, "repeats": args.repeats,
+                       "calibration": calibration, "results": results}, fout, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fin:
+            saved = json.load(fin)
+        baseline = {(r["tree"], r["stream"], r["size"]): r for r in saved["results"]}
+        speedup = calibration / saved.get("calibration", calibration)
+        print(f"\nmachine speed against baseline: {speedup:.2f}")
+        print(f"\n{'tree':>10} {'stream':>12} {'keys':>9} {'ops/s':>10} {'baseline':>10} {'ratio':>6}")
+        regressions = 0
+        for result in results:
+            old = baseline.get((result["tree"], result["stream"], result["size"]))
+            if old is None:
+                continue
+            ratio = result["ops_per_sec"] / old["ops_per_sec"] / speedup
+            # the best run must be also slower than every baseline run, so spread of
+            # runs on a noisy machine is not reported
+            regression = ratio < 1 - args.threshold and \
+                max(result["ops_per_sec_runs"]) / speedup < min(old.get("ops_per_sec_runs", [old["ops_per_sec"]]))
+            regressions += regression
+            print(f"{result['tree']:>10} {result['stream']:>12} {result['size']:>9} "
+                  f"{result['ops_per_sec']:>10.0f} {old['ops_per_sec']:>10.0f} {ratio:>6.2f}"
+                  + (" regression" if regression else ""))
+        return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    p = subparsers.add_parser("insert-comparisons", help="key comparisons per insert")
+    p.add_argument("--tests", type=int, nargs="+", default=[4, 5])
+    p.set_defaults(func=bench_insert_comparisons)
+
+    p = subparsers.add_parser("operations", help="time per insert, find and delete")
+    p.add_argument("--sizes", type=int, nargs="+", default=[10**5, 10**6])
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=bench_operations)
+
+    p = subparsers.add_parser("ab-sweep", help="ABTree throughput for (a, b) from (2, 4)")
+    p.add_argument("--size", type=int, default=10**6)
+    p.add_argument("--max-a", type=int, default=128)
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=bench_ab_sweep)
+
+    p = subparsers.add_parser("batch", help="batch operations against loop of single operations")
+    p.add_argument("--size", type=int, default=10**5)
+    p.add_argument("--ratios", type=float, nargs="+", default=[0.01, 0.1, 0.5, 1, 4])
+    p.add_argument("--repeats", type=int, default=3)
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=bench_batch)
+
+    p = subparsers.add_parser("bplus", help="BPlusTree against ABTree on point and range workloads")
+    p.add_argument("--size", type=int, default=10**5)
+    p.add_argument("--ab", type=int, nargs=2, action="append", metavar=("A", "B"),
+                   help="(a, b) of both trees, may be repeated (default (2, 4), (16, 32) and (64, 128))")
+    p.add_argument("--queries", type=int, default=1000)
+    p.add_argument("--scan", type=int, default=1000, help="average number of keys in scanned range")
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=bench_bplus)
+
+    p = subparsers.add_parser("find-many", help="NumpyBPlusTree find_many against loop of finds")
+    p.add_argument("--size", type=int, default=10**6)
+    p.add_argument("--ab", type=int, nargs=2, action="append", metavar=("A", "B"),
+                   help="(a, b) of the tree, may be repeated (default (16, 32) and (64, 128))")
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=bench_find_many)
+
+    p = subparsers.add_parser("cache", help="finds with LRU and CLOCK cache on zipfian workload")
+    p.add_argument("--size", type=int, default=10**5)
+    p.add_argument("--cache-sizes", type=int, nargs="+", default=[1024, 16384])
+    p.add_argument("--write-every", type=int, default=10, help="finds between writes of mixed workload")
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=bench_cache)
+
+    p = subparsers.add_parser("finger", help="finger find and insert against operations from root on key streams")
+    p.add_argument("--size", type=int, default=10**5)
+    p.add_argument("--step", type=int, default=16, help="maximal step of near stream")
+    p.add_argument("--repeats", type=int, default=3)
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=bench_finger)
+
+    p = subparsers.add_parser("keys", help="finds of int, str and tuple keys with one and two comparisons per level")
+    p.add_argument("--size", type=int, default=10**5)
+    p.add_argument("--repeats", type=int, default=3)
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=bench_keys)
+
+    p = subparsers.add_parser("aggregate", help="aggregate against walk along the chain")
+    p.add_argument("--size", type=int, default=10**6)
+    p.add_argument("--queries", type=int, default=1000)
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=bench_aggregate)
+
+    p = subparsers.add_parser("memory", help="memory per key of node layouts")
+    p.add_argument("--sizes", type=int, nargs="+", default=[10**5, 10**6])
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=bench_memory)
+
+    p = subparsers.add_parser("snapshot", help="replay of inserts against snapshot load and mmap")
+    p.add_argument("--size", type=int, default=10**6)
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=bench_snapshot)
+
+    p = subparsers.add_parser("wal", help="throughput with write-ahead log and group commit")
+    p.add_argument("--size", type=int, default=10**4)
+    p.add_argument("--groups", type=int, nargs="+", default=[1, 16, 256])
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=bench_wal)
+
+    p = subparsers.add_parser("concurrent", help="ConcurrentTree throughput with one writer")
+    p.add_argument("--size", type=int, default=10**5)
+    p.add_argument("--readers", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.add_argument("--duration", type=float, default=2.0)
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=bench_concurrent)
+
+    p = subparsers.add_parser("persistent", help="memory per version and latency of persistent trees")
+    p.add_argument("--size", type=int, default=10**5)
+    p.add_argument("--versions", type=int, default=1000)
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=bench_persistent)
+
+    p = subparsers.add_parser("async", help="latency percentiles of AsyncTreeStore under load")
+    p.add_argument("--size", type=int, default=10**5)
+    p.add_argument("--clients", type=int, default=100)
+    p.add_argument("--requests", type=int, default=200)
+    p.add_argument("--scan-threshold", type=int, default=1024)
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=bench_async)
+
+    p = subparsers.add_parser("sharded", help="ShardedTree throughput for 1 to 8 worker processes")
+    p.add_argument("--test", type=int, default=4)
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.add_argument("--batch", type=int, default=1000)
+    p.set_defaults(func=bench_sharded)
+
+    p = subparsers.add_parser("replay", help="replay of text test against its binary version")
+    p.add_argument("--test", type=int, default=4)
+    p.set_defaults(func=bench_replay)
+
+    p = subparsers.add_parser("suite", help="all trees on key streams and sizes, JSON results")
+    p.add_argument("--sizes", type=int, nargs="+", default=[10**3, 10**4, 10**5])
+    p.add_argument("--streams", nargs="+", choices=STREAMS, default=list(STREAMS))
+    p.add_argument("--ab", type=int, nargs=2, action="append", metavar=("A", "B"),
+                   help="(a, b) of ABTree, may be repeated (default (2, 4), (8, 16) and (32, 64))")
+    p.add_argument("--detail-max", type=int, default=10**5,
+                   help="measure memory and comparisons only up to this size")
+    p.add_argument("--output", help="save results to this JSON file")
+    p.add_argument("--compare", help="compare throughput with results saved by --output")
+    p.add_argument("--threshold", type=float, default=0.1,
+                   help="relative slowdown reported as regression")
+    p.add_argument("--warmup", type=int, default=1, help="unmeasured runs of every workload")
+    p.add_argument("--repeats", type=int, default=5, help="measured runs of every workload, the fastest is reported")
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    if args.benchmark == "suite" and args.ab is None:
+        args.ab = [(2, 4), (8, 16), (32, 64)]
+    if args.benchmark == "bplus" and args.ab is None:
+        args.ab = [(2, 4), (16, 32), (64, 128)]
+    if args.benchmark == "find-many" and args.ab is None:
+        args.ab = [(16, 32), (64, 128)]
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,409 @@
+from bisect import bisect_left, bisect_right
+from typing import Iterable, Iterator, List, Optional, Tuple
+from generic import ATree
+
+
+class BPlusVertex:
+    """ Vertex of BPlusTree
+
+    keys - sorted keys, separators in internal vertex (child i holds keys
+    between keys[i - 1] inclusive and keys[i] exclusive), keys of values in leaf
+    values - values of keys, only in leaf
+    children - child vertices, empty for leaf
+    prev, nxt - neighbour leaves, only in leaf
+    size - number of keys in leaves of subtree of vertex
+    """
+    __slots__ = ("keys", "values", "children", "leaf", "prev", "nxt", "size")
+
+    def __init__(self, keys, values, children, leaf):
+        self.keys: list = keys
+        self.values: list = values
+        self.children: 'List[BPlusVertex]' = children
+        self.leaf: bool = leaf
+        self.prev: 'Optional[BPlusVertex]' = None
+        self.nxt: 'Optional[BPlusVertex]' = None
+        self.size: int = len(keys) if leaf else sum(child.size for child in children)
+
+    def __repr__(self):
+        return f"BPlusVertex({', '.join(str(key) for key in self.keys)})"
+
+
+class BPlusNode:
+    """ View to one key of leaf, it is valid until the tree is modified """
+    __slots__ = ("leaf", "idx")
+
+    def __init__(self, leaf: BPlusVertex, idx: int):
+        self.leaf = leaf
+        self.idx = idx
+
+    @property
+    def key(self):
+        return self.leaf.keys[self.idx]
+
+    @property
+    def value(self):
+        return self.leaf.values[self.idx]
+
+    @property
+    def prev(self) -> 'Optional[BPlusNode]':
+        if self.idx > 0:
+            return BPlusNode(self.leaf, self.idx - 1)
+        leaf = self.leaf.prev
+        return BPlusNode(leaf, len(leaf.keys) - 1) if leaf is not None else None
+
+    @property
+    def nxt(self) -> 'Optional[BPlusNode]':
+        if self.idx + 1 < len(self.leaf.keys):
+            return BPlusNode(self.leaf, self.idx + 1)
+        leaf = self.leaf.nxt
+        return BPlusNode(leaf, 0) if leaf is not None else None
+
+    def __eq__(self, other):
+        return isinstance(other, BPlusNode) and self.leaf is other.leaf and self.idx == other.idx
+
+    def __hash__(self):
+        return hash((id(self.leaf), self.idx))
+
+    def __repr__(self):
+        return f"Node( key: {self.key}, value: {self.value} )"
+
+
+class BPlusTree(ATree):
+    """ B+ tree, internal vertices hold only separator keys, keys and values are in leaves
+
+    Vertices have a-1 to b-1 keys (root can have less), b >= 2a - 1.
+    Leaves are linked to their neighbours, so scans walk whole leaves.
+    Methods returning node return BPlusNode view.
+    """
+    # views point to positions in leaves, which move on every insert and delete
+    STABLE_NODES = False
+    # vertices always keep sizes, one number per vertex of up to b-1 keys
+    sizes = True
+
+    def __init__(self, a: int, b: int):
+        self.root = BPlusVertex([], [], [], True)
+        self.a = a
+        self.b = b
+
+    @classmethod
+    def from_sorted(cls, pairs: Iterable[Tuple], a: int, b: int, fill: float = 1.0) -> 'BPlusTree':
+        """ Build tree from (key, value) pairs sorted by key in linear time
+
+        fill - how full vertices are, 1.0 means b-1 keys in vertex (but never less than a-1)
+        Leaves are built first, then levels of internal vertices bottom-up.
+        """
+        tree = cls(a, b)
+        keys: list = []
+        values: list = []
+        for key, value in pairs:
+            if keys and not keys[-1] < key:
+                raise ValueError(f"keys are not strictly increasing: {keys[-1]}, {key}")
+            keys.append(key)
+            values.append(key if value is None else value)
+        size = max(a - 1, min(b - 1, round(fill * (b - 1))))
+
+        level: List[BPlusVertex] = []
+        for start, end in cls._parts(len(keys), size, a - 1):
+            leaf = BPlusVertex(keys[start:end], values[start:end], [], True)
+            if level:
+                leaf.prev, level[-1].nxt = level[-1], leaf
+            level.append(leaf)
+        # the smallest key in subtree of every vertex of level
+        lows = [leaf.keys[0] for leaf in level]
+
+        while len(level) > 1:
+            parts = cls._parts(len(level), size + 1, a)
+            level = [BPlusVertex(lows[start + 1:end], [], level[start:end], False) for start, end in parts]
+            lows = [lows[start] for start, _ in parts]
+
+        if level:
+            tree.root = level[0]
+        return tree
+
+    @staticmethod
+    def _parts(count: int, size: int, minimum: int) -> List[Tuple[int, int]]:
+        """ Split count items to nearly equal parts of at most size items
+        and at least minimum items (unless there is only one part) """
+        parts = max(1, -(-count // size))
+        if parts > 1 and count // parts < minimum:
+            parts = max(1, count // minimum)
+        base, extra = divmod(count, parts)
+        ret, start = [], 0
+        for idx in range(parts if count else 0):
+            end = start + base + (1 if idx < extra else 0)
+            ret.append((start, end))
+            start = end
+        return ret
+
+    def _rebuild(self, pairs: Iterable[Tuple]) -> None:
+        self.root = self.from_sorted(pairs, self.a, self.b).root
+
+    def _leaf(self, vertex: BPlusVertex, key) -> BPlusVertex:
+        """ Return leaf of subtree of vertex where key is or would be """
+        while not vertex.leaf:
+            vertex = vertex.children[bisect_right(vertex.keys, key)]
+        return vertex
+
+    def find(self, key) -> Optional[BPlusNode]:
+        leaf = self._leaf(self.root, key)
+        idx = bisect_left(leaf.keys, key)
+        if idx < len(leaf.keys) and leaf.keys[idx] == key:
+            return BPlusNode(leaf, idx)
+        return None
+
+    def __len__(self) -> int:
+        return self.root.size
+
+    def select(self, k: int) -> BPlusNode:
+        vertex = self.root
+        if not 0 <= k < vertex.size:
+            raise IndexError("tree index out of range")
+        while not vertex.leaf:
+            for child in vertex.children:
+                if k < child.size:
+                    vertex = child
+                    break
+                k -= child.size
+        return BPlusNode(vertex, k)
+
+    def rank(self, key) -> int:
+        ret = 0
+        vertex = self.root
+        while not vertex.leaf:
+            idx = bisect_right(vertex.keys, key)
+            for child in vertex.children[:idx]:
+                ret += child.size
+            vertex = vertex.children[idx]
+        return ret + bisect_left(vertex.keys, key)
+
+    def _find_lower(self, vertex: BPlusVertex, key) -> Optional[BPlusNode]:
+        """ Find the node with the largest smaller key """
+        leaf = self._leaf(vertex, key)
+        idx = bisect_left(leaf.keys, key)
+        if idx > 0:
+            return BPlusNode(leaf, idx - 1)
+        return BPlusNode(leaf.prev, len(leaf.prev.keys) - 1) if leaf.prev is not None else None
+
+    def _find_bigger_or_equal(self, vertex: BPlusVertex, key) -> Optional[BPlusNode]:
+        """ Find the node with the lowest key which is not smaller than key """
+        leaf = self._leaf(vertex, key)
+        idx = bisect_left(leaf.keys, key)
+        if idx < len(leaf.keys):
+            return BPlusNode(leaf, idx)
+        return BPlusNode(leaf.nxt, 0) if leaf.nxt is not None else None
+
+    def findmin(self) -> Optional[BPlusNode]:
+        vertex = self.root
+        while not vertex.leaf:
+            vertex = vertex.children[0]
+        return BPlusNode(vertex, 0) if len(vertex.keys) else None
+
+    def findmax(self) -> Optional[BPlusNode]:
+        vertex = self.root
+        while not vertex.leaf:
+            vertex = vertex.children[-1]
+        return BPlusNode(vertex, len(vertex.keys) - 1) if len(vertex.keys) else None
+
+    def _runs(self, lo, hi, reverse: bool) -> Iterator[Tuple[BPlusVertex, int, int]]:
+        """ Yield (leaf, start, end) with keys lo <= key < hi in leaf.keys[start:end] in leaf order """
+        if not lo < hi or self.root.size == 0:
+            return
+        if reverse:
+            leaf = self._leaf(self.root, hi)
+            end = bisect_left(leaf.keys, hi)
+            while leaf is not None:
+                start = 0 if not leaf.keys[0] < lo else bisect_left(leaf.keys, lo)
+                yield leaf, start, end
+                if start > 0:
+                    return
+                leaf = leaf.prev
+                end = len(leaf.keys) if leaf is not None else 0
+        else:
+            leaf = self._leaf(self.root, lo)
+            start = bisect_left(leaf.keys, lo)
+            while leaf is not None:
+                end = len(leaf.keys) if leaf.keys[-1] < hi else bisect_left(leaf.keys, hi)
+                yield leaf, start, end
+                if end < len(leaf.keys):
+                    return
+                leaf = leaf.nxt
+                start = 0
+
+    def range(self, lo, hi, reverse: bool = False) -> Iterator[BPlusNode]:
+        """ Lazily yield nodes with lo <= key < hi in increasing order (decreasing if reverse)
+
+        Leaves are walked as whole, keys of leaf are compared only at both ends of range.
+        """
+        for leaf, start, end in self._runs(lo, hi, reverse):
+            for idx in (range(end - 1, start - 1, -1) if reverse else range(start, end)):
+                yield BPlusNode(leaf, idx)
+
+    def items(self, lo, hi, reverse: bool = False) -> Iterator[Tuple]:
+        """ Lazily yield (key, value) pairs with lo <= key < hi, without node views """
+        for leaf, start, end in self._runs(lo, hi, reverse):
+            if reverse:
+                yield from zip(reversed(leaf.keys[start:end]), reversed(leaf.values[start:end]))
+            else:
+                yield from zip(leaf.keys[start:end], leaf.values[start:end])
+
+    def insert(self, key, value) -> None:
+        if value is None:
+            # like Node of other trees
+            value = key
+        added, separator, right = self._insert(self.root, key, value)
+        if right is not None:
+            self.root = BPlusVertex([separator], [], [self.root, right], False)
+
+    def _insert(self, vertex: BPlusVertex, key, value) -> Tuple[bool, object, Optional[BPlusVertex]]:
+        """ Insert key to subtree of vertex
+
+        Return (key was added, separator, new right vertex) where the last two
+        are not None if vertex has got split.
+        """
+        if vertex.leaf:
+            idx = bisect_left(vertex.keys, key)
+            if idx < len(vertex.keys) and vertex.keys[idx] == key:
+                # key is alread in tree
+                return (False, None, None)
+            vertex.keys.insert(idx, key)
+            vertex.values.insert(idx, value)
+            vertex.size += 1
+        else:
+            idx = bisect_right(vertex.keys, key)
+            added, separator, right = self._insert(vertex.children[idx], key, value)
+            if not added:
+                return (False, None, None)
+            vertex.size += 1
+            if right is not None:
+                vertex.keys.insert(idx, separator)
+                vertex.children.insert(idx + 1, right)
+
+        if len(vertex.keys) == self.b:
+            return (True, *self._split_vertex(vertex))
+        return (True, None, None)
+
+    def _split_vertex(self, vertex: BPlusVertex) -> Tuple[object, BPlusVertex]:
+        """ Split overfull vertex, return separator and the new right vertex """
+        mid = len(vertex.keys) // 2
+        if vertex.leaf:
+            right = BPlusVertex(vertex.keys[mid:], vertex.values[mid:], [], True)
+            del vertex.keys[mid:], vertex.values[mid:]
+            right.prev, right.nxt = vertex, vertex.nxt
+            if vertex.nxt is not None:
+                vertex.nxt.prev = right
+            vertex.nxt = right
+            vertex.size = len(vertex.keys)
+            return right.keys[0], right
+
+        separator = vertex.keys[mid]
+        right = BPlusVertex(vertex.keys[mid + 1:], [], vertex.children[mid + 1:], False)
+        del vertex.keys[mid:], vertex.children[mid + 1:]
+        vertex.size -= right.size
+        return separator, right
+
+    def delete(self, key) -> None:
+        self._delete(self.root, key)
+        if not self.root.leaf and len(self.root.children) == 1:
+            self.root = self.root.children[0]
+
+    def _delete(self, vertex: BPlusVertex, key) -> bool:
+        """ Delete key from subtree of vertex, return True if key was there
+
+        Separators are not changed, they still separate keys of children.
+        """
+        if vertex.leaf:
+            idx = bisect_left(vertex.keys, key)
+            if idx == len(vertex.keys) or vertex.keys[idx] != key:
+                return False
+            del vertex.keys[idx], vertex.values[idx]
+            vertex.size -= 1
+            return True
+
+        idx = bisect_right(vertex.keys, key)
+        child = vertex.children[idx]
+        if not self._delete(child, key):
+            return False
+        vertex.size -= 1
+        if len(child.keys) < self.a - 1:
+            self._solve_underfull(vertex, idx - 1 if idx > 0 else idx)
+        return True
+
+    def _solve_underfull(self, parent: BPlusVertex, idx: int) -> None:
+        """ Merge children idx and idx + 1 of parent if they fit to one vertex,
+        otherwise move one key (and child) from the bigger one to the smaller one """
+        left, right = parent.children[idx], parent.children[idx + 1]
+        if left.leaf:
+            if len(left.keys) + len(right.keys) < self.b:
+                left.keys.extend(right.keys)
+                left.values.extend(right.values)
+                left.nxt = right.nxt
+                if right.nxt is not None:
+                    right.nxt.prev = left
+            elif len(left.keys) < len(right.keys):
+                left.keys.append(right.keys.pop(0))
+                left.values.append(right.values.pop(0))
+                parent.keys[idx] = right.keys[0]
+            else:
+                right.keys.insert(0, left.keys.pop())
+                right.values.insert(0, left.values.pop())
+                parent.keys[idx] = right.keys[0]
+            moved = len(left.keys) - left.size
+            merged = left.nxt is not right
+        else:
+            merged = len(left.children) + len(right.children) <= self.b
+            if merged:
+                left.keys.extend([parent.keys[idx], *right.keys])
+                left.children.extend(right.children)
+                moved = right.size
+            elif len(left.children) < len(right.children):
+                left.keys.append(parent.keys[idx])
+                left.children.append(right.children.pop(0))
+                parent.keys[idx] = right.keys.pop(0)
+                moved = left.children[-1].size
+            else:
+                right.keys.insert(0, parent.keys[idx])
+                right.children.insert(0, left.children.pop())
+                parent.keys[idx] = left.keys.pop()
+                moved = -right.children[0].size
+
+        left.size += moved
+        right.size -= moved
+        if merged:
+            del parent.keys[idx], parent.children[idx + 1]
+
+    def validate(self) -> bool:
+        leaves: List[BPlusVertex] = []
+
+        def _validate(vertex: BPlusVertex, lower, bigger, root=False) -> Tuple[int, bool]:
+            """ Return depth of leaves and validity of subtree with keys lower <= key < bigger """
+            keys = vertex.keys
+            valid = all(keys[i] < keys[i + 1] for i in range(len(keys) - 1)) and \
+                (lower is None or len(keys) == 0 or not keys[0] < lower) and \
+                (bigger is None or len(keys) == 0 or keys[-1] < bigger) and \
+                len(keys) <= self.b - 1 and (root or len(keys) >= self.a - 1)
+            if vertex.leaf:
+                leaves.append(vertex)
+                return (1, valid and len(vertex.children) == 0 and len(vertex.values) == len(keys) and
+                        vertex.size == len(keys))
+            if len(vertex.children) != len(keys) + 1 or len(keys) == 0 or \
+                    vertex.size != sum(child.size for child in vertex.children):
+                return (-1, False)
+
+            bounds = [lower, *keys, bigger]
+            depths = set()
+            for idx, child in enumerate(vertex.children):
+                depth, child_valid = _validate(child, bounds[idx], bounds[idx + 1])
+                depths.add(depth)
+                valid = valid and child_valid
+            return (depths.pop() + 1, valid and len(depths) == 0)
+
+        _, ret = _validate(self.root, None, None, True)
+        chain = leaves[0].prev is None and leaves[-1].nxt is None and \
+            all(left.nxt is right and right.prev is left for left, right in zip(leaves, leaves[1:]))
+        return ret and chain
+
+    def __repr__(self):
+        return self.makerepr(self.root)
+
+    def makerepr(self, vertex: BPlusVertex):
+        return f"( {vertex}, {' '.join([self.makerepr(x) for x in vertex.children])} )"
@@ -0,0 +1,173 @@
+""" Bounded cache of find results in front of a tree """
+
+from collections import OrderedDict
+from generic import RESTRUCTURING_METHODS, ATree
+from typing import Dict, Iterable, List, Set, Tuple
+
+
+MISSING = object()
+
+
+class LRUCache:
+    """ Map key -> node of at most size entries, the least recently used entry is evicted
+
+    entries - the cached nodes, touch(key) marks hit of cached key
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self.entries: OrderedDict = OrderedDict()
+        self.touch = self.entries.move_to_end
+
+    def put(self, key, node) -> None:
+        self.entries[key] = node
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def pop(self, key) -> None:
+        self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class ClockCache:
+    """ Map key -> node of at most size entries with CLOCK (second chance) eviction
+
+    Keys are in ring of slots, hit only adds key to referenced set, so hits
+    do not move anything. The hand evicts the first key which is not
+    referenced and removes keys it passes from referenced.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self.entries: Dict = {}
+        self.referenced: Set = set()
+        self.touch = self.referenced.add
+        self.slots: Dict = {}
+        self.ring: List = []
+        self.free: List[int] = []
+        self.hand = 0
+
+    def put(self, key, node) -> None:
+        if self.free:
+            slot = self.free.pop()
+        elif len(self.ring) < self.size:
+            slot = len(self.ring)
+            self.ring.append(None)
+        else:
+            ring, referenced = self.ring, self.referenced
+            while ring[self.hand] in referenced:
+                referenced.discard(ring[self.hand])
+                self.hand = (self.hand + 1) % self.size
+            slot = self.hand
+            self.hand = (self.hand + 1) % self.size
+            old_key = ring[slot]
+            del self.entries[old_key], self.slots[old_key]
+        self.ring[slot] = key
+        self.slots[key] = slot
+        self.entries[key] = node
+
+    def pop(self, key) -> None:
+        slot = self.slots.pop(key, None)
+        if slot is not None:
+            del self.entries[key]
+            self.referenced.discard(key)
+            self.ring[slot] = None
+            self.free.append(slot)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.referenced.clear()
+        self.slots.clear()
+        self.ring.clear()
+        self.free.clear()
+        self.hand = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+POLICIES = {"lru": LRUCache, "clock": ClockCache}
+
+
+class CachedTree:
+    """ Wrapper which caches results of find (also None for missing keys)
+
+    insert and delete drop the cached entry of their key. Nodes of AVL, LLRB
+    and AB trees keep their identity when the tree is restructured (delete
+    relinks node.prev in place of the deleted node), so other entries stay
+    valid. Trees without STABLE_NODES (B+ tree views) and batch operations,
+    which may rebuild the tree, clear the whole cache. Other methods except
+    split and join are delegated to the tree, the tree must be modified only
+    through this wrapper.
+
+    size - maximal number of cached keys
+    policy - eviction policy, "lru" or "clock"
+    """
+    def __init__(self, tree: ATree, size: int = 1024, policy: str = "lru"):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown cache policy {policy}, use one of {list(POLICIES)}")
+        if size < 1:
+            raise ValueError(f"cache size must be positive: {size}")
+        self.tree = tree
+        self.cache = POLICIES[policy](size)
+        self.hits = 0
+        self.misses = 0
+        # hit costs two calls of C methods, not of Python ones
+        self._get = self.cache.entries.get
+        self._touch = self.cache.touch
+
+    def find(self, key):
+        node = self._get(key, MISSING)
+        if node is MISSING:
+            self.misses += 1
+            node = self.tree.find(key)
+            self.cache.put(key, node)
+            return node
+        self._touch(key)
+        self.hits += 1
+        return node
+
+    def _invalidate(self, key) -> None:
+        if self.tree.STABLE_NODES:
+            self.cache.pop(key)
+        else:
+            self.cache.clear()
+
+    def insert(self, key, value) -> None:
+        self._invalidate(key)
+        self.tree.insert(key, value)
+
+    def delete(self, key) -> None:
+        self._invalidate(key)
+        self.tree.delete(key)
+
+    def insert_many(self, pairs: Iterable[Tuple]) -> None:
+        self.cache.clear()
+        self.tree.insert_many(pairs)
+
+    def delete_many(self, keys: Iterable) -> None:
+        self.cache.clear()
+        self.tree.delete_many(keys)
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        """ Return hits, misses, hit ratio and number of cached keys """
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": self.hit_ratio, "cached": len(self.cache)}
+
+    def reset_stats(self) -> None:
+        self.hits = self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.tree)
+
+    def __getattr__(self, name):
+        if name in RESTRUCTURING_METHODS:
+            raise AttributeError(f"CachedTree does not delegate {name}, it would move cached nodes to other trees")
+        return getattr(self.tree, name)
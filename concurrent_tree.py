@@ -0,0 +1,156 @@
+""" Thread-safe wrapper of trees for many readers and one writer """
+
+from contextlib import contextmanager
+from generic import ATree
+from persistent import APersistentTree
+from typing import Callable, Iterable, List, Tuple, Union
+import threading
+
+
+class RWLock:
+    """ Reader-writer lock, many readers or one writer hold it at once
+
+    Waiting writer blocks new readers, so writers are not starved.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self) -> None:
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self) -> None:
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self) -> None:
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self) -> None:
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+def _insert_all(version: APersistentTree, pairs: Iterable[Tuple]) -> APersistentTree:
+    for key, value in pairs:
+        version = version.insert(key, value)
+    return version
+
+
+def _delete_all(version: APersistentTree, keys: Iterable) -> APersistentTree:
+    for key in keys:
+        version = version.delete(key)
+    return version
+
+
+class ConcurrentTree:
+    """ Thread-safe wrapper of tree for many parallel readers and one writer
+
+    Locked mode - readers share RWLock, writer holds it exclusively.
+    Snapshot mode (snapshot_reads) - the tree must be persistent
+    (PersistentAvlTree, PersistentRBTree), every write makes its new version
+    by path copying in O(log n) and publishes it as `tree`. Readers only take
+    the last published version, which is never modified, so they never block
+    and they see every finished write (a thread sees its own writes).
+
+    range returns list instead of iterator, so no lock is held by caller.
+    Returned nodes must not be modified.
+    """
+    def __init__(self, tree: Union[ATree, APersistentTree], snapshot_reads: bool = False):
+        if snapshot_reads and not isinstance(tree, APersistentTree):
+            raise TypeError(f"snapshot reads need persistent tree, not {type(tree).__name__}")
+        self.tree = tree
+        self.lock = RWLock()
+        self.snapshot_reads = snapshot_reads
+
+    def snapshot(self) -> APersistentTree:
+        """ Return the last published version of the tree (snapshot mode) """
+        return self.tree
+
+    def _read(self, operation: Callable):
+        if self.snapshot_reads:
+            return operation(self.tree)
+        with self.lock.read():
+            return operation(self.tree)
+
+    def _write(self, operation: Callable, new_version: Callable) -> None:
+        with self.lock.write():
+            if self.snapshot_reads:
+                # readers take the reference at once, so they see the old or the new version
+                self.tree = new_version(self.tree)
+            else:
+                operation(self.tree)
+
+    def find(self, key):
+        return self._read(lambda tree: tree.find(key))
+
+    def findmin(self):
+        return self._read(lambda tree: tree.findmin())
+
+    def findmax(self):
+        return self._read(lambda tree: tree.findmax())
+
+    def select(self, k: int):
+        return self._read(lambda tree: tree.select(k))
+
+    def rank(self, key) -> int:
+        return self._read(lambda tree: tree.rank(key))
+
+    def range(self, lo, hi, reverse: bool = False) -> List:
+        return self._read(lambda tree: list(tree.range(lo, hi, reverse)))
+
+    def count_range(self, lo, hi) -> int:
+        return self._read(lambda tree: tree.count_range(lo, hi))
+
+    def aggregate(self, lo, hi):
+        return self._read(lambda tree: tree.aggregate(lo, hi))
+
+    def validate(self) -> bool:
+        return self._read(lambda tree: tree.validate())
+
+    def __len__(self) -> int:
+        return self._read(len)
+
+    def insert(self, key, value) -> None:
+        self._write(lambda tree: tree.insert(key, value), lambda version: version.insert(key, value))
+
+    def delete(self, key) -> None:
+        self._write(lambda tree: tree.delete(key), lambda version: version.delete(key))
+
+    def insert_many(self, pairs: Iterable[Tuple]) -> None:
+        pairs = list(pairs)
+        self._write(lambda tree: tree.insert_many(pairs), lambda version: _insert_all(version, pairs))
+
+    def delete_many(self, keys: Iterable) -> None:
+        keys = list(keys)
+        self._write(lambda tree: tree.delete_many(keys), lambda version: _delete_all(version, keys))
+
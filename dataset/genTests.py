@@ -1,10 +1,19 @@
 #!/usr/bin/env python3
 
 from array import array
+from concurrent.futures import ProcessPoolExecutor
+from heapq import merge
+import argparse
+import os
 import random
+import shutil
+import tempfile
 import time
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from replay import OperationWriter, concatenate  # noqa: E402
+
 CASES = [
     # test number, number of operations, operation chances
     [1, 100,        [0.4, 0.3, 0.3, 0, 0]],
@@ -23,66 +32,109 @@ Operations (key and value are same):
 2 <key> - delete
 3 - print sequence in increasing order
 4 - print sequence in decreasing order
-"""
 
-random.seed(42)
+Every operation is O(1) expected except prints, which are O(n), so big tests
+should have zero print chances. Output is written in chunks of WRITE_CHUNK lines.
+With --binary, operations are also written to test<num>.ops (see `replay.py`).
+
+Every case has its own seed derived from --seed and test number. Case with
+more than --segment-ops operations is split to segments generated in
+parallel. Segment i of s segments has its own seed and uses only keys
+k * s + i, so it never touches keys of other segments and its part of input
+and output can be verified alone (replayed on empty tree). Segments are
+concatenated, so output depends only on --seed and --segment-ops, not on
+number of --jobs. Segmented cases cannot have prints except the final ones.
+"""
 
+WRITE_CHUNK = 1 << 14
+SEGMENT_OPS = 1_000_000
 
-def insert(key):
-    global arr
-    for i in range(len(arr)):
-        if arr[i] == key:
-            return
-        if arr[i] > key:
-            arr.insert(i, key)
-            return
-    arr.append(key)
 
+class Oracle:
+    """ Expected state of the tree
 
-def delete(key):
-    global arr
-    arr.remove(key)
+    keys - keys in tree in arbitrary order (random choice), positions - key -> index
+    in keys, removal swaps the last key to the removed place.
+    Sorted sequence is rebuilt only for prints, from the previous sorted sequence
+    and keys added since then, so timsort merges two runs in O(n).
+    """
+    def __init__(self):
+        self.keys = []
+        self.positions = {}
+        self.sorted = []
+        self.added = []
+        self.removed = set()
+        self.text = self.reversed_text = None
 
+    def __contains__(self, key):
+        return key in self.positions
 
-def contains(key):
-    global arr, fout
-    try:
-        arr.index(key)
-        fout.write(f"1\n")
-    except Exception:
-        fout.write(f"0\n")
+    def insert(self, key):
+        self.positions[key] = len(self.keys)
+        self.keys.append(key)
+        if key in self.removed:
+            self.removed.discard(key)
+        else:
+            self.added.append(key)
+        self.text = None
 
+    def delete(self, key):
+        idx = self.positions.pop(key)
+        last = self.keys.pop()
+        if last != key:
+            self.keys[idx] = last
+            self.positions[last] = idx
+        self.removed.add(key)
+        self.text = None
 
-def printAll(increasing=True):
-    global arr, fin, fout
-    if increasing:
-        fin.write(f"3\n")
-        fout.write(f"{' '.join(str(x) for x in arr)}\n")
-    else:
-        fin.write(f"4\n")
-        arr.reverse()
-        fout.write(f"{' '.join(str(x) for x in arr)}\n")
-        arr.reverse()
+    def sequence(self, increasing=True):
+        if self.text is None:
+            if self.removed:
+                self.sorted = [key for key in self.sorted if key not in self.removed]
+            self.sorted.extend(sorted(key for key in self.added if key not in self.removed))
+            self.sorted.sort()
+            self.added, self.removed = [], set()
+            self.text = ' '.join(map(str, self.sorted))
+            self.reversed_text = ' '.join(map(str, reversed(self.sorted)))
+        return self.text if increasing else self.reversed_text
 
 
 def log(str):
     print(str, file=sys.stderr)
 
 
-start = time.time()
+def case_seed(seed, test_num, segment=0):
+    """ Seed of one segment of case, string seeds are hashed the same way in every process """
+    return f"{seed}:{test_num}:{segment}"
 
-for case in CASES:
-    test_num, num_op, chances = case
-    keys = []
-    arr = []
 
-    log(f"Generating test case {test_num}")
-    with open(f"test{test_num}.in", "w") as fin, open(f"test{test_num}.out", "w") as fout:
-        fin.write(f"{num_op + 2}\n")
+def generate_segment(prefix, seed, num_op, chances, residue=0, modulus=1, binary=False):
+    """ Write prefix.in, prefix.out (without header and final prints), sorted
+    final keys to prefix.keys and with binary operations to prefix.ops
+
+    Keys are k * modulus + residue for 0 <= k <= 2 * num_op.
+    """
+    rnd = random.Random(seed)
+    oracle = Oracle()
+    fin_lines, fout_lines = [], []
+    writer = OperationWriter(f"{prefix}.ops") if binary else None
+
+    with open(f"{prefix}.in", "w") as fin, open(f"{prefix}.out", "w") as fout:
+        def emit(operation, key=None, output=None):
+            fin_lines.append(f"{operation}\n" if key is None else f"{operation} {key}\n")
+            if output is not None:
+                fout_lines.append(output + "\n")
+            if writer is not None:
+                writer.write(operation, 0 if key is None else key)
+            if len(fin_lines) >= WRITE_CHUNK:
+                fin.writelines(fin_lines)
+                fout.writelines(fout_lines)
+                fin_lines.clear()
+                fout_lines.clear()
 
         operation_now = 0
         while operation_now < num_op:
-            chance = random.random()
+            chance = rnd.random()
             prev_chance = 0
             operation = 0
             for c in chances:
@@ -93,36 +145,115 @@ for case in CASES:
                     operation += 1
 
             if operation == 0:
-                key = random.randint(0, num_op*2)
-                if key in keys:
+                key = rnd.randint(0, num_op*2) * modulus + residue
+                if key in oracle:
                     continue
-
-                keys.append(key)
-                insert(key)
-                fin.write(f"{operation} {key}\n")
+                oracle.insert(key)
+                emit(operation, key)
             elif operation == 1:
-                idx_key = random.randint(0, len(keys))
-                if idx_key == len(keys):
-                    key = random.randint(0, num_op*2)
+                idx_key = rnd.randint(0, len(oracle.keys))
+                if idx_key == len(oracle.keys):
+                    key = rnd.randint(0, num_op*2) * modulus + residue
                 else:
-                    key = keys[idx_key]
-                fin.write(f"{operation} {key}\n")
-                contains(key)
+                    key = oracle.keys[idx_key]
+                emit(operation, key, "1" if key in oracle else "0")
             elif operation == 2:
-                if len(keys) == 0:
+                if len(oracle.keys) == 0:
                     continue
-                key = keys[random.randint(0, len(keys) - 1)]
-                keys.remove(key)
-                fin.write(f"{operation} {key}\n")
-                delete(key)
+                key = oracle.keys[rnd.randint(0, len(oracle.keys) - 1)]
+                oracle.delete(key)
+                emit(operation, key)
             elif operation == 3:
-                printAll(True)
+                emit(operation, output=oracle.sequence(True))
             else:
-                printAll(False)
+                emit(operation, output=oracle.sequence(False))
             operation_now += 1
+        fin.writelines(fin_lines)
+        fout.writelines(fout_lines)
+    if writer is not None:
+        writer.close()
+    with open(f"{prefix}.keys", "wb") as fkeys:
+        array('q', sorted(oracle.keys)).tofile(fkeys)
+
+
+def segments(num_op, segment_ops):
+    """ Return numbers of operations of segments of case """
+    count = max(1, -(-num_op // segment_ops))
+    return [num_op // count + (1 if idx < num_op % count else 0) for idx in range(count)]
+
+
+def assemble(test_num, num_op, prefixes, binary):
+    """ Concatenate segments to test<num>.in/.out (and .ops) and add final prints """
+    final = []
+    for prefix in prefixes:
+        keys = array('q')
+        with open(f"{prefix}.keys", "rb") as fkeys:
+            keys.frombytes(fkeys.read())
+        final.append(keys)
+    final = list(merge(*final))
+
+    with open(f"test{test_num}.in", "w") as fin, open(f"test{test_num}.out", "w") as fout:
+        fin.write(f"{num_op + 2}\n")
+        for prefix in prefixes:
+            for suffix, file in ((".in", fin), (".out", fout)):
+                with open(prefix + suffix) as part:
+                    shutil.copyfileobj(part, file)
         # Final check
-        printAll(True)
-        printAll(False)
+        fin.write("3\n4\n")
+        fout.write(' '.join(map(str, final)) + "\n")
+        fout.write(' '.join(map(str, reversed(final))) + "\n")
+
+    if binary:
+        final_prefix = prefixes[0] + ".final"
+        with OperationWriter(f"{final_prefix}.ops") as writer:
+            writer.write(3)
+            writer.write(4)
+        concatenate([f"{prefix}.ops" for prefix in prefixes] + [f"{final_prefix}.ops"], f"test{test_num}.ops")
+
+
+def generate(cases, seed=42, binary=False, segment_ops=SEGMENT_OPS, jobs=None):
+    """ Generate (test number, number of operations, chances) cases to current directory """
+    for test_num, num_op, chances in cases:
+        if len(segments(num_op, segment_ops)) > 1 and any(chances[3:]):
+            raise ValueError(f"test {test_num} is split to segments, it cannot have prints")
+
+    with tempfile.TemporaryDirectory(dir=".") as tmp, ProcessPoolExecutor(jobs) as pool:
+        tasks = []
+        for test_num, num_op, chances in cases:
+            sizes = segments(num_op, segment_ops)
+            prefixes = [os.path.join(tmp, f"test{test_num}.{idx}") for idx in range(len(sizes))]
+            futures = [pool.submit(generate_segment, prefix, case_seed(seed, test_num, idx), size,
+                                   chances, idx, len(sizes), binary)
+                       for idx, (prefix, size) in enumerate(zip(prefixes, sizes))]
+            tasks.append((test_num, num_op, prefixes, futures))
+
+        for test_num, num_op, prefixes, futures in tasks:
+            for future in futures:
+                future.result()
+            log(f"Generated test case {test_num}")
+            assemble(test_num, num_op, prefixes, binary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate test<num>.in/.out files to current directory, "
+                                                 "by default all CASES")
+    parser.add_argument("--test", type=int, help="number of generated test")
+    parser.add_argument("--ops", type=int, help="number of operations of --test")
+    parser.add_argument("--chances", type=float, nargs=5, default=[0.4, 0.3, 0.3, 0, 0],
+                        help="chances of operations 0-4 of --test")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--binary", action="store_true", help="write also binary test<num>.ops")
+    parser.add_argument("--segment-ops", type=int, default=SEGMENT_OPS,
+                        help="bigger cases are split to segments of at most this size")
+    parser.add_argument("--jobs", type=int, help="number of processes (default number of CPUs)")
+    args = parser.parse_args()
+
+    start = time.time()
+    cases = CASES if args.test is None else [[args.test, args.ops, args.chances]]
+    generate(cases, args.seed, args.binary, args.segment_ops, args.jobs)
+    end = time.time()
+    log(f"Generating tests took {end - start} s")
+
 
-end = time.time()
-log(f"Generating tests took {end - start} s")
+if __name__ == "__main__":
+    main()
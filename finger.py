@@ -0,0 +1,223 @@
+""" Finger search - operations start near the last touched node instead of the root
+
+find walks the prev/nxt chain from the node touched by the last find, insert
+and delete climb the search path of the last insert or delete. Nodes have no
+parent pointers, so the path is a list of vertices from the root. For near
+keys the walk is short and the climb ends low, time ordered inserts climb one
+or two levels and rebalance along the kept path.
+"""
+
+from ab_tree import ABTree
+from avl import AvlTree
+from generic import RESTRUCTURING_METHODS, ABinarySearchTree, ATree
+from typing import Iterable, List, Tuple
+
+
+class FingerTree:
+    """ Wrapper which serves operations from the last touched node and search path
+
+    Works with binary search trees (AVL, LLRB) and AB trees.
+
+    find walks the chain at most CHAIN_STEPS nodes from the node touched by the
+    last find, farther keys are searched from the root by find of the tree.
+    After a walk which did not reach the key the next 1, 2, 4, ... MAX_SKIPPED
+    finds do not walk, so random keys do not pay for it. Finds do not climb the
+    path: in Python a step of the climb or of the recorded descent costs about
+    twice a step of plain find, so the climb is slower than find from the root
+    even for keys a few nodes apart.
+
+    insert climbs the path of the previous insert or delete, descends from
+    there and rebalances bottom-up along the path, the part of the path above
+    the rebalanced vertices is kept (above the rotated nodes in LLRB tree,
+    which fixes colors along the whole path). AVL delete is served the same
+    way, LLRB and AB delete
+    search from the root and drop the path. Climb which would go above the
+    upper half of the path starts at the root instead and the next operations
+    skip the climb like finds skip the walk.
+
+    Other methods except split and join are delegated to the tree, the tree
+    must be modified only through this wrapper.
+
+    finger - node found by the last find (None if it was not found)
+    """
+    CHAIN_STEPS = 8
+    MAX_SKIPPED = 64
+
+    def __init__(self, tree: ATree):
+        if not isinstance(tree, (ABinarySearchTree, ABTree)):
+            raise TypeError(f"finger search does not support {type(tree).__name__}")
+        self.tree = tree
+        self.finger = None
+        # node where the next find starts its walk
+        self._node = None
+        # finds left which do not walk and their next count
+        self._skip = 0
+        self._backoff = 1
+        # (vertex, step) from the root, step is went_left for binary trees
+        # (as in AvlTree._insert_below) and index of child for AB trees
+        self._path: List[Tuple] = []
+        self._climb_skip = 0
+        self._climb_backoff = 1
+        self._ab = isinstance(tree, ABTree)
+        self._avl = isinstance(tree, AvlTree)
+        self._climb = self._climb_ab if self._ab else self._climb_binary
+
+    def _climb_binary(self, key):
+        """ Cut path to the deepest node whose subtree can hold key and return the node
+
+        Keys of subtree of a node are bounded by the nearest nodes above it
+        where the path goes left and right (bounds of the nodes higher up are
+        looser), so the climb looks above the candidate node only until both
+        bounds hold. Return None (path is not changed) if the climb would go
+        above the upper half of the path, such a climb and descent are longer
+        than search from the root.
+        """
+        path = self._path
+        idx = restart = len(path) - 1
+        lowest = restart >> 1
+        lo_found = hi_found = False
+        while idx > 0:
+            idx -= 1
+            node, left = path[idx]
+            if left:
+                if hi_found:
+                    continue
+                if key < node.key:
+                    if lo_found:
+                        break
+                    hi_found = True
+                    continue
+            else:
+                if lo_found:
+                    continue
+                if node.key < key:
+                    if hi_found:
+                        break
+                    lo_found = True
+                    continue
+            # key is not in subtree of the child of node, node is the new candidate
+            if idx < lowest:
+                return None
+            restart = idx
+            lo_found = hi_found = False
+        if restart < 0:
+            return self.tree.root
+        node = path[restart][0]
+        del path[restart:]
+        return node
+
+    def _climb_ab(self, key):
+        """ Cut path to the deepest vertex whose subtree can hold key, like _climb_binary """
+        path = self._path
+        idx = restart = len(path) - 1
+        lowest = restart >> 1
+        lo_found = hi_found = False
+        while idx > 0 and not (lo_found and hi_found):
+            idx -= 1
+            vertex, step = path[idx]
+            search_keys = vertex.search_keys
+            fits = True
+            if step > 0 and not lo_found:
+                fits = lo_found = search_keys[step - 1] < key
+            if fits and step < len(search_keys) and not hi_found:
+                fits = hi_found = key < search_keys[step]
+            if not fits:
+                if idx < lowest:
+                    return None
+                restart = idx
+                lo_found = hi_found = False
+        if restart < 0:
+            return self.tree.root
+        vertex = path[restart][0]
+        del path[restart:]
+        return vertex
+
+    def find(self, key):
+        """ Find node with given key by walk from the node touched by the last find """
+        node = self._node
+        if self._skip:
+            self._skip -= 1
+        elif node is not None:
+            steps = self.CHAIN_STEPS
+            if node.key < key:
+                while steps:
+                    nxt = node.nxt
+                    if nxt is None or key < nxt.key:
+                        break
+                    node = nxt
+                    steps -= 1
+            elif key < node.key:
+                while steps:
+                    prev = node.prev
+                    if prev is None or prev.key < key:
+                        break
+                    node = prev
+                    steps -= 1
+            self._node = node
+            if steps:
+                # key is between node and its neighbour or it is the key of node
+                self._backoff = 1
+                self.finger = node if node.key == key else None
+                return self.finger
+            self._skip = self._backoff
+            self._backoff = min(2 * self._backoff, self.MAX_SKIPPED)
+
+        self.finger = self.tree.find(key)
+        if self.finger is not None:
+            self._node = self.finger
+        return self.finger
+
+    def _reset(self) -> None:
+        # batches may rebuild the tree from new nodes
+        self._path.clear()
+        self._node = self.finger = None
+
+    def _start(self, key):
+        """ Return vertex where insert or delete of key starts, path is cut to its ancestors
+
+        After a climb which gave up the next 1, 2, 4, ... MAX_SKIPPED
+        operations start at the root without climbing, like finds skip walks.
+        """
+        if self._climb_skip:
+            self._climb_skip -= 1
+            vertex = None
+        else:
+            vertex = self._climb(key)
+            if vertex is None:
+                self._climb_skip = self._climb_backoff
+                self._climb_backoff = min(2 * self._climb_backoff, self.MAX_SKIPPED)
+            else:
+                self._climb_backoff = 1
+        if vertex is None:
+            self._path.clear()
+            return self.tree.root
+        return vertex
+
+    def insert(self, key, value) -> None:
+        self.tree._insert_below(key, value, self._path, self._start(key))
+
+    def delete(self, key) -> None:
+        if self._node is not None and self._node.key == key:
+            # deleted node leaves the chain
+            self._node = self.finger = None
+        if self._avl:
+            self.tree._delete_below(key, self._path, self._start(key))
+        else:
+            self._path.clear()
+            self.tree.delete(key)
+
+    def insert_many(self, pairs: Iterable[Tuple]) -> None:
+        self._reset()
+        self.tree.insert_many(pairs)
+
+    def delete_many(self, keys: Iterable) -> None:
+        self._reset()
+        self.tree.delete_many(keys)
+
+    def __len__(self) -> int:
+        return len(self.tree)
+
+    def __getattr__(self, name):
+        if name in RESTRUCTURING_METHODS:
+            raise AttributeError(f"FingerTree does not delegate {name}, it would leave the path in other trees")
+        return getattr(self.tree, name)
@@ -1,5 +1,7 @@
 from abc import ABC, abstractmethod
-from typing import Optional, TypeVar, Generic
+from math import ceil, log2
+from operator import itemgetter
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, TypeVar, Generic
 
 
 class Node:
@@ -10,6 +12,8 @@ class Node:
     prev - closest smaller node
     nxt - closest bigger node
     """
+    __slots__ = ("key", "value", "prev", "nxt")
+
     def __init__(self, key, value=None, prev=None, nxt=None):
         if value is None:
             value = key
@@ -31,6 +35,8 @@ class BinaryNode(Node):
     depth - depth of subtree with this node as root
     external - flag says if is it **real** node or helper node
     """
+    __slots__ = ("left", "right", "depth", "external")
+
     def __init__(self, key, value=None, prev=None, nxt=None,
                  left=None, right=None,
                  depth: int = 1, external: bool = False):
@@ -43,8 +49,25 @@ class BinaryNode(Node):
 
 T = TypeVar('T', bound=Node)
 
+# methods which move nodes between trees or replace all of them, wrappers which
+# keep state about nodes of their tree do not delegate them
+RESTRUCTURING_METHODS = ("split", "join", "join_with_key", "_rebuild")
+
 
 class ATree(ABC, Generic[T]):
+    # cost of one tree level of single insert/delete relative to cost of
+    # rebuilding one node, used by batch operations to pick the strategy
+    BATCH_LEVEL_COST = 0.15
+    # nodes returned by single operations stay valid until their key is deleted
+    # (batch operations may rebuild the tree), views to positions in vertices do not
+    STABLE_NODES = True
+    # searches use only comparison operators of keys, so search keys may be
+    # wrapped by objects comparable with stored keys (instrumentation)
+    WRAPPED_KEYS = True
+    # nodes (vertices) keep sizes of their subtrees, select, rank and len are
+    # O(log n), trees without sizes count nodes along the chain
+    sizes = False
+
     @abstractmethod
     def find(self, key) -> Optional[T]:
         """ Find node with given key and return it """
@@ -70,12 +93,287 @@ class ATree(ABC, Generic[T]):
         """ Return node with the biggest key or None (tree empty) """
         pass
 
+    def select(self, k: int) -> T:
+        """ Return node with k-th smallest key (from 0), raise IndexError if there is no such node
+
+        Without sizes nodes are counted along the chain in O(k).
+        """
+        node = self.findmin() if k >= 0 else None
+        while node is not None and k > 0:
+            node = node.nxt
+            k -= 1
+        if node is None:
+            raise IndexError("tree index out of range")
+        return node
+
+    def rank(self, key) -> int:
+        """ Return number of keys smaller than key
+
+        Without sizes nodes are counted along the chain in O(rank).
+        """
+        ret = 0
+        node = self.findmin()
+        while node is not None and node.key < key:
+            ret += 1
+            node = node.nxt
+        return ret
+
+    def __len__(self) -> int:
+        """ Return number of keys in tree, without sizes nodes are counted along the chain in O(n) """
+        ret = 0
+        node = self.findmin()
+        while node is not None:
+            ret += 1
+            node = node.nxt
+        return ret
+
+    def percentile(self, p: float) -> Optional[T]:
+        """ Return node with p-th percentile key (nearest-rank method) or None (tree empty) """
+        size = len(self)
+        if size == 0:
+            return None
+        if not 0 <= p <= 100:
+            raise ValueError(f"percentile must be between 0 and 100: {p}")
+        return self.select(max(0, ceil(p * size / 100) - 1))
+
+    @abstractmethod
+    def _find_lower(self, node, key) -> Optional[T]:
+        """ Find the node with the largest smaller key in subtree of node """
+        pass
+
+    @abstractmethod
+    def _find_bigger_or_equal(self, node, key) -> Optional[T]:
+        """ Find the node with the lowest key which is not smaller than key in subtree of node """
+        pass
+
+    @abstractmethod
+    def _rebuild(self, pairs: Iterable[Tuple]) -> None:
+        """ Replace whole tree with (key, value) pairs sorted by key """
+        pass
+
     def validate(self) -> bool:
         """ Return true if whole tree is valid (matched all requirements)
             Helpfull for debuging and unittests
         """
         return True
 
+    def range(self, lo, hi, reverse: bool = False) -> Iterator[T]:
+        """ Lazily yield nodes with lo <= key < hi in increasing order (decreasing if reverse)
+
+        Only the first node is searched from root, others are taken from prev/nxt chain.
+        The tree must not be modified during iteration.
+        """
+        if reverse:
+            node = self._find_lower(self.root, hi)
+            while node is not None and not node.key < lo:
+                yield node
+                node = node.prev
+        else:
+            node = self._find_bigger_or_equal(self.root, lo)
+            while node is not None and node.key < hi:
+                yield node
+                node = node.nxt
+
+    def count_range(self, lo, hi) -> int:
+        """ Return number of keys with lo <= key < hi """
+        if self.sizes:
+            return max(0, self.rank(hi) - self.rank(lo))
+        return sum(1 for _ in self.range(lo, hi))
+
+    def insert_many(self, pairs: Iterable[Tuple]) -> None:
+        """ Insert (key, value) pairs, if key repeats only the first pair is inserted
+
+        The batch is sorted and inserted key by key (see _insert_sorted) or merged
+        with the tree which is rebuilt afterwards, whatever is cheaper.
+        """
+        batch: List[Tuple] = []
+        for key, value in sorted(pairs, key=itemgetter(0)):
+            if not batch or batch[-1][0] < key:
+                batch.append((key, value))
+
+        if not self._rebuild_is_cheaper(len(batch), len(batch)):
+            self._insert_sorted(batch)
+            return
+
+        def _merge():
+            node = self.findmin()
+            for key, value in batch:
+                while node is not None and node.key < key:
+                    yield (node.key, node.value)
+                    node = node.nxt
+                if node is None or key < node.key:
+                    yield (key, value)
+            while node is not None:
+                yield (node.key, node.value)
+                node = node.nxt
+
+        self._rebuild(list(_merge()))
+
+    def delete_many(self, keys: Iterable) -> None:
+        """ Delete nodes with given keys
+
+        The batch is sorted and deleted key by key (see _delete_sorted) or the
+        tree is rebuilt without given keys, whatever is cheaper.
+        """
+        batch = sorted(keys)
+        if not self._rebuild_is_cheaper(len(batch), 0):
+            self._delete_sorted(batch)
+            return
+
+        def _filter():
+            node = self.findmin()
+            idx = 0
+            while node is not None:
+                while idx < len(batch) and batch[idx] < node.key:
+                    idx += 1
+                if idx == len(batch) or node.key < batch[idx]:
+                    yield (node.key, node.value)
+                node = node.nxt
+
+        self._rebuild(list(_filter()))
+
+    def _insert_sorted(self, pairs: List[Tuple]) -> None:
+        """ Insert (key, value) pairs with strictly increasing keys
+
+        Trees which can reuse search paths of previous keys override it.
+        """
+        for key, value in pairs:
+            self.insert(key, value)
+
+    def _delete_sorted(self, keys: List) -> None:
+        """ Delete keys sorted in increasing order
+
+        Trees which can reuse search paths of previous keys override it.
+        """
+        for key in keys:
+            self.delete(key)
+
+    def split(self, key) -> Tuple['ATree[T]', 'ATree[T]']:
+        """ Split tree to trees with keys smaller than key and keys bigger or equal to key in O(log n)
+
+        Nodes are moved to the new trees, this tree is left empty.
+        """
+        left, right = self._empty_copy(), self._empty_copy()
+        lower = self._find_lower(self.root, key)
+        if lower is not None and lower.nxt is not None:
+            lower.nxt.prev = None
+            lower.nxt = None
+
+        left.root, right.root = self._split_root(key)
+        self.root = self._empty_copy().root
+        return left, right
+
+    @staticmethod
+    def join(left: 'ATree[T]', right: 'ATree[T]') -> 'ATree[T]':
+        """ Join trees, all keys of left must be smaller than keys of right, in O(log n)
+
+        Return new tree with settings of left, nodes are moved to it and both trees are left empty.
+        The smallest node of right is taken out and used as the middle key of join_with_key.
+        """
+        ATree._check_joinable(left, right)
+        tree = left._empty_copy()
+        middle = right.findmin()
+        if middle is None:
+            tree.root, left.root = left.root, tree.root
+            return tree
+
+        lower = left.findmax()
+        if lower is not None and not lower.key < middle.key:
+            raise ValueError(f"keys of left tree are not smaller than keys of right tree: {lower.key}, {middle.key}")
+        right.delete(middle.key)
+        return ATree.join_with_key(left, middle.key, middle.value, right)
+
+    @staticmethod
+    def join_with_key(left: 'ATree[T]', key, value, right: 'ATree[T]') -> 'ATree[T]':
+        """ Join trees and new node (key, value) between them in O(log n)
+
+        All keys of left must be smaller than key and all keys of right bigger.
+        Return new tree with settings of left, nodes are moved to it and both trees are left empty.
+        """
+        ATree._check_joinable(left, right)
+        lower, bigger = left.findmax(), right.findmin()
+        if (lower is not None and not lower.key < key) or (bigger is not None and not key < bigger.key):
+            raise ValueError(f"key {key} does not separate keys of left and right tree")
+
+        tree = left._empty_copy()
+        node = tree._join_roots(left.root, key, value, right.root)
+        tree._add_node_to_chain(node, lower, bigger)
+        left.root = left._empty_copy().root
+        right.root = right._empty_copy().root
+        return tree
+
+    @staticmethod
+    def _check_joinable(left: 'ATree[T]', right: 'ATree[T]') -> None:
+        """ Raise ValueError before any tree is modified if trees differ in type or settings """
+        if type(left) is not type(right):
+            raise ValueError(f"cannot join {type(left).__name__} with {type(right).__name__}")
+        if left._settings() != right._settings():
+            raise ValueError(f"cannot join trees with different settings: {left._settings()}, {right._settings()}")
+
+    def _settings(self) -> tuple:
+        """ Return constructor arguments of the tree, trees are joined only with the same settings """
+        return ()
+
+    def _empty_copy(self) -> 'ATree[T]':
+        """ Return new empty tree with the same settings """
+        raise NotImplementedError(f"{type(self).__name__} does not support split and join")
+
+    def _split_root(self, key) -> Tuple:
+        """ Split tree structure to roots of trees with smaller and bigger or equal keys
+
+        Prev/nxt chain is already cut by split.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support split and join")
+
+    def _join_roots(self, left_root, key, value, right_root) -> T:
+        """ Make new node and join it with subtrees to root of this tree, return the new node
+
+        The new node is linked to prev/nxt chain by join_with_key.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support split and join")
+
+    def _rebuild_is_cheaper(self, batch_size: int, grow: int) -> bool:
+        """ Compare rebuild of whole tree with batch_size single operations
+
+        grow - how much the tree grows by the batch
+        Trees without sizes count nodes along the chain, counting stops as soon
+        as the tree is too big for rebuild to be cheaper.
+        """
+        def single_cost(size):
+            return batch_size * self.BATCH_LEVEL_COST * log2(size + grow + 2)
+
+        if self.sizes:
+            size = len(self)
+            return size + batch_size < single_cost(size)
+
+        size = 0
+        node = self.findmin()
+        while node is not None:
+            size += 1
+            if size % 1024 == 0 and size >= single_cost(size):
+                return False
+            node = node.nxt
+        return size + batch_size < single_cost(size)
+
+    @staticmethod
+    def _sorted_nodes(pairs: Iterable[Tuple], make_node: Callable[..., T]) -> List[T]:
+        """ Make nodes from (key, value) pairs sorted by key and link them to chain
+
+        Raise ValueError if keys are not strictly increasing
+        """
+        nodes: List[T] = []
+        prev_node = None
+        for key, value in pairs:
+            if prev_node is not None and not prev_node.key < key:
+                raise ValueError(f"keys are not strictly increasing: {prev_node.key}, {key}")
+            node = make_node(key, value)
+            node.prev = prev_node
+            if prev_node is not None:
+                prev_node.nxt = node
+            nodes.append(node)
+            prev_node = node
+        return nodes
+
     def _add_node_to_chain(self, node: T,
                            prev_node: Optional[T], nxt_node: Optional[T]):
         node.prev, node.nxt = prev_node, nxt_node
@@ -97,64 +395,169 @@ BN = TypeVar('BN', bound=BinaryNode)
 
 
 class ABinarySearchTree(ATree[BN]):
+    """ Binary search tree with optional cached aggregates of values in subtrees
+
+    combine - associative function of two values (e.g. operator.add, min, max)
+    identity - identity value of combine (e.g. 0 for operator.add)
+    sizes - nodes keep sizes of their subtrees for O(log n) select, rank and len
+    node_class - class of new nodes, nodes with size and agg slots only if tree
+    has sizes and combine
+    """
     root: BN
+    combine: Optional[Callable] = None
+    identity = None
+
+    def _update_aggregate(self, node: BN) -> None:
+        """ Recompute node.agg from its children, used only if tree has combine function """
+        combine = self.combine
+        agg = node.value
+        if not node.left.external:
+            agg = combine(node.left.agg, agg)
+        if not node.right.external:
+            agg = combine(agg, node.right.agg)
+        node.agg = agg
+
+    def aggregate(self, lo, hi):
+        """ Return combined values of nodes with lo <= key < hi in O(log n)
+
+        Values are combined in key order, identity is returned for empty range.
+        """
+        if self.combine is None:
+            raise ValueError("tree was created without combine function")
+        combine = self.combine
+
+        # the highest node in range, both range borders are below it
+        node = self.root
+        while not node.external:
+            if node.key < lo:
+                node = node.right
+            elif not node.key < hi:
+                node = node.left
+            else:
+                break
+        if node.external:
+            return self.identity
+
+        # nodes bigger or equal to lo in the left subtree
+        left_agg = self.identity
+        child = node.left
+        while not child.external:
+            if child.key < lo:
+                child = child.right
+            else:
+                if not child.right.external:
+                    left_agg = combine(child.right.agg, left_agg)
+                left_agg = combine(child.value, left_agg)
+                child = child.left
+
+        # nodes smaller than hi in the right subtree
+        right_agg = self.identity
+        child = node.right
+        while not child.external:
+            if not child.key < hi:
+                child = child.left
+            else:
+                if not child.left.external:
+                    right_agg = combine(right_agg, child.left.agg)
+                right_agg = combine(right_agg, child.value)
+                child = child.right
 
-    def find(self, key) -> Optional[BN]:
-        def _find(key, node: BN) -> Optional[BN]:
-            if node.external:
-                return None
+        return combine(combine(left_agg, node.value), right_agg)
 
-            if node.key == key:
+    def find(self, key) -> Optional[BN]:
+        # one comparison per level, equality is checked only with the last
+        # node not bigger than key
+        node = self.root
+        candidate = None
+        while not node.external:
+            if key < node.key:
+                node = node.left
+            else:
+                candidate = node
+                node = node.right
+        if candidate is not None and candidate.key == key:
+            return candidate
+        return None
+
+    def __len__(self) -> int:
+        if not self.sizes:
+            return super().__len__()
+        return self.root.size
+
+    def select(self, k: int) -> BN:
+        if not self.sizes:
+            return super().select(k)
+        node = self.root
+        if not 0 <= k < node.size:
+            raise IndexError("tree index out of range")
+        while True:
+            left_size = node.left.size
+            if k < left_size:
+                node = node.left
+            elif k == left_size:
                 return node
-            elif node.key < key:
-                return _find(key, node.right)
             else:
-                return _find(key, node.left)
-        return _find(key, self.root)
+                k -= left_size + 1
+                node = node.right
+
+    def rank(self, key) -> int:
+        if not self.sizes:
+            return super().rank(key)
+        ret = 0
+        node = self.root
+        while not node.external:
+            if node.key < key:
+                ret += node.left.size + 1
+                node = node.right
+            else:
+                node = node.left
+        return ret
 
     def _find_bigger(self, node: BN, key) -> Optional[BN]:
         """ Find the node with lowest bigger key """
-        if node.external:
-            return None
-
-        if key < node.key:
-            ret = self._find_bigger(node.left, key)
-            if ret is None:
-                return node
-            return ret
-        else:
-            return self._find_bigger(node.right, key)
+        ret = None
+        while not node.external:
+            if key < node.key:
+                ret = node
+                node = node.left
+            else:
+                node = node.right
+        return ret
+
+    def _find_bigger_or_equal(self, node: BN, key) -> Optional[BN]:
+        """ Find the node with the lowest key which is not smaller than key """
+        ret = None
+        while not node.external:
+            if node.key < key:
+                node = node.right
+            else:
+                ret = node
+                node = node.left
+        return ret
 
     def _find_lower(self, node: BN, key) -> Optional[BN]:
         """ Find the node with the largest smaller key """
-        if node.external:
-            return None
-
-        if key > node.key:
-            ret = self._find_lower(node.right, key)
-            if ret is None:
-                return node
-            return ret
-        else:
-            return self._find_lower(node.left, key)
-
-    def findmin(self) -> Optional[BN]:
-        def _findmin(node):
-            if node == self.EXTERNAL_NODE:
-                return None
-            if node.left == self.EXTERNAL_NODE:
-                return node
+        ret = None
+        while not node.external:
+            if key > node.key:
+                ret = node
+                node = node.right
             else:
-                return _findmin(node.left)
+                node = node.left
+        return ret
 
-        return _findmin(self.root)
+    def findmin(self) -> Optional[BN]:
+        node = self.root
+        if node.external:
+            return None
+        while not node.left.external:
+            node = node.left
+        return node
 
     def findmax(self) -> Optional[BN]:
-        def _findmax(node):
-            if node == self.EXTERNAL_NODE:
-                return None
-            if node.right == self.EXTERNAL_NODE:
-                return node
-            else:
-                return _findmax(node.right)
-        return _findmax(self.root)
+        node = self.root
+        if node.external:
+            return None
+        while not node.right.external:
+            node = node.right
+        return node
@@ -0,0 +1,233 @@
+""" Opt-in counters and timing histograms of tree internals
+
+`instrument(tree)` replaces methods of one tree instance by counting wrappers,
+`uninstrument(tree)` removes them again. Trees which are not instrumented
+run class methods directly, so disabled instrumentation costs nothing.
+
+Comparisons are counted by wrapping search keys passed to the tree. Keys
+passed to insert are stored by the tree, so they are never wrapped: insert
+searches its key the same way as find, the search is run with wrapped key
+first and the plain key is inserted. Comparisons of internal searches for
+stored keys (predecessor of deleted key in AB and LLRB trees) are not counted.
+"""
+
+from ab_tree import ABTree
+from async_tree import LatencyHistogram
+from functools import wraps
+from generic import ATree
+from typing import Callable, Dict, List, Optional
+import time
+
+
+COUNTERS = {
+    "comparisons": "key comparisons",
+    "descents": "searches from the root",
+    "neighbour_searches": "extra predecessor and successor searches",
+    "rotations": "single rotations",
+    "double_rotations": "AVL double rotations (their single rotations are counted too)",
+    "color_flips": "LLRB color flips",
+    "move_red_left": "LLRB _move_red_left calls",
+    "move_red_right": "LLRB _move_red_right calls",
+    "splits": "AB tree vertex splits",
+    "merges": "AB tree vertex merges",
+    "borrows": "AB tree borrows from neighbour vertex",
+}
+TIMED = ("insert", "delete", "find", "rank", "select", "count_range", "aggregate")
+# methods with search key arguments, comparisons with them are counted
+KEY_ARGUMENTS = {"delete": 1, "find": 1, "rank": 1, "split": 1,
+                 "range": 2, "count_range": 2, "aggregate": 2}
+DESCENTS = ("insert", "delete", "find", "rank", "select", "aggregate")
+NEIGHBOUR_SEARCHES = ("_find_lower", "_find_bigger", "_find_bigger_or_equal")
+# method -> counter, counted on every call
+CALL_COUNTERS = {
+    "_rotation": "rotations",
+    "_left_rotation": "rotations",
+    "_right_rotation": "rotations",
+    "_double_rotation": "double_rotations",
+    "_flip_colors": "color_flips",
+    "_move_red_left": "move_red_left",
+    "_move_red_right": "move_red_right",
+    "_split_vertex": "splits",
+}
+
+
+class TreeStats:
+    """ Counters and per-operation latency histograms of instrumented trees
+
+    counters - counts by names from COUNTERS
+    latency - LatencyHistogram of every operation from TIMED
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.counters: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+        self.latency: Dict[str, LatencyHistogram] = {name: LatencyHistogram() for name in TIMED}
+
+    def as_dict(self) -> dict:
+        """ Return counters and nonempty histograms as (upper bound, count) buckets """
+        latency = {}
+        for name, histogram in self.latency.items():
+            if histogram.count:
+                latency[name] = {
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "buckets": [(bound, count) for bound, count in zip(histogram.bounds, histogram.counts)
+                                if count],
+                }
+        return {"counters": dict(self.counters), "latency": latency}
+
+    def prometheus(self, prefix: str = "tree", labels: Optional[Dict[str, str]] = None) -> str:
+        """ Return counters and histograms in Prometheus text exposition format """
+        labels = labels or {}
+
+        def _labels(**extra) -> str:
+            items = {**labels, **extra}
+            if not items:
+                return ""
+            return "{" + ",".join(f'{key}="{value}"' for key, value in items.items()) + "}"
+
+        lines: List[str] = []
+        for name, help_text in COUNTERS.items():
+            lines.append(f"# HELP {prefix}_{name}_total Number of {help_text}")
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total{_labels()} {self.counters[name]}")
+
+        name = f"{prefix}_operation_seconds"
+        lines.append(f"# HELP {name} Latency of tree operations")
+        lines.append(f"# TYPE {name} histogram")
+        for operation, histogram in self.latency.items():
+            if not histogram.count:
+                continue
+            # buckets are cumulative, empty buckets above the last latency are left out
+            last = max(idx for idx, count in enumerate(histogram.counts) if count)
+            seen = 0
+            for bound, count in zip(histogram.bounds[:last], histogram.counts):
+                seen += count
+                lines.append(f"{name}_bucket{_labels(operation=operation, le=f'{bound:.3g}')} {seen}")
+            lines.append(f"{name}_bucket{_labels(operation=operation, le='+Inf')} {histogram.count}")
+            lines.append(f"{name}_sum{_labels(operation=operation)} {histogram.sum}")
+            lines.append(f"{name}_count{_labels(operation=operation)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+class _CountedKey:
+    """ Search key which counts its comparisons, it is never stored in the tree """
+    __slots__ = ("key", "stats")
+
+    def __init__(self, key, stats: TreeStats):
+        self.key = key
+        self.stats = stats
+
+    def _count(self) -> None:
+        self.stats.counters["comparisons"] += 1
+
+    def __eq__(self, other):
+        self._count()
+        return self.key == (other.key if isinstance(other, _CountedKey) else other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        self._count()
+        return self.key < (other.key if isinstance(other, _CountedKey) else other)
+
+    def __gt__(self, other):
+        self._count()
+        return self.key > (other.key if isinstance(other, _CountedKey) else other)
+
+    def __le__(self, other):
+        self._count()
+        return self.key <= (other.key if isinstance(other, _CountedKey) else other)
+
+    def __ge__(self, other):
+        self._count()
+        return self.key >= (other.key if isinstance(other, _CountedKey) else other)
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return repr(self.key)
+
+
+def _wrap(tree: ATree, name: str, stats: TreeStats) -> Callable:
+    method = getattr(type(tree), name).__get__(tree)
+    counter = CALL_COUNTERS.get(name)
+    if counter is None and name in NEIGHBOUR_SEARCHES:
+        counter = "neighbour_searches"
+    if counter is None and name in DESCENTS:
+        counter = "descents"
+    keys = KEY_ARGUMENTS.get(name, 0)
+    timed = name in TIMED
+
+    if name == "insert":
+        # find of the class, not the counting wrapper of this instance
+        search = type(tree).find.__get__(tree)
+
+        @wraps(method)
+        def insert(key, value, *args, **kwargs):
+            stats.counters["descents"] += 1
+            search(_CountedKey(key, stats))
+            start = time.perf_counter()
+            result = method(key, value, *args, **kwargs)
+            stats.latency["insert"].record(time.perf_counter() - start)
+            return result
+        return insert
+
+    if name == "_solve_underfull":
+        @wraps(method)
+        def solve_underfull(underfull_vertex, neighbour_vertex, *args):
+            # the same condition as in ABTree._solve_underfull
+            stats.counters["merges" if len(neighbour_vertex.keys) == tree.a - 1 else "borrows"] += 1
+            return method(underfull_vertex, neighbour_vertex, *args)
+        return solve_underfull
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        if counter is not None:
+            stats.counters[counter] += 1
+        if keys:
+            args = tuple(arg if idx >= keys or isinstance(arg, _CountedKey) else _CountedKey(arg, stats)
+                         for idx, arg in enumerate(args))
+        if not timed:
+            result = method(*args, **kwargs)
+        else:
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            stats.latency[name].record(time.perf_counter() - start)
+        return result
+    return wrapper
+
+
+def instrument(tree: ATree, stats: Optional[TreeStats] = None) -> TreeStats:
+    """ Count internals of tree to stats (new TreeStats by default), return stats
+
+    Methods of this instance only are replaced, other trees are not affected.
+    More trees may share one stats. Trees which search keys other way than by
+    comparison operators (NumpyBPlusTree) are rejected.
+    """
+    if not isinstance(tree, ATree) or not tree.WRAPPED_KEYS:
+        raise TypeError(f"instrumentation does not support {type(tree).__name__}")
+    if stats is None:
+        stats = TreeStats()
+    uninstrument(tree)
+    names = (set(TIMED) | set(KEY_ARGUMENTS) | set(DESCENTS) | set(NEIGHBOUR_SEARCHES)
+             | set(CALL_COUNTERS) | {"_solve_underfull"})
+    wrapped = []
+    if not isinstance(tree, ABTree):
+        # B+ tree has _solve_underfull with other arguments
+        names.discard("_solve_underfull")
+    for name in sorted(names):
+        if hasattr(type(tree), name):
+            setattr(tree, name, _wrap(tree, name, stats))
+            wrapped.append(name)
+    tree._instrumented = wrapped
+    return stats
+
+
+def uninstrument(tree: ATree) -> None:
+    """ Remove counting wrappers of instrument from tree """
+    for name in tree.__dict__.pop("_instrumented", []):
+        delattr(tree, name)
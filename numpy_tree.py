@@ -0,0 +1,156 @@
+""" B+ tree with leaves in NumPy arrays for 64-bit integer keys, needs numpy """
+
+from bplus_tree import BPlusNode, BPlusTree, BPlusVertex
+from typing import Iterable, Optional, Tuple
+import numpy as np
+
+
+class NumpyBPlusTree(BPlusTree):
+    """ BPlusTree with int64 keys and values of value_dtype in NumPy arrays of leaves
+
+    Internal vertices keep separators in lists like BPlusTree. Insert and delete
+    copy arrays of one leaf, so big vertices (e.g. (64, 128)) are not slower
+    than small ones. find_many searches whole batch of keys with NumPy.
+    Keys and values of returned nodes are NumPy scalars.
+    """
+    # leaves search keys by np.searchsorted, which converts them to int64
+    WRAPPED_KEYS = False
+
+    def __init__(self, a: int, b: int, value_dtype=np.int64):
+        super().__init__(a, b)
+        self.value_dtype = np.dtype(value_dtype)
+        self.root = self._new_leaf([], [])
+
+    def _new_leaf(self, keys, values) -> BPlusVertex:
+        return BPlusVertex(np.asarray(keys, dtype=np.int64), np.asarray(values, dtype=self.value_dtype), [], True)
+
+    @classmethod
+    def from_sorted(cls, pairs: Iterable[Tuple], a: int, b: int, fill: float = 1.0,  # type: ignore[override]
+                    value_dtype=np.int64) -> 'NumpyBPlusTree':
+        """ Build tree from (key, value) pairs sorted by key in linear time, see BPlusTree.from_sorted """
+        tree = super().from_sorted(pairs, a, b, fill)
+        tree.value_dtype = np.dtype(value_dtype)
+        leaf = tree.root
+        while not leaf.leaf:
+            leaf = leaf.children[0]
+        while leaf is not None:
+            leaf.keys = np.asarray(leaf.keys, dtype=np.int64)
+            leaf.values = np.asarray(leaf.values, dtype=tree.value_dtype)
+            leaf = leaf.nxt
+        # separators are python ints, bisect compares them faster
+        vertices = [tree.root]
+        while vertices and not vertices[0].leaf:
+            for vertex in vertices:
+                vertex.keys = [int(key) for key in vertex.keys]
+            vertices = [child for vertex in vertices for child in vertex.children]
+        return tree
+
+    def _rebuild(self, pairs: Iterable[Tuple]) -> None:
+        self.root = self.from_sorted(pairs, self.a, self.b, value_dtype=self.value_dtype).root
+
+    def find(self, key) -> Optional[BPlusNode]:
+        leaf = self._leaf(self.root, key)
+        idx = int(leaf.keys.searchsorted(key))
+        if idx < len(leaf.keys) and leaf.keys[idx] == key:
+            return BPlusNode(leaf, idx)
+        return None
+
+    def find_many(self, keys) -> Tuple[np.ndarray, np.ndarray]:
+        """ Find batch of keys, return (values, found) arrays in order of keys
+
+        Values of missing keys are zeros. The batch is sorted (if it is not) and
+        routed down the tree at once, every visited vertex splits its part of
+        the batch between children by np.searchsorted and every leaf searches
+        its part by np.searchsorted, so Python work is per visited vertex, not per key.
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        order = None
+        if len(keys) > 1 and not (keys[1:] >= keys[:-1]).all():
+            order = np.argsort(keys, kind="stable")
+            keys = keys[order]
+        values = np.zeros(len(keys), dtype=self.value_dtype)
+        found = np.zeros(len(keys), dtype=bool)
+
+        # (vertex, start, end) - keys[start:end] belong to subtree of vertex
+        stack = [(self.root, 0, len(keys))]
+        while stack:
+            vertex, start, end = stack.pop()
+            if vertex.leaf:
+                if len(vertex.keys) == 0:
+                    continue
+                batch = keys[start:end]
+                idx = vertex.keys.searchsorted(batch)
+                np.minimum(idx, len(vertex.keys) - 1, out=idx)
+                hit = vertex.keys[idx] == batch
+                found[start:end] = hit
+                values[start:end][hit] = vertex.values[idx[hit]]
+                continue
+            bounds = (keys[start:end].searchsorted(vertex.keys) + start).tolist()
+            for child, child_start, child_end in zip(vertex.children, [start, *bounds], [*bounds, end]):
+                if child_start < child_end:
+                    stack.append((child, child_start, child_end))
+
+        if order is not None:
+            unsorted_values, unsorted_found = np.empty_like(values), np.empty_like(found)
+            unsorted_values[order] = values
+            unsorted_found[order] = found
+            return unsorted_values, unsorted_found
+        return values, found
+
+    def _insert(self, vertex: BPlusVertex, key, value) -> Tuple[bool, object, Optional[BPlusVertex]]:
+        if not vertex.leaf:
+            return super()._insert(vertex, key, value)
+        idx = int(vertex.keys.searchsorted(key))
+        if idx < len(vertex.keys) and vertex.keys[idx] == key:
+            # key is alread in tree
+            return (False, None, None)
+        vertex.keys = np.insert(vertex.keys, idx, key)
+        vertex.values = np.insert(vertex.values, idx, value)
+        vertex.size += 1
+        if len(vertex.keys) == self.b:
+            return (True, *self._split_vertex(vertex))
+        return (True, None, None)
+
+    def _split_vertex(self, vertex: BPlusVertex) -> Tuple[object, BPlusVertex]:
+        if not vertex.leaf:
+            return super()._split_vertex(vertex)
+        mid = len(vertex.keys) // 2
+        right = self._new_leaf(vertex.keys[mid:], vertex.values[mid:])
+        vertex.keys, vertex.values = vertex.keys[:mid].copy(), vertex.values[:mid].copy()
+        right.prev, right.nxt = vertex, vertex.nxt
+        if vertex.nxt is not None:
+            vertex.nxt.prev = right
+        vertex.nxt = right
+        vertex.size = mid
+        return int(right.keys[0]), right
+
+    def _delete(self, vertex: BPlusVertex, key) -> bool:
+        if not vertex.leaf:
+            return super()._delete(vertex, key)
+        idx = int(vertex.keys.searchsorted(key))
+        if idx == len(vertex.keys) or vertex.keys[idx] != key:
+            return False
+        vertex.keys = np.delete(vertex.keys, idx)
+        vertex.values = np.delete(vertex.values, idx)
+        vertex.size -= 1
+        return True
+
+    def _solve_underfull(self, parent: BPlusVertex, idx: int) -> None:
+        """ Merge leaves idx and idx + 1 of parent if they fit to one leaf, otherwise
+        split their keys evenly (arrays are copied anyway) """
+        left, right = parent.children[idx], parent.children[idx + 1]
+        if not left.leaf:
+            return super()._solve_underfull(parent, idx)
+        keys = np.concatenate((left.keys, right.keys))
+        values = np.concatenate((left.values, right.values))
+        if len(keys) < self.b:
+            left.keys, left.values, left.size = keys, values, len(keys)
+            left.nxt = right.nxt
+            if right.nxt is not None:
+                right.nxt.prev = left
+            del parent.keys[idx], parent.children[idx + 1]
+            return
+        mid = len(keys) // 2
+        left.keys, left.values, left.size = keys[:mid], values[:mid], mid
+        right.keys, right.values, right.size = keys[mid:], values[mid:], len(keys) - mid
+        parent.keys[idx] = int(right.keys[0])
@@ -0,0 +1,410 @@
+""" Persistent (immutable) AVL and LLRB trees
+
+insert and delete return new version of tree, which shares all untouched
+subtrees with the old version, so every version costs O(log n) new nodes.
+Nodes are never modified after they are published in a version, so there
+is no prev/nxt chain, ordered iteration walks the tree with a stack.
+"""
+
+from typing import Iterator, List, Optional
+
+
+class PersistentNode:
+    """ Node of persistent tree, it must not be modified once it is in a tree
+
+    size - number of nodes in subtree with this node as root
+    external - flag says if is it **real** node or helper node
+    """
+    __slots__ = ("key", "value", "left", "right", "size", "external")
+
+    def __init__(self, key, value=None, left=None, right=None, external: bool = False):
+        if value is None:
+            value = key
+        self.key = key
+        self.value = value
+        self.left = left
+        self.right = right
+        self.size = 0 if external else 1
+        self.external = external
+
+    def __repr__(self):
+        return f"Node( key: {self.key}, value: {self.value} )"
+
+
+class PersistentAvlNode(PersistentNode):
+    """ PersistentNode with depth, which is computed from children at construction """
+    __slots__ = ("depth",)
+
+    def __init__(self, key, value=None, left=None, right=None, external: bool = False):
+        super().__init__(key, value, left, right, external)
+        if external:
+            self.depth = 0
+        else:
+            self.depth = max(left.depth, right.depth) + 1
+            self.size = left.size + right.size + 1
+
+
+class PersistentRBNode(PersistentNode):
+    """ PersistentNode with color of edge to parent """
+    __slots__ = ("red",)
+
+    def __init__(self, key, value=None, left=None, right=None, external: bool = False, red: bool = True):
+        super().__init__(key, value, left, right, external)
+        self.red = red
+
+
+class APersistentTree:
+    """ Read-only operations shared by persistent trees """
+    root: PersistentNode
+
+    def find(self, key) -> Optional[PersistentNode]:
+        # one comparison per level like ABinarySearchTree.find
+        node = self.root
+        candidate = None
+        while not node.external:
+            if key < node.key:
+                node = node.left
+            else:
+                candidate = node
+                node = node.right
+        if candidate is not None and candidate.key == key:
+            return candidate
+        return None
+
+    def findmin(self) -> Optional[PersistentNode]:
+        node = self.root
+        if node.external:
+            return None
+        while not node.left.external:
+            node = node.left
+        return node
+
+    def findmax(self) -> Optional[PersistentNode]:
+        node = self.root
+        if node.external:
+            return None
+        while not node.right.external:
+            node = node.right
+        return node
+
+    def __len__(self) -> int:
+        return self.root.size
+
+    def select(self, k: int) -> PersistentNode:
+        node = self.root
+        if not 0 <= k < node.size:
+            raise IndexError("tree index out of range")
+        while True:
+            left_size = node.left.size
+            if k < left_size:
+                node = node.left
+            elif k == left_size:
+                return node
+            else:
+                k -= left_size + 1
+                node = node.right
+
+    def rank(self, key) -> int:
+        ret = 0
+        node = self.root
+        while not node.external:
+            if node.key < key:
+                ret += node.left.size + 1
+                node = node.right
+            else:
+                node = node.left
+        return ret
+
+    def count_range(self, lo, hi) -> int:
+        """ Return number of keys with lo <= key < hi """
+        return max(0, self.rank(hi) - self.rank(lo))
+
+    def range(self, lo, hi, reverse: bool = False) -> Iterator[PersistentNode]:
+        """ Lazily yield nodes with lo <= key < hi in increasing order (decreasing if reverse)
+
+        Stack holds the nodes on path whose subtree is not yielded yet, O(log n) memory.
+        """
+        stack: List[PersistentNode] = []
+        node = self.root
+        if reverse:
+            while not node.external or stack:
+                if not node.external:
+                    if node.key < hi:
+                        stack.append(node)
+                        node = node.right
+                    else:
+                        node = node.left
+                else:
+                    node = stack.pop()
+                    if node.key < lo:
+                        return
+                    yield node
+                    node = node.left
+        else:
+            while not node.external or stack:
+                if not node.external:
+                    if not node.key < lo:
+                        stack.append(node)
+                        node = node.left
+                    else:
+                        node = node.right
+                else:
+                    node = stack.pop()
+                    if not node.key < hi:
+                        return
+                    yield node
+                    node = node.right
+
+    def __iter__(self) -> Iterator[PersistentNode]:
+        """ Yield all nodes in increasing order """
+        stack: List[PersistentNode] = []
+        node = self.root
+        while not node.external or stack:
+            if not node.external:
+                stack.append(node)
+                node = node.left
+            else:
+                node = stack.pop()
+                yield node
+                node = node.right
+
+
+class PersistentAvlTree(APersistentTree):
+    """ Persistent AVL tree, insert and delete return new version of tree """
+    EXTERNAL_NODE = PersistentAvlNode(0, external=True)
+    EXTERNAL_NODE.left = EXTERNAL_NODE
+    EXTERNAL_NODE.right = EXTERNAL_NODE
+
+    def __init__(self, root: Optional[PersistentAvlNode] = None):
+        self.root = self.EXTERNAL_NODE if root is None else root
+
+    def insert(self, key, value=None) -> 'PersistentAvlTree':
+        """ Return version with inserted key, if key exists the same version is returned """
+        root = self._insert(self.root, key, value)
+        return self if root is self.root else PersistentAvlTree(root)
+
+    def _insert(self, node: PersistentAvlNode, key, value) -> PersistentAvlNode:
+        if node.external:
+            return PersistentAvlNode(key, value, self.EXTERNAL_NODE, self.EXTERNAL_NODE)
+        if key == node.key:
+            return node
+        if key < node.key:
+            left = self._insert(node.left, key, value)
+            return node if left is node.left else self._balance(node, left, node.right)
+        right = self._insert(node.right, key, value)
+        return node if right is node.right else self._balance(node, node.left, right)
+
+    def delete(self, key) -> 'PersistentAvlTree':
+        """ Return version without key, if key doesn't exist the same version is returned """
+        root = self._delete(self.root, key)
+        return self if root is self.root else PersistentAvlTree(root)
+
+    def _delete(self, node: PersistentAvlNode, key) -> PersistentAvlNode:
+        if node.external:
+            return node
+        if key < node.key:
+            left = self._delete(node.left, key)
+            return node if left is node.left else self._balance(node, left, node.right)
+        if node.key < key:
+            right = self._delete(node.right, key)
+            return node if right is node.right else self._balance(node, node.left, right)
+
+        if node.left.external:
+            return node.right
+        if node.right.external:
+            return node.left
+        # node is replaced by the biggest node of left subtree
+        left, prev_node = self._delete_max(node.left)
+        return self._balance(prev_node, left, node.right)
+
+    def _delete_max(self, node: PersistentAvlNode):
+        """ Return subtree without its biggest node and the removed node """
+        if node.right.external:
+            return node.left, node
+        right, removed = self._delete_max(node.right)
+        return self._balance(node, node.left, right), removed
+
+    def _balance(self, node: PersistentAvlNode, left: PersistentAvlNode,
+                 right: PersistentAvlNode) -> PersistentAvlNode:
+        """ Make new node with key and value of node and given balanced subtrees
+        differing in depth at most by 2, rotations create new nodes
+        """
+        make = PersistentAvlNode
+        if left.depth > right.depth + 1:
+            if left.left.depth >= left.right.depth:
+                return make(left.key, left.value, left.left, make(node.key, node.value, left.right, right))
+            mid = left.right
+            return make(mid.key, mid.value, make(left.key, left.value, left.left, mid.left),
+                        make(node.key, node.value, mid.right, right))
+        if right.depth > left.depth + 1:
+            if right.right.depth >= right.left.depth:
+                return make(right.key, right.value, make(node.key, node.value, left, right.left), right.right)
+            mid = right.left
+            return make(mid.key, mid.value, make(node.key, node.value, left, mid.left),
+                        make(right.key, right.value, mid.right, right.right))
+        return make(node.key, node.value, left, right)
+
+    def validate(self) -> bool:
+        def _validate(node: PersistentAvlNode) -> bool:
+            if node.external:
+                return True
+            return node.depth == max(node.left.depth, node.right.depth) + 1 and \
+                node.size == node.left.size + node.right.size + 1 and \
+                abs(node.left.depth - node.right.depth) <= 1 and \
+                _validate(node.left) and _validate(node.right)
+        return self.EXTERNAL_NODE.depth == 0 and _validate(self.root)
+
+
+class PersistentRBTree(APersistentTree):
+    """ Persistent left leaning red black tree, insert and delete return new version of tree
+
+    Nodes on the path are copied and the copies are fixed in place like
+    in recursive LLRB, every node is copied before it is modified.
+    """
+    EXTERNAL_NODE = PersistentRBNode(0, external=True, red=False)
+    EXTERNAL_NODE.left = EXTERNAL_NODE
+    EXTERNAL_NODE.right = EXTERNAL_NODE
+
+    def __init__(self, root: Optional[PersistentRBNode] = None):
+        self.root = self.EXTERNAL_NODE if root is None else root
+
+    @staticmethod
+    def _copy(node: PersistentRBNode) -> PersistentRBNode:
+        copy = PersistentRBNode(node.key, node.value, node.left, node.right, red=node.red)
+        copy.size = node.size
+        return copy
+
+    def insert(self, key, value=None) -> 'PersistentRBTree':
+        """ Return version with inserted key, if key exists the same version is returned """
+        root = self._insert(self.root, key, value)
+        if root is self.root:
+            return self
+        root.red = False
+        return PersistentRBTree(root)
+
+    def _insert(self, node: PersistentRBNode, key, value) -> PersistentRBNode:
+        if node.external:
+            return PersistentRBNode(key, value, self.EXTERNAL_NODE, self.EXTERNAL_NODE)
+        if key == node.key:
+            return node
+        if key < node.key:
+            left = self._insert(node.left, key, value)
+            if left is node.left:
+                return node
+            node = self._copy(node)
+            node.left = left
+        else:
+            right = self._insert(node.right, key, value)
+            if right is node.right:
+                return node
+            node = self._copy(node)
+            node.right = right
+        return self._fix_up(node)
+
+    def delete(self, key) -> 'PersistentRBTree':
+        """ Return version without key, if key doesn't exist the same version is returned """
+        if self.find(key) is None:
+            return self
+        root = self._copy(self.root)
+        if not root.left.red and not root.right.red:
+            root.red = True
+        root = self._delete(root, key)
+        root.red = False
+        return PersistentRBTree(root)
+
+    def _delete(self, node: PersistentRBNode, key) -> PersistentRBNode:
+        """ Delete key from copied node, key must be in subtree """
+        if key < node.key:
+            if not node.left.red and not node.left.left.red:
+                node = self._move_red_left(node)
+            node.left = self._delete(self._copy(node.left), key)
+        else:
+            if node.left.red:
+                node = self._right_rotation(node)
+            if key == node.key and node.right.external:
+                return self.EXTERNAL_NODE
+            if not node.right.red and not node.right.left.red:
+                node = self._move_red_right(node)
+            if key == node.key:
+                # node takes key and value of the smallest node of right subtree
+                min_node = node.right
+                while not min_node.left.external:
+                    min_node = min_node.left
+                node.key, node.value = min_node.key, min_node.value
+                node.right = self._delete_min(self._copy(node.right))
+            else:
+                node.right = self._delete(self._copy(node.right), key)
+        return self._fix_up(node)
+
+    def _delete_min(self, node: PersistentRBNode) -> PersistentRBNode:
+        """ Delete the smallest key from copied node """
+        if node.left.external:
+            return self.EXTERNAL_NODE
+        if not node.left.red and not node.left.left.red:
+            node = self._move_red_left(node)
+        node.left = self._delete_min(self._copy(node.left))
+        return self._fix_up(node)
+
+    def _fix_up(self, node: PersistentRBNode) -> PersistentRBNode:
+        """ Fix invariants of copied node with valid subtrees """
+        if node.right.red and not node.left.red:
+            node = self._left_rotation(node)
+        if node.left.red and node.left.left.red:
+            node = self._right_rotation(node)
+        if node.left.red and node.right.red:
+            self._flip_colors(node)
+        node.size = node.left.size + node.right.size + 1
+        return node
+
+    def _left_rotation(self, node: PersistentRBNode) -> PersistentRBNode:
+        right_node = self._copy(node.right)
+        node.right = right_node.left
+        right_node.left = node
+        right_node.red, node.red = node.red, True
+        node.size = node.left.size + node.right.size + 1
+        right_node.size = node.size + right_node.right.size + 1
+        return right_node
+
+    def _right_rotation(self, node: PersistentRBNode) -> PersistentRBNode:
+        left_node = self._copy(node.left)
+        node.left = left_node.right
+        left_node.right = node
+        left_node.red, node.red = node.red, True
+        node.size = node.left.size + node.right.size + 1
+        left_node.size = left_node.left.size + node.size + 1
+        return left_node
+
+    def _flip_colors(self, node: PersistentRBNode) -> None:
+        node.red = not node.red
+        node.left = self._copy(node.left)
+        node.left.red = not node.left.red
+        node.right = self._copy(node.right)
+        node.right.red = not node.right.red
+
+    def _move_red_left(self, node: PersistentRBNode) -> PersistentRBNode:
+        self._flip_colors(node)
+        if node.right.left.red:
+            node.right = self._right_rotation(node.right)
+            node = self._left_rotation(node)
+            self._flip_colors(node)
+        return node
+
+    def _move_red_right(self, node: PersistentRBNode) -> PersistentRBNode:
+        self._flip_colors(node)
+        if node.left.left.red:
+            node = self._right_rotation(node)
+            self._flip_colors(node)
+        return node
+
+    def validate(self) -> bool:
+        def _validate(node: PersistentRBNode):
+            """ Return black height of subtree and its validity """
+            if node.external:
+                return (1, True)
+            lc, lo = _validate(node.left)
+            rc, ro = _validate(node.right)
+            valid = not node.right.red and not (node.red and node.left.red) and \
+                node.size == node.left.size + node.right.size + 1
+            return (lc + (0 if node.red else 1), lc == rc and lo and ro and valid)
+        _, ret = _validate(self.root)
+        return ret and not self.root.red and not self.EXTERNAL_NODE.red
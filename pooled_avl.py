@@ -0,0 +1,429 @@
+from array import array
+from typing import Iterable, List, Optional, Tuple
+from generic import ATree
+
+
+EXTERNAL = 0
+
+
+class NodePool:
+    """ Struct of arrays which holds nodes of PooledAvlTree
+
+    Node is an index to columns below, index 0 is external node and it is
+    also used as None in prev and nxt links.
+
+    keys, values - key and value of node
+    left, right - indices of child nodes
+    prev, nxt - indices of closest smaller and bigger node
+    depth - depth of subtree with this node as root
+    size - number of nodes in subtree with this node as root, None if tree has no sizes
+    free - first index in free list, released indices are chained through `left`
+    """
+    def __init__(self, sizes: bool = False):
+        self.keys: list = [None]
+        self.values: list = [None]
+        self.left = array('l', [EXTERNAL])
+        self.right = array('l', [EXTERNAL])
+        self.prev = array('l', [EXTERNAL])
+        self.nxt = array('l', [EXTERNAL])
+        self.depth = array('B', [0])
+        self.size = array('l', [0]) if sizes else None
+        self.free = EXTERNAL
+
+    def alloc(self, key, value=None) -> int:
+        """ Return index of new node, reuse released node if there is any """
+        if value is None:
+            value = key
+
+        idx = self.free
+        if idx != EXTERNAL:
+            self.free = self.left[idx]
+            self.keys[idx] = key
+            self.values[idx] = value
+            self.left[idx] = self.right[idx] = EXTERNAL
+            self.prev[idx] = self.nxt[idx] = EXTERNAL
+            self.depth[idx] = 1
+            if self.size is not None:
+                self.size[idx] = 1
+        else:
+            idx = len(self.keys)
+            self.keys.append(key)
+            self.values.append(value)
+            self.left.append(EXTERNAL)
+            self.right.append(EXTERNAL)
+            self.prev.append(EXTERNAL)
+            self.nxt.append(EXTERNAL)
+            self.depth.append(1)
+            if self.size is not None:
+                self.size.append(1)
+        return idx
+
+    def release(self, idx: int) -> None:
+        """ Return node to free list """
+        self.keys[idx] = self.values[idx] = None
+        self.left[idx] = self.free
+        self.free = idx
+
+
+class PooledNode:
+    """ View to one node of NodePool, it is valid until the node is deleted """
+    __slots__ = ("pool", "idx")
+
+    def __init__(self, pool: NodePool, idx: int):
+        self.pool = pool
+        self.idx = idx
+
+    @property
+    def key(self):
+        return self.pool.keys[self.idx]
+
+    @property
+    def value(self):
+        return self.pool.values[self.idx]
+
+    @property
+    def prev(self) -> 'Optional[PooledNode]':
+        idx = self.pool.prev[self.idx]
+        return PooledNode(self.pool, idx) if idx != EXTERNAL else None
+
+    @property
+    def nxt(self) -> 'Optional[PooledNode]':
+        idx = self.pool.nxt[self.idx]
+        return PooledNode(self.pool, idx) if idx != EXTERNAL else None
+
+    def __eq__(self, other):
+        return isinstance(other, PooledNode) and self.pool is other.pool and self.idx == other.idx
+
+    def __hash__(self):
+        return hash((id(self.pool), self.idx))
+
+    def __repr__(self):
+        return f"Node( key: {self.key}, value: {self.value} )"
+
+
+class PooledAvlTree(ATree):
+    """ AvlTree which keeps nodes in NodePool instead of AvlNode objects
+
+    Nodes are not python objects, so the tree needs much less memory.
+    Methods returning node return PooledNode view.
+    sizes - pool keeps sizes of subtrees for O(log n) select, rank and len
+    """
+    def __init__(self, sizes: bool = False):
+        self.pool = NodePool(sizes)
+        self.root = EXTERNAL
+        self.sizes = sizes
+
+    @classmethod
+    def from_sorted(cls, pairs: Iterable[Tuple], sizes: bool = False) -> 'PooledAvlTree':
+        """ Build balanced tree from (key, value) pairs sorted by key in linear time """
+        tree = cls(sizes)
+        pool = tree.pool
+        prev_idx = EXTERNAL
+        for key, value in pairs:
+            if prev_idx != EXTERNAL and not pool.keys[prev_idx] < key:
+                raise ValueError(f"keys are not strictly increasing: {pool.keys[prev_idx]}, {key}")
+            idx = pool.alloc(key, value)
+            tree._add_node_to_chain(idx, prev_idx, EXTERNAL)
+            prev_idx = idx
+
+        # nodes are allocated in key order from index 1
+        def _build(lo: int, hi: int) -> int:
+            if lo == hi:
+                return EXTERNAL
+            mid = (lo + hi) // 2
+            pool.left[mid] = _build(lo, mid)
+            pool.right[mid] = _build(mid + 1, hi)
+            tree._update(mid)
+            return mid
+
+        tree.root = _build(1, len(pool.keys))
+        return tree
+
+    def _rebuild(self, pairs: Iterable[Tuple]) -> None:
+        tree = self.from_sorted(pairs, self.sizes)
+        self.pool, self.root = tree.pool, tree.root
+
+    def _view(self, idx: int) -> Optional[PooledNode]:
+        return PooledNode(self.pool, idx) if idx != EXTERNAL else None
+
+    def find(self, key) -> Optional[PooledNode]:
+        keys, left, right = self.pool.keys, self.pool.left, self.pool.right
+        # one comparison per level like ABinarySearchTree.find
+        idx = self.root
+        candidate = EXTERNAL
+        while idx != EXTERNAL:
+            if key < keys[idx]:
+                idx = left[idx]
+            else:
+                candidate = idx
+                idx = right[idx]
+        if candidate != EXTERNAL and keys[candidate] == key:
+            return self._view(candidate)
+        return None
+
+    def __len__(self) -> int:
+        if not self.sizes:
+            return super().__len__()
+        return self.pool.size[self.root]
+
+    def select(self, k: int) -> PooledNode:
+        if not self.sizes:
+            return super().select(k)
+        pool = self.pool
+        idx = self.root
+        if not 0 <= k < pool.size[idx]:
+            raise IndexError("tree index out of range")
+        while True:
+            left_size = pool.size[pool.left[idx]]
+            if k < left_size:
+                idx = pool.left[idx]
+            elif k == left_size:
+                return PooledNode(pool, idx)
+            else:
+                k -= left_size + 1
+                idx = pool.right[idx]
+
+    def rank(self, key) -> int:
+        if not self.sizes:
+            return super().rank(key)
+        pool = self.pool
+        ret = 0
+        idx = self.root
+        while idx != EXTERNAL:
+            if pool.keys[idx] < key:
+                ret += pool.size[pool.left[idx]] + 1
+                idx = pool.right[idx]
+            else:
+                idx = pool.left[idx]
+        return ret
+
+    def _find_lower(self, idx: int, key) -> Optional[PooledNode]:
+        """ Find the node with the largest smaller key """
+        keys, left, right = self.pool.keys, self.pool.left, self.pool.right
+        ret = EXTERNAL
+        while idx != EXTERNAL:
+            if key > keys[idx]:
+                ret = idx
+                idx = right[idx]
+            else:
+                idx = left[idx]
+        return self._view(ret)
+
+    def _find_bigger_or_equal(self, idx: int, key) -> Optional[PooledNode]:
+        """ Find the node with the lowest key which is not smaller than key """
+        keys, left, right = self.pool.keys, self.pool.left, self.pool.right
+        ret = EXTERNAL
+        while idx != EXTERNAL:
+            if keys[idx] < key:
+                idx = right[idx]
+            else:
+                ret = idx
+                idx = left[idx]
+        return self._view(ret)
+
+    def findmin(self) -> Optional[PooledNode]:
+        left = self.pool.left
+        idx = self.root
+        if idx == EXTERNAL:
+            return None
+        while left[idx] != EXTERNAL:
+            idx = left[idx]
+        return self._view(idx)
+
+    def findmax(self) -> Optional[PooledNode]:
+        right = self.pool.right
+        idx = self.root
+        if idx == EXTERNAL:
+            return None
+        while right[idx] != EXTERNAL:
+            idx = right[idx]
+        return self._view(idx)
+
+    def insert(self, key, value) -> None:
+        keys, left, right = self.pool.keys, self.pool.left, self.pool.right
+        path: List[Tuple[int, bool]] = []
+        idx = self.root
+        lower = bigger = EXTERNAL
+        while idx != EXTERNAL:
+            if key < keys[idx]:
+                path.append((idx, True))
+                bigger = idx
+                idx = left[idx]
+            else:
+                path.append((idx, False))
+                lower = idx
+                idx = right[idx]
+        if lower != EXTERNAL and keys[lower] == key:
+            # key is alread in tree - nothing to do
+            return
+
+        new_idx = self.pool.alloc(key, value)
+        self._add_node_to_chain(new_idx, lower, bigger)
+        self._rebalance_path(path, new_idx)
+
+    def delete(self, key) -> None:
+        pool = self.pool
+        keys, left, right = pool.keys, pool.left, pool.right
+        path: List[Tuple[int, bool]] = []
+        idx = self.root
+        candidate, candidate_depth = EXTERNAL, 0
+        while idx != EXTERNAL:
+            if key < keys[idx]:
+                path.append((idx, True))
+                idx = left[idx]
+            else:
+                candidate, candidate_depth = idx, len(path)
+                path.append((idx, False))
+                idx = right[idx]
+
+        if candidate == EXTERNAL or keys[candidate] != key:
+            return
+        idx = candidate
+        del path[candidate_depth:]
+        self._remove_node_from_chain(idx)
+
+        if left[idx] == EXTERNAL:
+            self._rebalance_path(path, right[idx])
+        elif right[idx] == EXTERNAL:
+            self._rebalance_path(path, left[idx])
+        else:
+            # node is replaced by the biggest node of left subtree (prev node)
+            replace_idx = pool.prev[idx]
+            node_pos = len(path)
+            path.append((replace_idx, True))
+            parent = left[idx]
+            while parent != replace_idx:
+                path.append((parent, False))
+                parent = right[parent]
+            child = left[replace_idx]
+
+            left[replace_idx] = left[idx]
+            right[replace_idx] = right[idx]
+            pool.depth[replace_idx] = pool.depth[idx]
+            if self.sizes:
+                pool.size[replace_idx] = pool.size[idx]
+            self._link(path[:node_pos], replace_idx)
+            self._rebalance_path(path, child)
+
+        pool.release(idx)
+
+    def _add_node_to_chain(self, idx: int, prev_idx: int, nxt_idx: int):  # type: ignore[override]
+        pool = self.pool
+        pool.prev[idx], pool.nxt[idx] = prev_idx, nxt_idx
+        if prev_idx != EXTERNAL:
+            pool.nxt[prev_idx] = idx
+        if nxt_idx != EXTERNAL:
+            pool.prev[nxt_idx] = idx
+
+    def _remove_node_from_chain(self, idx: int):  # type: ignore[override]
+        pool = self.pool
+        prev_idx = pool.prev[idx]
+        nxt_idx = pool.nxt[idx]
+        if prev_idx != EXTERNAL:
+            pool.nxt[prev_idx] = nxt_idx
+        if nxt_idx != EXTERNAL:
+            pool.prev[nxt_idx] = prev_idx
+
+    def _link(self, path: 'List[Tuple[int, bool]]', idx: int) -> None:
+        """ Hang node as the child of the last node in path (or as root) """
+        if not path:
+            self.root = idx
+        else:
+            parent, left = path[-1]
+            if left:
+                self.pool.left[parent] = idx
+            else:
+                self.pool.right[parent] = idx
+
+    def _rebalance_path(self, path: 'List[Tuple[int, bool]]', idx: int) -> None:
+        """ Same as AvlTree._rebalance_path """
+        pool = self.pool
+        while path:
+            parent, left = path.pop()
+            old_depth = pool.depth[parent]
+            if left:
+                pool.left[parent] = idx
+            else:
+                pool.right[parent] = idx
+
+            idx = self._rebalance(parent)
+            if idx == parent and pool.depth[idx] == old_depth:
+                if self.sizes:
+                    for parent, _ in reversed(path):
+                        pool.size[parent] = pool.size[pool.left[parent]] + pool.size[pool.right[parent]] + 1
+                return
+
+        self.root = idx
+
+    def _balance(self, idx: int) -> int:
+        depth = self.pool.depth
+        return depth[self.pool.left[idx]] - depth[self.pool.right[idx]]
+
+    def _update(self, idx: int) -> None:
+        pool = self.pool
+        left, right = pool.left[idx], pool.right[idx]
+        pool.depth[idx] = max(pool.depth[left], pool.depth[right]) + 1
+        if self.sizes:
+            pool.size[idx] = pool.size[left] + pool.size[right] + 1
+
+    def _rebalance(self, idx: int) -> int:
+        """ Fix balance of node with balanced subtrees, return new root of subtree """
+        balance = self._balance(idx)
+        if balance > 1:
+            if self._balance(self.pool.left[idx]) >= 0:
+                idx = self._rotation(idx, left_rotation=False)
+            else:
+                idx = self._double_rotation(idx, left_side=True)
+        elif balance < -1:
+            if self._balance(self.pool.right[idx]) <= 0:
+                idx = self._rotation(idx, left_rotation=True)
+            else:
+                idx = self._double_rotation(idx, left_side=False)
+
+        self._update(idx)
+        return idx
+
+    def _rotation(self, idx: int, left_rotation=True) -> int:
+        """Makes single rotation, update node depth, return new root of subtree"""
+        left, right = self.pool.left, self.pool.right
+        if left_rotation:
+            right_idx = right[idx]
+            right[idx] = left[right_idx]
+            left[right_idx] = idx
+
+            self._update(idx)
+            self._update(right_idx)
+
+            return right_idx
+        else:
+            left_idx = left[idx]
+            left[idx] = right[left_idx]
+            right[left_idx] = idx
+
+            self._update(idx)
+            self._update(left_idx)
+
+            return left_idx
+
+    def _double_rotation(self, idx: int, left_side=True) -> int:
+        """Makes double rotation from single rotations, return new root of subtree"""
+        if left_side:
+            self.pool.left[idx] = self._rotation(self.pool.left[idx])
+            return self._rotation(idx, left_rotation=False)
+        else:
+            self.pool.right[idx] = self._rotation(self.pool.right[idx], left_rotation=False)
+            return self._rotation(idx)
+
+    def validate(self) -> bool:
+        pool = self.pool
+
+        def _validate(idx: int) -> bool:
+            if idx == EXTERNAL:
+                return True
+            left, right = pool.left[idx], pool.right[idx]
+            if pool.depth[idx] != max(pool.depth[left], pool.depth[right]) + 1 or \
+                    (self.sizes and pool.size[idx] != pool.size[left] + pool.size[right] + 1):
+                return False
+            return abs(self._balance(idx)) <= 1 and _validate(left) and _validate(right)
+
+        return pool.depth[EXTERNAL] == 0 and _validate(self.root)
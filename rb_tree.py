@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Callable, Iterable, List, Optional, Tuple
 from generic import ABinarySearchTree, BinaryNode
 
 
@@ -7,6 +7,8 @@ class RBNode(BinaryNode):
 
     red - if edge to parent is red
     """
+    __slots__ = ("red",)
+
     left: 'RBNode'
     right: 'RBNode'
 
@@ -20,6 +22,39 @@ class RBNode(BinaryNode):
     def __repr__(self): return f"RBNode( key: {self.key}, red: {self.red} )"
 
 
+class AggregateRBNode(RBNode):
+    """ RBNode of tree with combine function
+
+    agg - values of subtree combined by tree combine function
+    """
+    __slots__ = ("agg",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.agg = self.value
+
+
+class SizedRBNode(RBNode):
+    """ RBNode of tree with sizes
+
+    size - number of nodes in subtree with this node as root
+    """
+    __slots__ = ("size",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.size = 0 if self.external else 1
+
+
+class SizedAggregateRBNode(SizedRBNode):
+    """ RBNode of tree with sizes and combine function """
+    __slots__ = ("agg",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.agg = self.value
+
+
 class RBTree(ABinarySearchTree):
     """ Implementation of Red-Black Tree with those invaraints
 
@@ -30,47 +65,157 @@ class RBTree(ABinarySearchTree):
 
     This variation of RB tree is called left leaning red black tree
     """
-    EXTERNAL_NODE = RBNode(0, depth=0, external=True, red=False)
+    # external node has size 0 for trees with sizes
+    EXTERNAL_NODE = SizedRBNode(0, depth=0, external=True, red=False)
     EXTERNAL_NODE.left = EXTERNAL_NODE
     EXTERNAL_NODE.right = EXTERNAL_NODE
 
-    def __init__(self) -> None:
+    def __init__(self, combine: Optional[Callable] = None, identity=None, sizes: bool = False) -> None:
         self.root = self.EXTERNAL_NODE
+        self.combine = combine
+        self.identity = identity
+        self.sizes = sizes
+        if sizes:
+            self.node_class = SizedRBNode if combine is None else SizedAggregateRBNode
+        else:
+            self.node_class = RBNode if combine is None else AggregateRBNode
+
+    @classmethod
+    def from_sorted(cls, pairs: Iterable[Tuple], combine: Optional[Callable] = None,
+                    identity=None, sizes: bool = False) -> 'RBTree':
+        """ Build tree from (key, value) pairs sorted by key in linear time
+
+        Nodes are split to 2-3 tree with all leaves in the same depth,
+        3-vertex is black node with red left child.
+        """
+        tree = cls(combine, identity, sizes)
+        nodes = cls._sorted_nodes(
+            pairs, lambda key, value: tree.node_class(key, value, left=tree.EXTERNAL_NODE,
+                                                      right=tree.EXTERNAL_NODE, red=False))
+
+        # 2-3 tree with black height h has at least 2^h - 1 and at most 3^h - 1 keys
+        max_keys = [0]
+        while max_keys[-1] < len(nodes):
+            max_keys.append(3 * max_keys[-1] + 2)
+
+        def _build(lo: int, hi: int, height: int) -> RBNode:
+            if height == 0:
+                return tree.EXTERNAL_NODE
+            count = hi - lo
+            if count - 1 <= 2 * max_keys[height - 1]:
+                mid = lo + (count - 1) // 2
+                node = nodes[mid]
+                node.left = _build(lo, mid, height - 1)
+                node.right = _build(mid + 1, hi, height - 1)
+                if sizes:
+                    node.size = count
+                if combine is not None:
+                    tree._update_aggregate(node)
+                return node
+
+            size, extra = divmod(count - 2, 3)
+            first = lo + size + (1 if extra > 0 else 0)
+            second = first + 1 + size + (1 if extra > 1 else 0)
+            red_node, node = nodes[first], nodes[second]
+            red_node.red = True
+            red_node.left = _build(lo, first, height - 1)
+            red_node.right = _build(first + 1, second, height - 1)
+            node.left = red_node
+            node.right = _build(second + 1, hi, height - 1)
+            if sizes:
+                red_node.size = second - lo
+                node.size = count
+            if combine is not None:
+                tree._update_aggregate(red_node)
+                tree._update_aggregate(node)
+            return node
 
-    def insert(self, key, value) -> None:
-        self.root = self._insert(key, value, self.root)
-
-    def _insert(self, key, value, node: RBNode):
-        if node.external:
-            new_node = RBNode(key, value, left=self.EXTERNAL_NODE, right=self.EXTERNAL_NODE)
-            self._add_node_to_chain(new_node, self._find_lower(self.root, key),
-                                    self._find_bigger(self.root, key))
-
-            return new_node
+        tree.root = _build(0, len(nodes), len(max_keys) - 1)
+        return tree
 
-        if node.left.red and node.right.red:
-            node.red = True
-            node.left.red = node.right.red = False
-        if node.key > key:
-            node.left = self._insert(key, value, node.left)
-        elif node.key == key:
-            # key is alread in tree
-            pass
-        else:
-            node.right = self._insert(key, value, node.right)
+    def _rebuild(self, pairs: Iterable[Tuple]) -> None:
+        self.root = self.from_sorted(pairs, *self._settings()).root
 
-        return self._fix_llrb_invariants(node)
+    def insert(self, key, value) -> None:
+        self._insert_below(key, value, [], self.root)
+
+    def _insert_below(self, key, value, path: 'List[Tuple[RBNode, bool]]', node: RBNode) -> None:
+        """ Insert key to subtree of node, path leads from root to node
+
+        Colors are flipped on the way down only below node and the whole path
+        is fixed bottom-up. path is left with its part above the last rotation.
+        """
+        # one comparison per level, existing key is found at the bottom and
+        # the path is fixed anyway because of color flips on the way down
+        while not node.external:
+            if node.left.red and node.right.red:
+                self._flip_colors(node)
+            if key < node.key:
+                path.append((node, True))
+                node = node.left
+            else:
+                path.append((node, False))
+                node = node.right
+
+        # neighbours of the new node, lower is the last node not bigger than key
+        lower = bigger = None
+        if path:
+            parent, left = path[-1]
+            if left:
+                lower, bigger = parent.prev, parent
+            else:
+                lower, bigger = parent, parent.nxt
+        if lower is None or lower.key != key:
+            node = self.node_class(key, value, left=self.EXTERNAL_NODE, right=self.EXTERNAL_NODE)
+            self._add_node_to_chain(node, lower, bigger)
+
+        # like _fix_path, but remembers the highest rotated node
+        kept = len(path)
+        for idx in range(len(path) - 1, -1, -1):
+            parent, left = path[idx]
+            if left:
+                parent.left = node
+            else:
+                parent.right = node
+            node = self._fix_llrb_invariants(parent)
+            if node is not parent:
+                kept = idx
+        del path[kept:]
+        self.root = node
+
+    def _fix_path(self, path: 'List[Tuple[RBNode, bool]]', node: RBNode) -> RBNode:
+        """ Hang node in place of the subtree at the end of path and fix invariants bottom-up
+
+        path - list of (node, went_left) from root, where went_left says which child
+        of node is on the path
+        Return new root of tree
+        """
+        for parent, left in reversed(path):
+            if left:
+                parent.left = node
+            else:
+                parent.right = node
+            node = self._fix_llrb_invariants(parent)
+        return node
 
     def _fix_llrb_invariants(self, node: RBNode) -> RBNode:
+        if self.sizes:
+            node.size = node.left.size + node.right.size + 1
+        if self.combine is not None:
+            self._update_aggregate(node)
         if node.right.red:
             node = self._left_rotation(node)
         if node.left.red and node.left.left.red:
             node = self._right_rotation(node)
         if node.left.red and node.right.red:
-            node.red = True
-            node.left.red = node.right.red = False
+            self._flip_colors(node)
         return node
 
+    def _flip_colors(self, node: RBNode) -> None:
+        """ Split 4-node, children with red edges are made black and node red """
+        node.red = True
+        node.left.red = node.right.red = False
+
     def _left_rotation(self, node: RBNode) -> RBNode:
         """ Make left rotation """
         right_node = node.right
@@ -78,6 +223,12 @@ class RBTree(ABinarySearchTree):
         right_node.left = node
 
         node.red, right_node.red = right_node.red, node.red
+        if self.sizes:
+            right_node.size = node.size
+            node.size = node.left.size + node.right.size + 1
+        if self.combine is not None:
+            right_node.agg = node.agg
+            self._update_aggregate(node)
 
         return right_node
 
@@ -88,46 +239,150 @@ class RBTree(ABinarySearchTree):
         left_node.right = node
 
         node.red, left_node.red = left_node.red, node.red
+        if self.sizes:
+            left_node.size = node.size
+            node.size = node.left.size + node.right.size + 1
+        if self.combine is not None:
+            left_node.agg = node.agg
+            self._update_aggregate(node)
 
         return left_node
 
     def delete(self, key) -> None:
-        self.root = self._delete(key, self.root)
-
-    def _delete(self, key, node: RBNode) -> RBNode:
-        if node.external:
-            return node
-
-        if node.key < key:
-            if node.left.red:  # external nodes have only black color
-                node = self._right_rotation(node)
-            if node.right.black and node.right.left.black and not node.right.external:
-                node = self._move_red_right(node)
-
-            node.right = self._delete(key, node.right)
-        else:
-            if node.key == key and node.right.external:
-                # if right node is external, so
-                # - if left node is external and this node must be red -> return external node
-                # - if left is red node, then this node must be black
-                # - if left is black -> cannot occur
-                self._remove_node_from_chain(node)
-                node.left.red = False
-                return node.left
-            if node.left.black and node.left.left.black and not node.left.external:
-                node = self._move_red_left(node)
-            if node.key == key:
-                prev_node = node.prev
-                self._remove_node_from_chain(node)
-                node.left = self._delete(prev_node.key, node.left)
-                prev_node.left, prev_node.right = node.left, node.right
-                prev_node.red = node.red
-                node = prev_node
-                self._add_node_to_chain(node, node.prev, node.nxt)
+        # (node, went_left, node which replaces this node on the way up)
+        path: List[Tuple[RBNode, bool, Optional[RBNode]]] = []
+        node = self.root
+        while not node.external:
+            if node.key < key:
+                if node.left.red:  # external nodes have only black color
+                    node = self._right_rotation(node)
+                if node.right.black and node.right.left.black and not node.right.external:
+                    node = self._move_red_right(node)
+
+                path.append((node, False, None))
+                node = node.right
+            else:
+                # equality is tested on this branch only, cheap test of right child first
+                if node.right.external and node.key == key:
+                    # if right node is external, so
+                    # - if left node is external and this node must be red -> return external node
+                    # - if left is red node, then this node must be black
+                    # - if left is black -> cannot occur
+                    self._remove_node_from_chain(node)
+                    node.left.red = False
+                    node = node.left
+                    break
+                if node.left.black and node.left.left.black and not node.left.external:
+                    node = self._move_red_left(node)
+                if node.key == key:
+                    # node is replaced by prev node which is deleted from left subtree
+                    prev_node = node.prev
+                    self._remove_node_from_chain(node)
+                    path.append((node, True, prev_node))
+                    key = prev_node.key
+                else:
+                    path.append((node, True, None))
+                node = node.left
+
+        for parent, left, replace_node in reversed(path):
+            if left:
+                parent.left = node
             else:
-                node.left = self._delete(key, node.left)
+                parent.right = node
+            if replace_node is not None:
+                replace_node.left, replace_node.right = parent.left, parent.right
+                replace_node.red = parent.red
+                parent = replace_node
+                self._add_node_to_chain(parent, parent.prev, parent.nxt)
+            node = self._fix_llrb_invariants(parent)
+        self.root = node
+
+    def _settings(self) -> tuple:
+        return (self.combine, self.identity, self.sizes)
+
+    def _empty_copy(self) -> 'RBTree':
+        return type(self)(*self._settings())
+
+    def _black_height(self, node: RBNode) -> int:
+        """ Return number of black nodes on path from node to leaves (without external node) """
+        height = 0
+        while not node.external:
+            if node.black:
+                height += 1
+            node = node.left
+        return height
+
+    def _split_root(self, key) -> Tuple[RBNode, RBNode]:
+        """ Nodes on search path of key are joined bottom-up with their subtrees off the path
+
+        Black heights of subtrees are counted on the way down, joins cost
+        O(black height difference) each, which sums up to O(log n).
+        """
+        smaller: List[Tuple[RBNode, RBNode, int]] = []
+        bigger: List[Tuple[RBNode, RBNode, int]] = []
+        node = self.root
+        height = self._black_height(node)
+        while not node.external:
+            if node.black:
+                height -= 1
+            if node.key < key:
+                smaller.append((node, node.left, height))
+                node = node.right
+            else:
+                bigger.append((node, node.right, height))
+                node = node.left
+
+        left = right = self.EXTERNAL_NODE
+        left_height = right_height = 0
+        for node, subtree, subtree_height in reversed(smaller):
+            left, left_height = self._join_nodes(subtree, subtree_height, node, left, left_height)
+        for node, subtree, subtree_height in reversed(bigger):
+            right, right_height = self._join_nodes(right, right_height, node, subtree, subtree_height)
+        return left, right
+
+    def _join_roots(self, left_root: RBNode, key, value, right_root: RBNode) -> RBNode:
+        node = self.node_class(key, value, left=self.EXTERNAL_NODE, right=self.EXTERNAL_NODE)
+        self.root, _ = self._join_nodes(left_root, self._black_height(left_root),
+                                        node, right_root, self._black_height(right_root))
+        return node
 
-        return self._fix_llrb_invariants(node)
+    def _join_nodes(self, left: RBNode, left_height: int, node: RBNode,
+                    right: RBNode, right_height: int) -> Tuple[RBNode, int]:
+        """ Join subtrees with node between them, return new root and its black height
+
+        left_height, right_height - black heights of subtrees (see _black_height)
+        Roots of subtrees are made black, node is hung as red node on the spine
+        of the higher subtree in place of black node with the black height of
+        the other subtree and invariants are fixed bottom-up like after insert.
+        """
+        if left.red:
+            left.red = False
+            left_height += 1
+        if right.red:
+            right.red = False
+            right_height += 1
+
+        path: List[Tuple[RBNode, bool]] = []
+        height = max(left_height, right_height)
+        while left.red or height > right_height:
+            path.append((left, False))
+            if left.black:
+                height -= 1
+            left = left.right
+        while right.red or height > left_height:
+            path.append((right, True))
+            if right.black:
+                height -= 1
+            right = right.left
+
+        node.red = True
+        node.left, node.right = left, right
+        root = self._fix_path(path, self._fix_llrb_invariants(node))
+        height = max(left_height, right_height)
+        if root.red:
+            root.red = False
+            height += 1
+        return root, height
 
     def _move_red_right(self, node: RBNode) -> RBNode:
         node.red = False
@@ -167,6 +422,7 @@ class RBTree(ABinarySearchTree):
             lc, lo = _validate(node.left)
             rc, ro = _validate(node.right)
             valid = root or node.black or (node.red and node.left.black and node.right.black)
+            valid = valid and (not self.sizes or node.size == node.left.size + node.right.size + 1)
             if lc == rc:
                 return (lc + (0 if node.red else 1), lo and ro and valid)
             return (-1, False)
@@ -0,0 +1,147 @@
+""" Compact binary format of dataset operations and its replay driver
+
+File starts with header (magic, number of operations) followed by chunks.
+Chunk is number of operations n, n bytes of operation codes and n int64 keys,
+so whole chunk is read by two reads without parsing. Operation codes are the
+same as in text tests (see `dataset/genTests.py`), operations 3 and 4 have key 0.
+"""
+
+from array import array
+from generic import ATree
+from struct import Struct
+from typing import BinaryIO, Iterable, Iterator, List, Tuple
+import shutil
+
+
+MAGIC = b"TREEOPS1"
+HEADER = Struct("<8sQ")
+CHUNK = Struct("<I")
+
+INSERT = 0
+FIND = 1
+DELETE = 2
+PRINT_INCREASING = 3
+PRINT_DECREASING = 4
+
+
+class OperationWriter:
+    """ Stream operations to binary file, chunk_size operations are buffered
+
+    Number of operations in the header is written by close.
+    """
+    def __init__(self, path: str, chunk_size: int = 1 << 16):
+        self.file: BinaryIO = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, 0))
+        self.chunk_size = chunk_size
+        self.count = 0
+        self._codes = bytearray()
+        self._keys = array("q")
+
+    def write(self, operation: int, key: int = 0) -> None:
+        self._codes.append(operation)
+        self._keys.append(key)
+        if len(self._codes) >= self.chunk_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._codes:
+            self.file.write(CHUNK.pack(len(self._codes)))
+            self.file.write(self._codes)
+            self.file.write(self._keys.tobytes())
+            self.count += len(self._codes)
+            self._codes = bytearray()
+            self._keys = array("q")
+
+    def close(self) -> None:
+        self._flush()
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, self.count))
+        self.file.close()
+
+    def __enter__(self) -> 'OperationWriter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def write_operations(path: str, operations: Iterable[Tuple[int, int]], chunk_size: int = 1 << 16) -> None:
+    """ Write (operation, key) pairs to binary file """
+    with OperationWriter(path, chunk_size) as writer:
+        for operation, key in operations:
+            writer.write(operation, key)
+
+
+def read_chunks(path: str) -> Iterator[Tuple[bytes, array]]:
+    """ Yield (operation codes, keys) of every chunk of binary file """
+    with open(path, "rb") as fin:
+        magic, count = HEADER.unpack(fin.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not binary operations file")
+        read = 0
+        while read < count:
+            size, = CHUNK.unpack(fin.read(CHUNK.size))
+            codes = fin.read(size)
+            keys = array("q")
+            keys.frombytes(fin.read(8 * size))
+            if len(codes) != size or len(keys) != size:
+                raise ValueError(f"{path} is truncated")
+            read += size
+            yield codes, keys
+
+
+def read_operations(path: str) -> Iterator[Tuple[int, int]]:
+    """ Yield (operation, key) pairs of binary file """
+    for codes, keys in read_chunks(path):
+        yield from zip(codes, keys)
+
+
+def concatenate(paths: List[str], path: str) -> int:
+    """ Write operations of binary files one after another to path, return number of operations """
+    count = 0
+    with open(path, "wb") as fout:
+        fout.write(HEADER.pack(MAGIC, 0))
+        for part in paths:
+            with open(part, "rb") as fin:
+                magic, part_count = HEADER.unpack(fin.read(HEADER.size))
+                if magic != MAGIC:
+                    raise ValueError(f"{part} is not binary operations file")
+                shutil.copyfileobj(fin, fout)
+                count += part_count
+        fout.seek(0)
+        fout.write(HEADER.pack(MAGIC, count))
+    return count
+
+
+def convert_text(text_path: str, binary_path: str) -> int:
+    """ Convert text test input to binary file, return number of operations """
+    with open(text_path) as fin, OperationWriter(binary_path) as writer:
+        fin.readline()
+        for line in fin:
+            operation, _, key = line.partition(" ")
+            writer.write(int(operation), int(key) if key else 0)
+        return writer.count
+
+
+def replay(tree: ATree, path: str) -> int:
+    """ Apply inserts, finds and deletes of binary file to tree, return number of successful finds
+
+    Print operations only walk the chain, so replay of text and binary tests
+    does the same work in the tree.
+    """
+    insert, find, delete = tree.insert, tree.find, tree.delete
+    found = 0
+    for codes, keys in read_chunks(path):
+        for operation, key in zip(codes, keys):
+            if operation == INSERT:
+                insert(key, key)
+            elif operation == FIND:
+                if find(key) is not None:
+                    found += 1
+            elif operation == DELETE:
+                delete(key)
+            else:
+                node = tree.findmin() if operation == PRINT_INCREASING else tree.findmax()
+                while node is not None:
+                    node = node.nxt if operation == PRINT_INCREASING else node.prev
+    return found
@@ -0,0 +1,264 @@
+""" Tree sharded to worker processes by key ranges
+
+Every worker process owns one tree and answers batches of operations sent
+through a pipe. Shard i holds keys in [bounds[i - 1], bounds[i]).
+Operation codes are the same as in `dataset` tests.
+"""
+
+from bisect import bisect_left, bisect_right
+from generic import ATree
+from multiprocessing.connection import Connection
+from typing import Iterable, List, Optional, Tuple
+import multiprocessing
+
+
+INSERT = 0
+FIND = 1
+DELETE = 2
+
+
+class _Infinity:
+    """ Bound bigger than any key, bounds of shards which got no keys yet """
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return not isinstance(other, _Infinity)
+
+    def __repr__(self):
+        return "INFINITY"
+
+
+INFINITY = _Infinity()
+
+
+def _pairs(tree: ATree) -> List[Tuple]:
+    pairs = []
+    node = tree.findmin()
+    while node is not None:
+        pairs.append((node.key, node.value))
+        node = node.nxt
+    return pairs
+
+
+def _serve(tree: ATree, command: str, payload) -> Tuple[ATree, object]:
+    """ Run one command on tree, return the tree (take and give replace it) and reply """
+    if command == "ops":
+        results = []
+        for operation, key, value in payload:
+            if operation == INSERT:
+                tree.insert(key, value)
+                results.append(None)
+            elif operation == DELETE:
+                tree.delete(key)
+                results.append(None)
+            else:
+                node = tree.find(key)
+                results.append(None if node is None else node.value)
+        return tree, results
+    if command == "range":
+        return tree, [(node.key, node.value) for node in tree.range(*payload)]
+    if command == "size":
+        return tree, len(tree)
+    if command == "take":
+        # take count smallest or biggest keys, the tree keeps the rest,
+        # the split key is the new bound between the trees
+        count, biggest = payload
+        key = tree.select(len(tree) - count if biggest else count).key
+        left, right = tree.split(key)
+        tree, taken = (left, right) if biggest else (right, left)
+        return tree, (_pairs(taken), key)
+    if command == "give":
+        # add keys which are all smaller or bigger than keys of tree
+        pairs, biggest = payload
+        if pairs:
+            given = tree._empty_copy()
+            given._rebuild(pairs)
+            tree = ATree.join(tree, given) if biggest else ATree.join(given, tree)
+        return tree, None
+    raise ValueError(f"unknown command {command}")
+
+
+def _worker(conn: Connection, tree_class: type, tree_args: tuple) -> None:
+    """ Serve messages (command, payload) until None is received
+
+    Every message gets reply (True, result) or (False, exception), the worker
+    and its tree survive exceptions of commands. Operations of a batch before
+    the failed one stay applied.
+    """
+    tree = tree_class(*tree_args)
+    while True:
+        message = conn.recv()
+        if message is None:
+            return
+        try:
+            tree, reply = _serve(tree, *message)
+        except Exception as error:
+            try:
+                conn.send((False, error))
+            except Exception:
+                # exception which cannot be pickled
+                conn.send((False, RuntimeError(repr(error))))
+        else:
+            conn.send((True, reply))
+
+
+class ShardedTree:
+    """ Tree sharded to worker processes by key ranges
+
+    tree_class, tree_args - every worker owns tree_class(*tree_args), the tree
+    must support split and join (AVL, AB and LLRB trees), shard sizes are counted
+    in O(log n) only by trees with sizes
+    bounds - sorted workers - 1 keys splitting shards, by default all keys go to the
+    first shard until rebalance
+    Point operations are routed by key, apply sends one batch to every shard
+    and shards process their batches in parallel. Shards are rebalanced after
+    every rebalance_every applied operations if the biggest one has more than
+    skew times the average size.
+    """
+    def __init__(self, workers: int, tree_class: type, tree_args: tuple = (),
+                 bounds: Optional[List] = None, rebalance_every: int = 100000, skew: float = 2.0):
+        if bounds is None:
+            bounds = [INFINITY] * (workers - 1)
+        if len(bounds) != workers - 1:
+            raise ValueError(f"{workers} workers need {workers - 1} bounds")
+        self.bounds = list(bounds)
+        self.rebalance_every = rebalance_every
+        self.skew = skew
+        self._operations = 0
+        self.connections: List[Connection] = []
+        self.processes = []
+        for _ in range(workers):
+            conn, worker_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_worker, args=(worker_conn, tree_class, tree_args),
+                                              daemon=True)
+            process.start()
+            self.connections.append(conn)
+            self.processes.append(process)
+
+    def close(self) -> None:
+        for conn in self.connections:
+            conn.send(None)
+        for process in self.processes:
+            process.join()
+
+    def __enter__(self) -> 'ShardedTree':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _shard(self, key) -> int:
+        return bisect_right(self.bounds, key)
+
+    def _request(self, messages: List[Tuple[int, tuple]]) -> List:
+        """ Send (shard, message) pairs, return replies in the same order
+
+        Replies of all shards which got their message are read before an error
+        (of a shard or of sending) is raised, so no pipe keeps a stale reply.
+        """
+        sent: List[int] = []
+        error = None
+        for shard, message in messages:
+            try:
+                self.connections[shard].send(message)
+            except Exception as send_error:
+                error = send_error
+                break
+            sent.append(shard)
+        replies = []
+        for shard in sent:
+            ok, reply = self.connections[shard].recv()
+            if not ok and error is None:
+                error = reply
+            replies.append(reply)
+        if error is not None:
+            raise error
+        return replies
+
+    def apply(self, operations: Iterable[Tuple]) -> List:
+        """ Apply (operation, key, value) triples, return results in the same order
+
+        Result of FIND is value of key or None, result of other operations is None.
+        Operations of one shard are applied in given order. If a shard fails,
+        its error is raised after all shards answered, operations of other
+        shards and operations of the failed shard before the error stay applied.
+        """
+        batches: List[List[Tuple]] = [[] for _ in self.connections]
+        positions: List[List[int]] = [[] for _ in self.connections]
+        for idx, (operation, key, value) in enumerate(operations):
+            shard = self._shard(key)
+            batches[shard].append((operation, key, value))
+            positions[shard].append(idx)
+
+        shards = [shard for shard, batch in enumerate(batches) if batch]
+        replies = self._request([(shard, ("ops", batches[shard])) for shard in shards])
+        results: List = [None] * sum(len(batch) for batch in batches)
+        for shard, shard_results in zip(shards, replies):
+            for idx, result in zip(positions[shard], shard_results):
+                results[idx] = result
+
+        self._operations += len(results)
+        if self._operations >= self.rebalance_every:
+            self._operations = 0
+            sizes = self.sizes()
+            if max(sizes) > self.skew * sum(sizes) / len(sizes):
+                self.rebalance()
+        return results
+
+    def insert(self, key, value=None) -> None:
+        self.apply([(INSERT, key, key if value is None else value)])
+
+    def delete(self, key) -> None:
+        self.apply([(DELETE, key, None)])
+
+    def find(self, key):
+        """ Return value of key or None """
+        return self.apply([(FIND, key, None)])[0]
+
+    def range(self, lo, hi) -> List[Tuple]:
+        """ Return (key, value) pairs with lo <= key < hi in increasing order """
+        shards = range(self._shard(lo), bisect_left(self.bounds, hi) + 1)
+        pairs: List[Tuple] = []
+        for shard_pairs in self._request([(shard, ("range", (lo, hi))) for shard in shards]):
+            pairs.extend(shard_pairs)
+        return pairs
+
+    def sizes(self) -> List[int]:
+        """ Return number of keys of every shard """
+        return self._request([(shard, ("size", None)) for shard in range(len(self.connections))])
+
+    def __len__(self) -> int:
+        return sum(self.sizes())
+
+    def rebalance(self) -> None:
+        """ Move keys between neighbouring shards so all shards have nearly the same size
+
+        flow[i] keys go over bound i (to the right if positive), moves to the right
+        are done from the left, moves to the left from the right, so every shard
+        has enough keys when it sends them.
+        """
+        sizes = self.sizes()
+        total, workers = sum(sizes), len(sizes)
+        if total < workers:
+            return
+        flows = []
+        current = target = 0
+        for shard in range(workers - 1):
+            current += sizes[shard]
+            target += total // workers + (1 if shard < total % workers else 0)
+            flows.append(current - target)
+
+        for shard in range(workers - 1):
+            if flows[shard] > 0:
+                self.bounds[shard] = self._move(shard, shard + 1, flows[shard])
+        for shard in reversed(range(workers - 1)):
+            if flows[shard] < 0:
+                self.bounds[shard] = self._move(shard + 1, shard, -flows[shard])
+
+    def _move(self, source: int, target: int, count: int):
+        """ Move count keys from source shard to its neighbour target, return new bound between them """
+        to_right = target > source
+        (pairs, bound), = self._request([(source, ("take", (count, to_right)))])
+        self._request([(target, ("give", (pairs, not to_right)))])
+        return bound
@@ -0,0 +1,268 @@
+""" Binary snapshots of trees
+
+Snapshot is a file with sorted key and value columns:
+    header - magic, version, typecodes of keys and values, byte order, number of keys
+             and length of metadata (see HEADER)
+    metadata - JSON with tree type and its shape parameters (a, b of AB and B+
+               trees, value dtype of NumPy B+ tree)
+    keys, values - columns of `array` typecodes in native byte order,
+                   both aligned to 8 bytes
+
+`save` writes the snapshot in one pass over prev/nxt chain, `load` builds
+the tree by its `from_sorted` in linear time and `MappedTree` serves read-only
+queries straight from the memory mapped file.
+"""
+
+from ab_tree import ABTree
+from array import array
+from avl import AvlTree
+from bisect import bisect_left
+from bplus_tree import BPlusTree
+from generic import ATree
+from pooled_avl import PooledAvlTree
+from rb_tree import RBTree
+from struct import Struct
+from typing import Callable, Iterator, Optional, Tuple
+import json
+import mmap
+import os
+import sys
+
+
+MAGIC = b"TREESNAP"
+VERSION = 1
+# magic, version, key typecode, value typecode, byte order, number of keys, metadata length
+HEADER = Struct("<8sHcccQI")
+# typecodes which are the same for `array` and memoryview.cast
+TYPECODES = "bBhHiIlLqQfd"
+CHUNK = 4096
+
+TREES = {cls.__name__: cls for cls in (AvlTree, RBTree, ABTree, PooledAvlTree, BPlusTree)}
+
+
+def _tree_class(name: str) -> type:
+    """ Return class of tree saved as name, numpy is imported only for NumpyBPlusTree """
+    if name == "NumpyBPlusTree":
+        from numpy_tree import NumpyBPlusTree
+        return NumpyBPlusTree
+    if name not in TREES:
+        raise ValueError(f"snapshots do not support {name}")
+    return TREES[name]
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) // 8 * 8
+
+
+def _layout(key_type: str, value_type: str, count: int, metadata_length: int) -> Tuple[int, int]:
+    """ Return offsets of keys and values columns """
+    keys_offset = _align(HEADER.size + metadata_length)
+    values_offset = _align(keys_offset + count * array(key_type).itemsize)
+    return keys_offset, values_offset
+
+
+def _read_header(header: bytes) -> Tuple[str, str, int, int]:
+    """ Return key typecode, value typecode, number of keys and metadata length """
+    magic, version, key_type, value_type, byteorder, count, metadata_length = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("file is not a tree snapshot")
+    if byteorder.decode() != sys.byteorder[0]:
+        raise ValueError("snapshot was saved on machine with different byte order")
+    return key_type.decode(), value_type.decode(), count, metadata_length
+
+
+def save(tree: ATree, path: str, key_type: str = 'q', value_type: str = 'q') -> None:
+    """ Save tree to snapshot in one pass over prev/nxt chain
+
+    key_type, value_type - `array` typecodes of keys and values, one of TYPECODES
+    Both columns are streamed at once through two handles of temporary file,
+    which is renamed to path at the end, so keys or values which do not fit
+    to their typecode leave no partial snapshot.
+    """
+    if key_type not in TYPECODES or value_type not in TYPECODES:
+        raise ValueError(f"unsupported typecode, use one of {TYPECODES}")
+    name = type(tree).__name__
+    if _tree_class(name) is not type(tree):
+        raise ValueError(f"snapshots do not support {name}")
+
+    metadata = {"tree": name}
+    if isinstance(tree, (ABTree, BPlusTree)):
+        metadata.update(a=tree.a, b=tree.b)
+    if name == "NumpyBPlusTree":
+        metadata.update(value_dtype=tree.value_dtype.str)
+    metadata_bytes = json.dumps(metadata).encode()
+    count = len(tree)
+    keys_offset, values_offset = _layout(key_type, value_type, count, len(metadata_bytes))
+
+    tmp_path = path + ".tmp"
+    try:
+        _write(tree, tmp_path, key_type, value_type, count, metadata_bytes, keys_offset, values_offset)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+def _write(tree: ATree, path: str, key_type: str, value_type: str, count: int, metadata_bytes: bytes,
+           keys_offset: int, values_offset: int) -> None:
+    with open(path, "wb") as fkeys, open(path, "r+b") as fvalues:
+        fkeys.write(HEADER.pack(MAGIC, VERSION, key_type.encode(), value_type.encode(),
+                                sys.byteorder[0].encode(), count, len(metadata_bytes)))
+        fkeys.write(metadata_bytes)
+        fkeys.write(bytes(keys_offset - fkeys.tell()))
+        fvalues.seek(values_offset)
+
+        keys, values = array(key_type), array(value_type)
+        node = tree.findmin()
+        while node is not None:
+            keys.append(node.key)
+            values.append(node.value)
+            if len(keys) == CHUNK:
+                keys.tofile(fkeys)
+                values.tofile(fvalues)
+                keys, values = array(key_type), array(value_type)
+            node = node.nxt
+        keys.tofile(fkeys)
+        values.tofile(fvalues)
+
+
+def _read(path: str) -> Tuple[dict, array, array]:
+    """ Return metadata, keys and values of snapshot """
+    with open(path, "rb") as fin:
+        key_type, value_type, count, metadata_length = _read_header(fin.read(HEADER.size))
+        metadata = json.loads(fin.read(metadata_length))
+        keys_offset, values_offset = _layout(key_type, value_type, count, metadata_length)
+        keys, values = array(key_type), array(value_type)
+        fin.seek(keys_offset)
+        keys.fromfile(fin, count)
+        fin.seek(values_offset)
+        values.fromfile(fin, count)
+    return metadata, keys, values
+
+
+def load(path: str, combine: Optional[Callable] = None, identity=None, sizes: bool = False) -> ATree:
+    """ Load tree saved by save, the tree is built by from_sorted in linear time
+
+    combine, identity - aggregate settings of the tree (ignored by PooledAvlTree and B+ trees)
+    sizes - tree keeps subtree sizes (ignored by B+ trees, which always keep them)
+    """
+    metadata, keys, values = _read(path)
+    cls = _tree_class(metadata["tree"])
+    pairs = zip(keys, values)
+    if cls is ABTree:
+        return ABTree.from_sorted(pairs, metadata["a"], metadata["b"], combine=combine, identity=identity,
+                                  sizes=sizes)
+    if cls is BPlusTree:
+        return BPlusTree.from_sorted(pairs, metadata["a"], metadata["b"])
+    if metadata["tree"] == "NumpyBPlusTree":
+        return cls.from_sorted(pairs, metadata["a"], metadata["b"], value_dtype=metadata["value_dtype"])
+    if cls is PooledAvlTree:
+        return PooledAvlTree.from_sorted(pairs, sizes)
+    return cls.from_sorted(pairs, combine, identity, sizes)
+
+
+def load_into(tree: ATree, path: str) -> None:
+    """ Replace content of tree by snapshot in linear time, the tree keeps its type and settings """
+    _, keys, values = _read(path)
+    tree._rebuild(zip(keys, values))
+
+
+class MappedNode:
+    """ View to one key of MappedTree, it is valid until the tree is closed """
+    __slots__ = ("tree", "idx")
+
+    def __init__(self, tree: 'MappedTree', idx: int):
+        self.tree = tree
+        self.idx = idx
+
+    @property
+    def key(self):
+        return self.tree.keys[self.idx]
+
+    @property
+    def value(self):
+        return self.tree.values[self.idx]
+
+    @property
+    def prev(self) -> 'Optional[MappedNode]':
+        return self.tree._view(self.idx - 1)
+
+    @property
+    def nxt(self) -> 'Optional[MappedNode]':
+        return self.tree._view(self.idx + 1)
+
+    def __eq__(self, other):
+        return isinstance(other, MappedNode) and self.tree is other.tree and self.idx == other.idx
+
+    def __hash__(self):
+        return hash((id(self.tree), self.idx))
+
+    def __repr__(self):
+        return f"Node( key: {self.key}, value: {self.value} )"
+
+
+class MappedTree:
+    """ Read-only tree served straight from memory mapped snapshot
+
+    Keys are searched by binary search in the mapped keys column, no nodes
+    are built. Methods returning node return MappedNode view.
+    """
+    def __init__(self, path: str):
+        with open(path, "rb") as fin:
+            self._mmap = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        key_type, value_type, count, metadata_length = _read_header(self._mmap[:HEADER.size])
+        self.metadata = json.loads(self._mmap[HEADER.size:HEADER.size + metadata_length])
+        keys_offset, values_offset = _layout(key_type, value_type, count, metadata_length)
+
+        buffer = memoryview(self._mmap)
+        self.keys = buffer[keys_offset:keys_offset + count * array(key_type).itemsize].cast(key_type)
+        self.values = buffer[values_offset:values_offset + count * array(value_type).itemsize].cast(value_type)
+        buffer.release()
+
+    def close(self) -> None:
+        self.keys.release()
+        self.values.release()
+        self._mmap.close()
+
+    def __enter__(self) -> 'MappedTree':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _view(self, idx: int) -> Optional[MappedNode]:
+        return MappedNode(self, idx) if 0 <= idx < len(self.keys) else None
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def find(self, key) -> Optional[MappedNode]:
+        idx = bisect_left(self.keys, key)
+        if idx < len(self.keys) and self.keys[idx] == key:
+            return MappedNode(self, idx)
+        return None
+
+    def findmin(self) -> Optional[MappedNode]:
+        return self._view(0)
+
+    def findmax(self) -> Optional[MappedNode]:
+        return self._view(len(self.keys) - 1)
+
+    def select(self, k: int) -> MappedNode:
+        if not 0 <= k < len(self.keys):
+            raise IndexError("tree index out of range")
+        return MappedNode(self, k)
+
+    def rank(self, key) -> int:
+        return bisect_left(self.keys, key)
+
+    def range(self, lo, hi, reverse: bool = False) -> Iterator[MappedNode]:
+        """ Lazily yield nodes with lo <= key < hi in increasing order (decreasing if reverse) """
+        start, end = bisect_left(self.keys, lo), bisect_left(self.keys, hi)
+        indices = range(end - 1, start - 1, -1) if reverse else range(start, end)
+        for idx in indices:
+            yield MappedNode(self, idx)
+
+    def count_range(self, lo, hi) -> int:
+        """ Return number of keys with lo <= key < hi """
+        return max(0, bisect_left(self.keys, hi) - bisect_left(self.keys, lo))
@@ -1,11 +1,38 @@
 #!/usr/bin/env python3
 
 from generic import ATree
+from instrumentation import TreeStats, instrument, uninstrument
 from rb_tree import RBNode, RBTree
 from ab_tree import ABTree
+from bplus_tree import BPlusTree
+from finger import FingerTree
+from async_tree import AsyncTreeStore, LatencyHistogram
+from cache import CachedTree, ClockCache, LRUCache
+from concurrent_tree import ConcurrentTree
 from avl import AvlTree, AvlNode
+from persistent import PersistentAvlTree, PersistentRBTree
+from pooled_avl import PooledAvlTree
+from operator import add
+from random import Random
+from replay import convert_text, read_operations, replay, write_operations
+from sharded import DELETE, FIND, INSERT, ShardedTree
+from snapshot import MappedTree, load, save
+from wal import WalTree
+import asyncio
+import filecmp
+import importlib.util
+import os
+import sys
+import tempfile
+import threading
 import unittest
 
+try:
+    import numpy as np
+    from numpy_tree import NumpyBPlusTree
+except ImportError:
+    np = None
+
 
 class TreeGeneric(unittest.TestCase):
     def run_test(self, test_num, tree: ATree):
@@ -44,6 +71,161 @@ class TreeGeneric(unittest.TestCase):
                 # self.assertTrue(tree.validate())
 
 
+    def assert_chain(self, tree: ATree, keys):
+        """ Check that prev/nxt chain contains exactly given keys """
+        forward, node = [], tree.findmin()
+        while node is not None:
+            forward.append(node.key)
+            node = node.nxt
+        backward, node = [], tree.findmax()
+        while node is not None:
+            backward.append(node.key)
+            node = node.prev
+        self.assertEqual(forward, list(keys))
+        self.assertEqual(backward, list(reversed(keys)))
+
+    def check_from_sorted(self, make_tree):
+        for size in [0, 1, 2, 3, 10, 100, 1000]:
+            keys = list(range(0, 2 * size, 2))
+            tree = make_tree((x, x) for x in keys)
+            self.assertTrue(tree.validate())
+            self.assertTrue(all(tree.find(x) is not None for x in keys))
+            self.assertEqual(tree.find(1), None)
+            self.assert_chain(tree, keys)
+
+            tree.insert(1, 1)
+            tree.delete(0)
+            self.assertTrue(tree.validate())
+            self.assert_chain(tree, sorted(set(keys + [1]) - {0}))
+
+        with self.assertRaises(ValueError):
+            make_tree([(1, 1), (3, 3), (2, 2)])
+
+    def check_batch_operations(self, make_tree):
+        # 0 - always single operations, 100 - always rebuild
+        for level_cost in [0, ATree.BATCH_LEVEL_COST, 100]:
+            tree = make_tree()
+            tree.BATCH_LEVEL_COST = level_cost
+            tree.insert_many((x, x) for x in range(0, 200, 2))
+            tree.insert_many([(x, -x) for x in range(150, 0, -3)] + [(1, 1)])
+            keys = sorted(set(range(0, 200, 2)) | set(range(150, 0, -3)) | {1})
+            self.assertTrue(tree.validate())
+            self.assert_chain(tree, keys)
+            self.assertEqual(tree.find(3).value, -3)
+            self.assertEqual(tree.find(6).value, 6)
+
+            tree.delete_many(list(range(0, 300, 5)) + [0])
+            keys = [x for x in keys if x % 5 != 0]
+            self.assertTrue(tree.validate())
+            self.assert_chain(tree, keys)
+
+    def check_range(self, make_tree):
+        keys = list(range(0, 100, 3))
+        tree = make_tree()
+        for x in keys:
+            tree.insert(x, x)
+
+        for lo, hi in [(-5, 200), (0, 0), (3, 4), (4, 50), (31, 33), (98, 98), (99, 200), (50, 10)]:
+            expected = [x for x in keys if lo <= x < hi]
+            self.assertEqual([n.key for n in tree.range(lo, hi)], expected)
+            self.assertEqual([n.key for n in tree.range(lo, hi, reverse=True)], expected[::-1])
+            self.assertEqual(tree.count_range(lo, hi), len(expected))
+
+        self.assertEqual(list(make_tree().range(0, 10)), [])
+
+    def check_order_statistics(self, make_tree):
+        random = Random(42)
+        tree, keys = make_tree(), set()
+        self.assertEqual(len(tree), 0)
+        self.assertEqual(tree.percentile(50), None)
+        for _ in range(2000):
+            key = random.randint(0, 500)
+            if random.random() < 0.6:
+                tree.insert(key, key)
+                keys.add(key)
+            else:
+                tree.delete(key)
+                keys.discard(key)
+        self.assertTrue(tree.validate())
+
+        ordered = sorted(keys)
+        self.assertEqual(len(tree), len(ordered))
+        self.assertEqual([tree.select(k).key for k in range(len(ordered))], ordered)
+        self.assertEqual([tree.rank(x) for x in range(-1, 502)],
+                         [sum(1 for y in ordered if y < x) for x in range(-1, 502)])
+        self.assertEqual(tree.percentile(0).key, ordered[0])
+        self.assertEqual(tree.percentile(50).key, ordered[(len(ordered) + 1) // 2 - 1])
+        self.assertEqual(tree.percentile(100).key, ordered[-1])
+        with self.assertRaises(IndexError):
+            tree.select(len(ordered))
+        with self.assertRaises(IndexError):
+            tree.select(-1)
+
+    def check_split_join(self, make_tree):
+        random = Random(3)
+        for size in [0, 1, 2, 10, 300]:
+            keys = random.sample(range(4 * size + 1), size)
+            for split_key in [-1, 0, size, 2 * size + 1, 4 * size + 1]:
+                tree = make_tree(lambda x, y: x + y, 0)
+                for x in keys:
+                    tree.insert(x, x)
+                ordered = sorted(keys)
+
+                left, right = tree.split(split_key)
+                self.assertEqual(len(tree), 0)
+                for part, expected in [(left, [x for x in ordered if x < split_key]),
+                                       (right, [x for x in ordered if x >= split_key])]:
+                    self.assertTrue(part.validate())
+                    self.assert_chain(part, expected)
+                    self.assertEqual(len(part), len(expected))
+                    self.assertEqual(part.aggregate(-1, 4 * size + 2), sum(expected))
+
+                tree = ATree.join(left, right)
+                self.assertTrue(tree.validate())
+                self.assert_chain(tree, ordered)
+                self.assertEqual(tree.aggregate(-1, 4 * size + 2), sum(ordered))
+                self.assertEqual((len(left), len(right)), (0, 0))
+
+        left, right = make_tree(None, None), make_tree(None, None)
+        for x in range(100):
+            left.insert(x, x)
+        right.insert(1000, 1000)
+        tree = ATree.join_with_key(left, 500, -1, right)
+        self.assertTrue(tree.validate())
+        self.assert_chain(tree, list(range(100)) + [500, 1000])
+        self.assertEqual(tree.find(500).value, -1)
+        with self.assertRaises(ValueError):
+            ATree.join_with_key(tree, 50, 50, make_tree(None, None))
+        left, right = tree.split(50)
+        with self.assertRaises(ValueError):
+            ATree.join(right, left)
+
+    def check_aggregate(self, make_tree):
+        random = Random(7)
+        # string concatenation is not commutative, so it checks also order of values
+        tree, values = make_tree(lambda x, y: x + y, ""), {}
+        for _ in range(1000):
+            key = random.randint(0, 200)
+            if random.random() < 0.6:
+                tree.insert(key, f"{key},")
+                values.setdefault(key, f"{key},")
+            else:
+                tree.delete(key)
+                values.pop(key, None)
+
+            lo, hi = random.randint(-10, 210), random.randint(-10, 210)
+            self.assertEqual(tree.aggregate(lo, hi),
+                             ''.join(values[x] for x in sorted(values) if lo <= x < hi))
+
+        tree = make_tree(max, float("-inf"))
+        tree.insert_many((x, (x * 37) % 101) for x in range(1000))
+        self.assertEqual(tree.aggregate(100, 200), max((x * 37) % 101 for x in range(100, 200)))
+        self.assertEqual(tree.aggregate(5, 5), float("-inf"))
+
+        with self.assertRaises(ValueError):
+            make_tree(None, None).aggregate(0, 1)
+
+
 class TestAVLTree(TreeGeneric):
     def right_order_nxt(self, root, correct):
         for x in correct:
@@ -260,6 +442,67 @@ class TestAVLTree(TreeGeneric):
         self.assertEqual(tree.findmin().key, 1)
         self.assertEqual(tree.findmax().key, 19)
 
+    def test_from_sorted(self):
+        self.check_from_sorted(AvlTree.from_sorted)
+
+    def test_batch_operations(self):
+        self.check_batch_operations(AvlTree)
+
+    def test_batch_shared_paths(self):
+        # small batches reuse search paths of previous keys, sizes and aggregates
+        # above the reused part of path must be kept
+        random = Random(6)
+        tree, keys = AvlTree(lambda x, y: x + y, 0, sizes=True), set()
+        tree.BATCH_LEVEL_COST = 0
+        for _ in range(200):
+            batch = [random.randint(0, 500) for _ in range(random.randint(0, 30))]
+            if random.random() < 0.6:
+                tree.insert_many((x, x) for x in batch)
+                keys.update(batch)
+            else:
+                tree.delete_many(batch)
+                keys.difference_update(batch)
+            self.assertTrue(tree.validate())
+            self.assert_chain(tree, sorted(keys))
+            self.assertEqual(len(tree), len(keys))
+            self.assertEqual(tree.aggregate(0, 501), sum(keys))
+
+    def test_range(self):
+        self.check_range(AvlTree)
+
+    def test_order_statistics(self):
+        self.check_order_statistics(lambda: AvlTree(sizes=True))
+        self.check_order_statistics(AvlTree)
+        # only trees with sizes have nodes with size slot
+        self.assertFalse(hasattr(AvlTree.from_sorted([(1, 1)]).root, "size"))
+        self.assertEqual(AvlTree.from_sorted([(1, 1), (2, 2)], sizes=True).root.size, 2)
+
+    def test_aggregate(self):
+        self.check_aggregate(AvlTree)
+        # only trees with combine function have nodes with agg slot
+        self.assertFalse(hasattr(AvlTree.from_sorted([(1, 1)]).root, "agg"))
+        self.assertEqual(AvlTree.from_sorted([(1, "a")], lambda x, y: x + y, "").root.agg, "a")
+
+    def test_split_join(self):
+        self.check_split_join(AvlTree)
+        self.check_split_join(lambda combine, identity: AvlTree(combine, identity, sizes=True))
+
+    def test_join_incompatible_trees(self):
+        pairs = [(AvlTree(), RBTree()), (ABTree(2, 4), ABTree(3, 6)), (AvlTree(max, 0), AvlTree()),
+                 (AvlTree(max, 0), AvlTree(max, 1)), (AvlTree(sizes=True), AvlTree())]
+        for left, right in pairs:
+            for x in range(3):
+                left.insert(x, x)
+                right.insert(x + 10, x + 10)
+            with self.assertRaises(ValueError):
+                ATree.join(left, right)
+            with self.assertRaises(ValueError):
+                ATree.join_with_key(left, 5, 5, right)
+            # trees are not modified
+            self.assert_chain(left, [0, 1, 2])
+            self.assert_chain(right, [10, 11, 12])
+            self.assertTrue(right.validate())
+
     def test_fulltest1(self): self.run_test(1, AvlTree())
     def test_fulltest2(self): self.run_test(2, AvlTree())
     def test_fulltest3(self): self.run_test(3, AvlTree())
@@ -268,14 +511,218 @@ class TestAVLTree(TreeGeneric):
 
 
 class TestABTree(TreeGeneric):
+    def test_insert_existing_key_in_inner_vertex(self):
+        tree = ABTree(2, 4)
+        for x in range(1, 5):
+            tree.insert(x, x)
+        self.assertFalse(tree.root.leaf)
+
+        tree.insert(tree.root.keys[0].key, 0)
+        node, keys = tree.findmin(), []
+        while node is not None:
+            keys.append(node.key)
+            node = node.nxt
+        self.assertEqual(keys, [1, 2, 3, 4])
+        self.assertTrue(tree.validate())
+
+    def test_delete_keeps_root_with_a_bigger_than_two(self):
+        tree = ABTree(3, 5)
+        for x in range(1, 7):
+            tree.insert(x, x)
+        tree.delete(6)
+
+        self.assertEqual([tree.find(x) is not None for x in range(1, 7)], [True] * 5 + [False])
+        self.assertTrue(tree.validate())
+
+    def test_from_sorted(self):
+        self.check_from_sorted(lambda pairs: ABTree.from_sorted(pairs, 2, 4))
+        self.check_from_sorted(lambda pairs: ABTree.from_sorted(pairs, 3, 6, fill=0.5))
+        self.check_from_sorted(lambda pairs: ABTree.from_sorted(pairs, 64, 128, fill=0.75))
+
+    def test_batch_operations(self):
+        self.check_batch_operations(lambda: ABTree(2, 4))
+        self.check_batch_operations(lambda: ABTree(3, 6))
+
+    def test_range(self):
+        self.check_range(lambda: ABTree(2, 4))
+        self.check_range(lambda: ABTree(8, 16))
+
+    def test_order_statistics(self):
+        self.check_order_statistics(lambda: ABTree(2, 4, sizes=True))
+        self.check_order_statistics(lambda: ABTree(3, 6, sizes=True))
+        self.check_order_statistics(lambda: ABTree(2, 4))
+        self.assertFalse(hasattr(ABTree.from_sorted([(1, 1)], 2, 4).root, "size"))
+        self.assertEqual(ABTree.from_sorted([(1, 1), (2, 2)], 2, 4, sizes=True).root.size, 2)
+
+    def test_aggregate(self):
+        self.check_aggregate(lambda combine, identity: ABTree(2, 4, combine, identity))
+        self.check_aggregate(lambda combine, identity: ABTree(3, 6, combine, identity))
+        # only trees with combine function have vertices with agg slot
+        self.assertFalse(hasattr(ABTree.from_sorted([(1, 1)], 2, 4).root, "agg"))
+        self.assertEqual(ABTree.from_sorted([(1, "a")], 2, 4, combine=lambda x, y: x + y, identity="").root.agg, "a")
+
+    def test_split_join(self):
+        self.check_split_join(lambda combine, identity: ABTree(2, 4, combine, identity))
+        self.check_split_join(lambda combine, identity: ABTree(3, 5, combine, identity))
+        self.check_split_join(lambda combine, identity: ABTree(2, 4, combine, identity, sizes=True))
+
     def test_fulltest1(self): self.run_test(1, ABTree(2, 4))
     def test_fulltest2(self): self.run_test(2, ABTree(2, 4))
     def test_fulltest3(self): self.run_test(3, ABTree(2, 4))
     def test_fulltest4(self): self.run_test(4, ABTree(2, 4))
     def test_fulltest5(self): self.run_test(5, ABTree(2, 4))
+    def test_fulltest4_large_vertices(self): self.run_test(4, ABTree(64, 128))
+
+
+class TestBPlusTree(TreeGeneric):
+    def test_values_only_in_leaves(self):
+        tree = BPlusTree(2, 4)
+        for x in range(100):
+            tree.insert(x, -x)
+        self.assertFalse(tree.root.leaf)
+        self.assertEqual(tree.root.values, [])
+
+        # separators stay in internal vertices after their keys are deleted
+        separators = list(tree.root.keys)
+        for key in separators:
+            tree.delete(key)
+            self.assertEqual(tree.find(key), None)
+        self.assertTrue(tree.validate())
+        self.assert_chain(tree, sorted(set(range(100)) - set(separators)))
+
+    def test_default_value_is_key(self):
+        # the same default as Node of other trees
+        for tree in [BPlusTree(2, 4), BPlusTree.from_sorted([(1, None)], 2, 4)]:
+            tree.insert(2, None)
+            self.assertEqual([node.value for node in tree.range(0, 3)], [node.key for node in tree.range(0, 3)])
+            self.assertEqual(tree.find(2).value, 2)
+
+    def test_random_operations(self):
+        for a, b in [(2, 3), (3, 5), (16, 32)]:
+            random = Random(a)
+            tree, content = BPlusTree(a, b), {}
+            for _ in range(3000):
+                key = random.randrange(500)
+                if random.random() < 0.55:
+                    tree.insert(key, -key)
+                    content.setdefault(key, -key)
+                else:
+                    tree.delete(key)
+                    content.pop(key, None)
+            self.assertTrue(tree.validate())
+            self.assert_chain(tree, sorted(content))
+            self.assertEqual(list(tree.items(100, 300)), sorted((k, v) for k, v in content.items() if 100 <= k < 300))
+            self.assertEqual(list(tree.items(100, 300, reverse=True)),
+                             sorted(((k, v) for k, v in content.items() if 100 <= k < 300), reverse=True))
+
+    def test_from_sorted(self):
+        self.check_from_sorted(lambda pairs: BPlusTree.from_sorted(pairs, 2, 4))
+        self.check_from_sorted(lambda pairs: BPlusTree.from_sorted(pairs, 3, 6, fill=0.5))
+        self.check_from_sorted(lambda pairs: BPlusTree.from_sorted(pairs, 64, 128, fill=0.75))
+
+    def test_batch_operations(self):
+        self.check_batch_operations(lambda: BPlusTree(2, 4))
+        self.check_batch_operations(lambda: BPlusTree(3, 6))
+
+    def test_range(self):
+        self.check_range(lambda: BPlusTree(2, 4))
+        self.check_range(lambda: BPlusTree(8, 16))
+
+    def test_order_statistics(self):
+        self.check_order_statistics(lambda: BPlusTree(2, 4))
+        self.check_order_statistics(lambda: BPlusTree(3, 6))
+
+    def test_fulltest1(self): self.run_test(1, BPlusTree(2, 4))
+    def test_fulltest2(self): self.run_test(2, BPlusTree(2, 4))
+    def test_fulltest3(self): self.run_test(3, BPlusTree(2, 4))
+    def test_fulltest4(self): self.run_test(4, BPlusTree(2, 4))
+    def test_fulltest5(self): self.run_test(5, BPlusTree(2, 4))
+    def test_fulltest4_large_vertices(self): self.run_test(4, BPlusTree(64, 128))
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestNumpyBPlusTree(TreeGeneric):
+    def test_random_operations(self):
+        for a, b in [(2, 3), (3, 5), (16, 32)]:
+            random = Random(a)
+            tree, content = NumpyBPlusTree(a, b), {}
+            for _ in range(3000):
+                key = random.randrange(500)
+                if random.random() < 0.55:
+                    tree.insert(key, -key)
+                    content.setdefault(key, -key)
+                else:
+                    tree.delete(key)
+                    content.pop(key, None)
+            self.assertTrue(tree.validate())
+            self.assert_chain(tree, sorted(content))
+            self.assertEqual(list(tree.items(100, 300)), sorted((k, v) for k, v in content.items() if 100 <= k < 300))
+
+    def test_find_many(self):
+        random = Random(7)
+        keys = sorted(random.sample(range(10_000), 2_000))
+        for tree in [NumpyBPlusTree.from_sorted([(k, 3 * k) for k in keys], 2, 4),
+                     NumpyBPlusTree.from_sorted([(k, 3 * k) for k in keys], 64, 128, fill=0.5),
+                     NumpyBPlusTree(2, 4)]:
+            queries = np.array([random.randrange(-10, 10_010) for _ in range(5_000)])
+            for batch in [queries, np.sort(queries), queries[:0]]:
+                values, found = tree.find_many(batch)
+                expected = [tree.find(int(key)) for key in batch]
+                self.assertEqual(found.tolist(), [node is not None for node in expected])
+                self.assertEqual(values.tolist(), [0 if node is None else int(node.value) for node in expected])
+
+    def test_value_dtype(self):
+        tree = NumpyBPlusTree.from_sorted([(x, x / 2) for x in range(100)], 2, 4, value_dtype=np.float64)
+        tree.insert(1000, 0.25)
+        values, found = tree.find_many([3, 1000, 2000])
+        self.assertEqual(values.tolist(), [1.5, 0.25, 0.0])
+        self.assertEqual(found.tolist(), [True, True, False])
+
+    def test_from_sorted(self):
+        self.check_from_sorted(lambda pairs: NumpyBPlusTree.from_sorted(pairs, 2, 4))
+        self.check_from_sorted(lambda pairs: NumpyBPlusTree.from_sorted(pairs, 64, 128, fill=0.75))
+
+    def test_batch_operations(self):
+        self.check_batch_operations(lambda: NumpyBPlusTree(2, 4))
+
+    def test_range(self):
+        self.check_range(lambda: NumpyBPlusTree(2, 4))
+        self.check_range(lambda: NumpyBPlusTree(8, 16))
+
+    def test_order_statistics(self):
+        self.check_order_statistics(lambda: NumpyBPlusTree(3, 6))
+
+    def test_fulltest1(self): self.run_test(1, NumpyBPlusTree(2, 4))
+    def test_fulltest4(self): self.run_test(4, NumpyBPlusTree(64, 128))
+    def test_fulltest5(self): self.run_test(5, NumpyBPlusTree(16, 32))
 
 
 class TestRBTree(TreeGeneric):
+    def test_from_sorted(self):
+        self.check_from_sorted(RBTree.from_sorted)
+
+    def test_batch_operations(self):
+        self.check_batch_operations(RBTree)
+
+    def test_range(self):
+        self.check_range(RBTree)
+
+    def test_order_statistics(self):
+        self.check_order_statistics(lambda: RBTree(sizes=True))
+        self.check_order_statistics(RBTree)
+        self.assertFalse(hasattr(RBTree.from_sorted([(1, 1)]).root, "size"))
+        self.assertEqual(RBTree.from_sorted([(1, 1), (2, 2)], sizes=True).root.size, 2)
+
+    def test_aggregate(self):
+        self.check_aggregate(RBTree)
+        # only trees with combine function have nodes with agg slot
+        self.assertFalse(hasattr(RBTree.from_sorted([(1, 1)]).root, "agg"))
+        self.assertEqual(RBTree.from_sorted([(1, "a")], lambda x, y: x + y, "").root.agg, "a")
+
+    def test_split_join(self):
+        self.check_split_join(RBTree)
+        self.check_split_join(lambda combine, identity: RBTree(combine, identity, sizes=True))
+
     def test_fulltest1(self): self.run_test(1, RBTree())
     def test_fulltest2(self): self.run_test(2, RBTree())
     def test_fulltest3(self): self.run_test(3, RBTree())
@@ -283,5 +730,844 @@ class TestRBTree(TreeGeneric):
     def test_fulltest5(self): self.run_test(5, RBTree())
 
 
+class TestPooledAvlTree(TreeGeneric):
+    def test_same_shape_as_avl(self):
+        tree, pooled = AvlTree(), PooledAvlTree()
+        for x in [5, 3, 8, 1, 4, 7, 9, 2, 6]:
+            tree.insert(x, x)
+            pooled.insert(x, x)
+        tree.delete(5)
+        pooled.delete(5)
+
+        def shape(node):
+            return None if node.external else (node.key, shape(node.left), shape(node.right))
+
+        def pooled_shape(idx):
+            pool = pooled.pool
+            if idx == 0:
+                return None
+            return (pool.keys[idx], pooled_shape(pool.left[idx]), pooled_shape(pool.right[idx]))
+
+        self.assertEqual(shape(tree.root), pooled_shape(pooled.root))
+        self.assertTrue(pooled.validate())
+
+    def test_free_list_reuse(self):
+        tree = PooledAvlTree()
+        for x in range(100):
+            tree.insert(x, x)
+        for x in range(0, 100, 2):
+            tree.delete(x)
+        slots = len(tree.pool.keys)
+        for x in range(100, 150):
+            tree.insert(x, x)
+
+        self.assertEqual(len(tree.pool.keys), slots)
+        self.assertTrue(tree.validate())
+        self.assertEqual(tree.findmin().key, 1)
+        self.assertEqual(tree.findmax().prev.key, 148)
+
+    def test_batch_operations(self):
+        self.check_batch_operations(PooledAvlTree)
+
+    def test_range(self):
+        self.check_range(PooledAvlTree)
+
+    def test_order_statistics(self):
+        self.check_order_statistics(lambda: PooledAvlTree(sizes=True))
+        self.check_order_statistics(PooledAvlTree)
+        self.assertIsNone(PooledAvlTree().pool.size)
+
+    def test_fulltest1(self): self.run_test(1, PooledAvlTree())
+    def test_fulltest2(self): self.run_test(2, PooledAvlTree())
+    def test_fulltest3(self): self.run_test(3, PooledAvlTree())
+    def test_fulltest4(self): self.run_test(4, PooledAvlTree())
+    def test_fulltest5(self): self.run_test(5, PooledAvlTree())
+
+
+class TestSnapshot(TreeGeneric):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_save_load(self):
+        keys = Random(11).sample(range(100000), 10000)
+        trees = [AvlTree(), RBTree(), ABTree(3, 5), PooledAvlTree(), BPlusTree(3, 5)]
+        if np is not None:
+            trees.append(NumpyBPlusTree(3, 5, np.int32))
+        for tree in trees:
+            for x in keys:
+                tree.insert(x, -x)
+            save(tree, self.path)
+            loaded = load(self.path)
+            self.assertIs(type(loaded), type(tree))
+            self.assertTrue(loaded.validate())
+            self.assert_chain(loaded, sorted(keys))
+            self.assertEqual(loaded.find(keys[0]).value, -keys[0])
+            if isinstance(tree, (ABTree, BPlusTree)):
+                self.assertEqual((loaded.a, loaded.b), (3, 5))
+            if np is not None and isinstance(tree, NumpyBPlusTree):
+                self.assertEqual(loaded.value_dtype, np.int32)
+
+        tree = AvlTree.from_sorted((x, x / 2) for x in range(100))
+        save(tree, self.path, 'i', 'd')
+        loaded = load(self.path, combine=lambda x, y: x + y, identity=0)
+        self.assertEqual(loaded.aggregate(0, 10), 22.5)
+
+        save(AvlTree(), self.path)
+        self.assertEqual(len(load(self.path)), 0)
+
+    def test_mapped_tree(self):
+        keys = list(range(0, 300, 3))
+        save(RBTree.from_sorted((x, x * 2) for x in keys), self.path)
+        with MappedTree(self.path) as tree:
+            self.assertEqual(len(tree), len(keys))
+            self.assertEqual(tree.find(30).value, 60)
+            self.assertEqual(tree.find(31), None)
+            self.assertEqual(tree.findmin().key, 0)
+            self.assertEqual(tree.findmax().key, 297)
+            self.assertEqual(tree.findmax().nxt, None)
+            self.assertEqual(tree.find(30).prev.key, 27)
+            self.assertEqual(tree.select(5).key, 15)
+            self.assertEqual(tree.rank(31), 11)
+            self.assertEqual([n.key for n in tree.range(10, 25)], [12, 15, 18, 21, 24])
+            self.assertEqual([n.key for n in tree.range(10, 25, reverse=True)], [24, 21, 18, 15, 12])
+            self.assertEqual(tree.count_range(10, 25), 5)
+            self.assert_chain(tree, keys)
+
+    def test_invalid_snapshot(self):
+        with self.assertRaises(ValueError):
+            save(AvlTree(), self.path, key_type='u')
+        with self.assertRaises(ValueError):
+            save(FingerTree(AvlTree()), self.path)
+        # float key does not fit to 'q', the old snapshot is kept
+        save(AvlTree.from_sorted([(1, 1)]), self.path)
+        with self.assertRaises(TypeError):
+            save(AvlTree.from_sorted([(1, 1), (1.5, 2)]), self.path)
+        self.assertEqual([n.key for n in load(self.path).range(0, 5)], [1])
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+        with open(self.path, "wb") as fout:
+            fout.write(b"not a snapshot" * 10)
+        with self.assertRaises(ValueError):
+            load(self.path)
+        with self.assertRaises(ValueError):
+            MappedTree(self.path)
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        rnd = Random(5)
+        operations = [(rnd.randrange(5), rnd.randrange(-2**40, 2**40)) for _ in range(1000)]
+        write_operations(self.path, operations, chunk_size=64)
+        self.assertEqual(list(read_operations(self.path)), operations)
+
+        write_operations(self.path, [])
+        self.assertEqual(list(read_operations(self.path)), [])
+
+    def test_replay(self):
+        convert_text("dataset/test3.in", self.path)
+        operations = list(read_operations(self.path))
+        with open("dataset/test3.in") as fin:
+            self.assertEqual(len(operations), int(fin.readline()))
+
+        content, found = set(), 0
+        for operation, key in operations:
+            if operation == 0:
+                content.add(key)
+            elif operation == 1:
+                found += key in content
+            elif operation == 2:
+                content.discard(key)
+        for tree in [AvlTree(), RBTree(), ABTree(2, 4)]:
+            self.assertEqual(replay(tree, self.path), found)
+            self.assertEqual([node.key for node in tree.range(min(content), max(content) + 1)], sorted(content))
+
+    def test_invalid_file(self):
+        write_operations(self.path, [(0, x) for x in range(100)])
+        with open(self.path, "r+b") as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+        with self.assertRaises(ValueError):
+            list(read_operations(self.path))
+        with open(self.path, "wb") as f:
+            f.write(b"0 1\n" * 10)
+        with self.assertRaises(ValueError):
+            list(read_operations(self.path))
+
+
+class TestGenTests(TreeGeneric):
+    def setUp(self):
+        spec = importlib.util.spec_from_file_location("genTests", "dataset/genTests.py")
+        self.gen_tests = importlib.util.module_from_spec(spec)
+        # pool workers find generate_segment by module name
+        sys.modules["genTests"] = self.gen_tests
+        spec.loader.exec_module(self.gen_tests)
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def generate(self, directory, jobs):
+        os.makedirs(os.path.join(self.tmp.name, directory, "dataset"))
+        os.chdir(os.path.join(self.tmp.name, directory, "dataset"))
+        self.gen_tests.generate([[7, 5000, [0.4, 0.3, 0.3, 0, 0]], [8, 300, [0.3, 0.3, 0.3, 0.05, 0.05]]],
+                                segment_ops=1000, jobs=jobs, binary=True)
+        os.chdir(os.path.join(self.tmp.name, directory))
+
+    def test_segments(self):
+        self.assertEqual(self.gen_tests.segments(5000, 1000), [1000] * 5)
+        self.assertEqual(self.gen_tests.segments(10, 4), [4, 3, 3])
+        self.assertEqual(self.gen_tests.segments(0, 4), [0])
+
+    def test_deterministic(self):
+        self.generate("serial", 1)
+        self.run_test(7, AvlTree())
+        self.run_test(8, RBTree())
+        self.assertEqual(len(list(read_operations("dataset/test7.ops"))), 5002)
+
+        self.generate("parallel", 2)
+        for name in ["test7.in", "test7.out", "test7.ops", "test8.in", "test8.out"]:
+            self.assertTrue(filecmp.cmp(os.path.join(self.tmp.name, "serial", "dataset", name),
+                                        os.path.join(self.tmp.name, "parallel", "dataset", name),
+                                        shallow=False), name)
+
+    def test_segmented_prints(self):
+        with self.assertRaises(ValueError):
+            self.gen_tests.generate([[7, 5000, [0.3, 0.3, 0.3, 0.05, 0.05]]], segment_ops=1000)
+
+
+class TestWalTree(TreeGeneric):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.dir.name, "tree.log")
+        self.snapshot_path = os.path.join(self.dir.name, "tree.snap")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def fill(self, tree, keys):
+        random = Random(5)
+        for _ in range(2000):
+            key = random.randint(0, 300)
+            if random.random() < 0.6:
+                tree.insert(key, -key)
+                keys.add(key)
+            else:
+                tree.delete(key)
+                keys.discard(key)
+        tree.insert_many((x, x) for x in range(1000, 1100))
+        tree.delete_many(range(1000, 1050))
+        keys.update(range(1050, 1100))
+
+    def test_replay(self):
+        keys = set()
+        with WalTree(AvlTree(), self.log_path, group_size=16) as tree:
+            self.fill(tree, keys)
+            self.assertEqual(len(tree), len(keys))
+            self.assertLess(tree.syncs, 2000)
+
+        for make_tree in [AvlTree, RBTree, lambda: ABTree(2, 4)]:
+            with WalTree(make_tree(), self.log_path, fsync=False) as tree:
+                self.assertTrue(tree.validate())
+                self.assert_chain(tree, sorted(keys))
+                self.assertEqual(tree.find(1060).value, 1060)
+
+    def test_torn_record(self):
+        with WalTree(AvlTree(), self.log_path, fsync=False) as tree:
+            tree.insert(1, 1)
+            tree.insert(2, 2)
+        with open(self.log_path, "ab") as fout:
+            fout.write(b"\0\1")
+
+        with WalTree(AvlTree(), self.log_path, fsync=False) as tree:
+            self.assert_chain(tree, [1, 2])
+            tree.insert(3, 3)
+        with WalTree(AvlTree(), self.log_path, fsync=False) as tree:
+            self.assert_chain(tree, [1, 2, 3])
+
+    def test_compact(self):
+        keys = set()
+        with WalTree(RBTree(), self.log_path, self.snapshot_path, compact_every=500, fsync=False) as tree:
+            self.fill(tree, keys)
+            self.assertLess(tree.records, 500)
+            tree.compact()
+            self.assertEqual(os.path.getsize(self.log_path), 0)
+            tree.insert(5000, 5000)
+        keys.add(5000)
+
+        with WalTree(RBTree(), self.log_path, self.snapshot_path, fsync=False) as tree:
+            self.assertTrue(tree.validate())
+            self.assert_chain(tree, sorted(keys))
+
+        with WalTree(AvlTree(), self.log_path, fsync=False) as tree, self.assertRaises(ValueError):
+            tree.compact()
+
+    def test_compact_keeps_last_record(self):
+        tree = WalTree(AvlTree(), self.log_path, self.snapshot_path, group_size=1, compact_every=3)
+        for key in [1, 2, 3, 4]:
+            tree.insert(key, key)
+        # reopened without close, as after crash
+        with WalTree(AvlTree(), self.log_path, self.snapshot_path) as recovered:
+            self.assert_chain(recovered, [1, 2, 3, 4])
+        tree.close()
+
+    def test_restructuring_is_not_delegated(self):
+        with WalTree(AvlTree(), self.log_path, fsync=False) as tree:
+            tree.insert(1, 1)
+            with self.assertRaises(AttributeError):
+                tree.split(1)
+            self.assertEqual(tree.rank(2), 1)
+
+
+class TestConcurrentTree(TreeGeneric):
+    def stress(self, tree: ConcurrentTree):
+        errors: list = []
+        done = threading.Event()
+
+        def writer():
+            random = Random(1)
+            try:
+                for _ in range(3000):
+                    key = random.randint(0, 500)
+                    if random.random() < 0.6:
+                        tree.insert(key, key)
+                    else:
+                        tree.delete(key)
+            finally:
+                done.set()
+
+        def reader(seed):
+            random = Random(seed)
+            try:
+                while not done.is_set():
+                    key = random.randint(0, 500)
+                    node = tree.find(key)
+                    if node is not None and node.key != key:
+                        errors.append(f"find({key}) returned {node.key}")
+                    keys = [n.key for n in tree.range(key, key + 50)]
+                    if keys != sorted(keys):
+                        errors.append(f"range({key}) is not sorted")
+                    if not tree.validate():
+                        errors.append("invalid tree")
+            except Exception as e:
+                errors.append(repr(e))
+
+        threads = [threading.Thread(target=writer)]
+        threads += [threading.Thread(target=reader, args=(seed,)) for seed in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertTrue(tree.tree.validate())
+
+    def test_locked_stress(self):
+        self.stress(ConcurrentTree(ABTree(2, 4)))
+        self.stress(ConcurrentTree(AvlTree()))
+
+    def test_snapshot_stress(self):
+        self.stress(ConcurrentTree(PersistentAvlTree(), snapshot_reads=True))
+        self.stress(ConcurrentTree(PersistentRBTree(), snapshot_reads=True))
+
+    def test_snapshot_needs_persistent_tree(self):
+        with self.assertRaises(TypeError):
+            ConcurrentTree(AvlTree(), snapshot_reads=True)
+
+    def test_snapshot_reads(self):
+        tree = ConcurrentTree(PersistentAvlTree().insert(1, 1), snapshot_reads=True)
+        snapshot = tree.snapshot()
+        tree.insert(2, 2)
+        tree.insert(3, 3)
+        # every write is published at once, old versions are not changed
+        self.assertEqual([n.key for n in tree.range(0, 10)], [1, 2, 3])
+        self.assertEqual([n.key for n in snapshot], [1])
+        tree.delete(1)
+        tree.insert_many([(4, 4), (5, 5)])
+        tree.delete_many([2, 5])
+        self.assertEqual([n.key for n in tree.snapshot()], [3, 4])
+        self.assertEqual(tree.count_range(0, 10), 2)
+        self.assertTrue(tree.validate())
+        # the wrapped tree is the published version, writes are applied once
+        self.assertIs(tree.tree, tree.snapshot())
+        self.assertEqual([n.key for n in tree.tree], [3, 4])
+
+    def test_snapshot_reads_own_writes(self):
+        tree = ConcurrentTree(PersistentRBTree(), snapshot_reads=True)
+        errors: list = []
+
+        def writer(start):
+            for key in range(start, start + 200):
+                tree.insert(key, key)
+                if tree.find(key) is None:
+                    errors.append(key)
+
+        threads = [threading.Thread(target=writer, args=(start,)) for start in (0, 1000)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(tree), 400)
+
+
+class TestPersistentTree(unittest.TestCase):
+    def check_versions(self, make_tree):
+        random = Random(9)
+        versions = [(make_tree(), {})]
+        for _ in range(3000):
+            # mostly the newest version, sometimes an older one
+            tree, content = versions[-1] if random.random() < 0.8 else random.choice(versions)
+            key, content = random.randint(0, 300), dict(content)
+            if random.random() < 0.55:
+                tree = tree.insert(key, -key)
+                content.setdefault(key, -key)
+            else:
+                tree = tree.delete(key)
+                content.pop(key, None)
+            versions.append((tree, content))
+
+        for tree, content in versions[::20]:
+            self.assertTrue(tree.validate())
+            self.assertEqual([(n.key, n.value) for n in tree], sorted(content.items()))
+            self.assertEqual(len(tree), len(content))
+            keys = sorted(content)
+            for lo, hi in [(-1, 400), (10, 60), (60, 10)]:
+                expected = [x for x in keys if lo <= x < hi]
+                self.assertEqual([n.key for n in tree.range(lo, hi)], expected)
+                self.assertEqual([n.key for n in tree.range(lo, hi, reverse=True)], expected[::-1])
+            if keys:
+                self.assertEqual(tree.findmin().key, keys[0])
+                self.assertEqual(tree.findmax().key, keys[-1])
+                self.assertEqual(tree.select(len(keys) // 2).key, keys[len(keys) // 2])
+                self.assertEqual(tree.rank(150), sum(1 for x in keys if x < 150))
+
+        tree = make_tree().insert(1)
+        self.assertIs(tree.insert(1, 2), tree)
+        self.assertIs(tree.delete(2), tree)
+        self.assertEqual(tree.find(1).value, 1)
+        self.assertEqual(tree.delete(1).find(1), None)
+
+    def test_avl_versions(self):
+        self.check_versions(PersistentAvlTree)
+
+    def test_rb_versions(self):
+        self.check_versions(PersistentRBTree)
+
+    def test_versions_share_nodes(self):
+        tree = PersistentAvlTree()
+        for x in range(1024):
+            tree = tree.insert(x)
+
+        def nodes(node):
+            return set() if node.external else {id(node)} | nodes(node.left) | nodes(node.right)
+        new_nodes = nodes(tree.insert(2000).root) - nodes(tree.root)
+        self.assertLessEqual(len(new_nodes), 2 * tree.root.depth)
+
+
+class TestAsyncTreeStore(unittest.TestCase):
+    def test_coalescing(self):
+        async def run():
+            store = AsyncTreeStore(AvlTree())
+            await asyncio.gather(*(store.put(x, -x) for x in range(100)))
+            self.assertEqual(store.batches, 1)
+
+            # requests of one tick are applied in order
+            results = await asyncio.gather(store.get(5), store.put(5, 50), store.get(5),
+                                           store.delete(5), store.get(5), store.get(1000))
+            self.assertEqual(results, [-5, None, 50, None, None, None])
+            self.assertEqual(store.batches, 2)
+            self.assertEqual(store.latency["get"].count, 4)
+            self.assertTrue(store.tree.validate())
+        asyncio.run(run())
+
+    def test_errors_are_set_to_futures(self):
+        async def run():
+            store = AsyncTreeStore(AvlTree())
+            await store.put(1, 10)
+            results = await asyncio.wait_for(
+                asyncio.gather(store.get(1), store.get("x"), store.put(2, 20), store.get(2), store.put("y", 0),
+                               store.get(1), return_exceptions=True), timeout=5)
+            self.assertEqual(results[0], 10)
+            self.assertIsInstance(results[1], TypeError)
+            self.assertEqual(results[2:4], [None, 20])
+            self.assertIsInstance(results[4], TypeError)
+            self.assertEqual(results[5], 10)
+            self.assertEqual(await store.get(2), 20)
+            self.assertTrue(store.tree.validate())
+        asyncio.run(run())
+
+    def test_range(self):
+        async def run():
+            store = AsyncTreeStore(RBTree(), scan_threshold=10)
+            for x in range(100):
+                await store.put(x, x)
+            self.assertEqual([key async for key, _ in store.range(5, 9)], [5, 6, 7, 8])
+
+            async def scan():
+                return [key async for key, _ in store.range(0, 1000)]
+            # writes issued during the scan wait for it
+            keys, _, value = await asyncio.gather(scan(), store.put(1000, 1), store.get(1000))
+            self.assertEqual(keys, list(range(100)))
+            self.assertEqual(value, 1)
+            self.assertEqual(store.latency["range"].count, 2)
+        asyncio.run(run())
+
+    def test_latency_histogram(self):
+        histogram = LatencyHistogram(base=1, growth=2, buckets=8)
+        self.assertEqual(histogram.percentile(50), None)
+        for latency in [0.5, 1.5, 3, 3, 100, 1000]:
+            histogram.record(latency)
+        self.assertEqual(histogram.percentile(50), 4)
+        self.assertEqual(histogram.percentile(99), 128)
+        self.assertEqual(histogram.percentile(0), 1)
+
+
+class TestShardedTree(unittest.TestCase):
+    def check_sharded(self, tree_class, tree_args=()):
+        rnd = Random(7)
+        content = {}
+        with ShardedTree(3, tree_class, tree_args, rebalance_every=400) as tree:
+            for step in range(10):
+                # the second half of steps inserts only big keys to skew the shards
+                operations = [(rnd.choice([INSERT, INSERT, FIND, DELETE]),
+                               rnd.randint(0, 1000) if step < 5 else rnd.randint(800, 1000), None)
+                              for _ in range(200)]
+                operations = [(op, key, -key) if op == INSERT else (op, key, value)
+                              for op, key, value in operations]
+                results = tree.apply(operations)
+                for (operation, key, value), result in zip(operations, results):
+                    if operation == INSERT:
+                        content.setdefault(key, value)
+                    elif operation == DELETE:
+                        content.pop(key, None)
+                    else:
+                        self.assertEqual(result, content.get(key))
+                self.assertEqual(tree.range(-1, 2000), sorted(content.items()))
+                self.assertEqual(tree.range(100, 900),
+                                 sorted((k, v) for k, v in content.items() if 100 <= k < 900))
+
+            tree.rebalance()
+            self.assertLessEqual(max(tree.sizes()) - min(tree.sizes()), 1)
+            self.assertEqual(tree.bounds, sorted(tree.bounds))
+            self.assertEqual(tree.range(-1, 2000), sorted(content.items()))
+            self.assertEqual(len(tree), len(content))
+
+            tree.insert(5000, 1)
+            self.assertEqual(tree.find(5000), 1)
+            tree.delete(5000)
+            self.assertEqual(tree.find(5000), None)
+
+    def test_avl(self):
+        self.check_sharded(AvlTree)
+
+    def test_rb(self):
+        self.check_sharded(RBTree)
+
+    def test_ab(self):
+        self.check_sharded(ABTree, (2, 4))
+
+    def test_bounds(self):
+        with self.assertRaises(ValueError):
+            ShardedTree(3, AvlTree, bounds=[10])
+        with ShardedTree(3, AvlTree, bounds=[10, 20]) as tree:
+            tree.apply([(INSERT, x, x) for x in range(30)])
+            self.assertEqual(tree.sizes(), [10, 10, 10])
+            self.assertEqual(tree.range(5, 25), [(x, x) for x in range(5, 25)])
+
+    def test_shard_error(self):
+        with ShardedTree(2, AvlTree, bounds=[(100,)]) as tree:
+            tree.apply([(INSERT, (1, 0), "a"), (INSERT, (200, 0), "b")])
+            # (200, "x") is routed to the second shard, its tree cannot compare it
+            with self.assertRaises(TypeError):
+                tree.apply([(FIND, (1, 0), None), (FIND, (200, "x"), None)])
+            # the failed worker keeps its tree and no stale replies are left in pipes
+            self.assertEqual(tree.apply([(FIND, (1, 0), None), (FIND, (200, 0), None)]), ["a", "b"])
+            self.assertEqual(tree.sizes(), [1, 1])
+            self.assertEqual(tree.range((0,), (300,)), [((1, 0), "a"), ((200, 0), "b")])
+
+
+class TestCachedTree(TreeGeneric):
+    def test_coherent_with_tree(self):
+        makers = [AvlTree, RBTree, PooledAvlTree, lambda: ABTree(2, 4), lambda: BPlusTree(2, 4)]
+        for make_tree in makers:
+            for policy in ["lru", "clock"]:
+                random = Random(5)
+                tree = CachedTree(make_tree(), size=32, policy=policy)
+                content = {}
+                for _ in range(5000):
+                    key = random.randrange(100)
+                    operation = random.random()
+                    if operation < 0.2:
+                        tree.insert(key, -key)
+                        content.setdefault(key, -key)
+                    elif operation < 0.4:
+                        tree.delete(key)
+                        content.pop(key, None)
+                    else:
+                        node = tree.find(key)
+                        self.assertEqual(None if node is None else (node.key, node.value),
+                                         (key, content[key]) if key in content else None)
+                        if node is not None and tree.tree.STABLE_NODES:
+                            self.assertEqual(node, tree.tree.find(key))
+                self.assertTrue(tree.validate())
+                self.assertLessEqual(len(tree.cache), 32)
+                self.assertGreater(tree.hits, 0)
+                self.assertEqual(tree.hits + tree.misses, tree.stats()["hits"] + tree.stats()["misses"])
+
+    def test_batch_operations_clear_cache(self):
+        tree = CachedTree(AvlTree(), size=8)
+        tree.insert_many((x, x) for x in range(100))
+        self.assertEqual(tree.find(5).value, 5)
+        tree.delete_many(range(100))
+        self.assertEqual(tree.find(5), None)
+        tree.insert_many([(5, 50)])
+        self.assertEqual(tree.find(5).value, 50)
+        self.assertEqual(tree.stats(), {"hits": 0, "misses": 3, "hit_ratio": 0.0, "cached": 1})
+        self.assertEqual(tree.rank(6), 1)
+
+    def test_restructuring_is_not_delegated(self):
+        tree = CachedTree(AvlTree(), size=8)
+        tree.insert(1, 1)
+        self.assertEqual(tree.find(1).value, 1)
+        for name in ["split", "join", "join_with_key", "_rebuild"]:
+            with self.assertRaises(AttributeError):
+                getattr(tree, name)
+        self.assertEqual(tree.find(1).value, 1)
+
+    def test_eviction(self):
+        lru = LRUCache(2)
+        lru.put(1, "a")
+        lru.put(2, "b")
+        lru.touch(1)
+        lru.put(3, "c")
+        self.assertEqual(sorted(lru.entries), [1, 3])
+
+        clock = ClockCache(2)
+        clock.put(1, "a")
+        clock.put(2, "b")
+        clock.touch(1)
+        clock.put(3, "c")
+        self.assertEqual(sorted(clock.entries), [1, 3])
+        clock.pop(1)
+        clock.put(4, "d")
+        self.assertEqual(clock.entries, {3: "c", 4: "d"})
+        clock.touch(4)
+        clock.put(5, "e")
+        self.assertEqual(sorted(clock.entries), [4, 5])
+        self.assertRaises(ValueError, CachedTree, AvlTree(), 8, "fifo")
+
+
+class TestFingerTree(unittest.TestCase):
+    def test_find_near_and_far(self):
+        for make_tree in [AvlTree, RBTree, lambda: ABTree(2, 4), lambda: ABTree(16, 32)]:
+            random = Random(8)
+            tree, content = FingerTree(make_tree()), set()
+            for key in random.sample(range(2000), 1000):
+                tree.insert(key, -key)
+                content.add(key)
+            position = 1000
+            for step in range(20000):
+                if step % 10 == 0:
+                    position = random.randrange(-10, 2010)
+                else:
+                    position += random.randint(-8, 8)
+                if step % 97 == 0:
+                    tree.insert(position, -position)
+                    content.add(position)
+                elif step % 89 == 0:
+                    tree.delete(position)
+                    content.discard(position)
+                node = tree.find(position)
+                self.assertEqual(None if node is None else (node.key, node.value),
+                                 (position, -position) if position in content else None)
+                self.assertIs(tree.finger, node)
+            self.assertTrue(tree.validate())
+            self.assertEqual(len(tree), len(content))
+
+    def test_insert_and_delete_from_path(self):
+        makers = [AvlTree, RBTree, lambda: ABTree(2, 4), lambda: ABTree(16, 32),
+                  lambda: AvlTree(add, 0, sizes=True), lambda: RBTree(add, 0, sizes=True),
+                  lambda: ABTree(2, 4, add, 0, sizes=True)]
+        for make_tree in makers:
+            random = Random(10)
+            tree, content = FingerTree(make_tree()), {}
+            position = 500
+            for step in range(6000):
+                if step % 50 == 0:
+                    position = random.randrange(-10, 1010)
+                else:
+                    position += random.randint(-5, 5)
+                if random.random() < 0.6:
+                    tree.insert(position, position)
+                    content.setdefault(position, position)
+                else:
+                    tree.delete(position)
+                    content.pop(position, None)
+                if step % 7 == 0:
+                    node = tree.find(position + 1)
+                    self.assertEqual(None if node is None else node.key,
+                                     position + 1 if position + 1 in content else None)
+            self.assertTrue(tree.validate())
+            self.assertEqual([n.key for n in tree.range(-100, 2000)], sorted(content))
+            if tree.sizes:
+                self.assertEqual(len(tree), len(content))
+                self.assertEqual(tree.aggregate(100, 600), sum(k for k in content if 100 <= k < 600))
+
+        # AVL and AB trees keep the path above rebalanced vertices
+        for tree in [FingerTree(AvlTree()), FingerTree(ABTree(2, 4))]:
+            for key in range(1000):
+                tree.insert(key, key)
+            self.assertGreater(len(tree._path), 1)
+            self.assertTrue(tree.validate())
+            self.assertEqual(tree.find(500).key, 500)
+
+    def test_sequential_finds(self):
+        tree = FingerTree(AvlTree.from_sorted((x, x) for x in range(0, 1000, 2)))
+        self.assertEqual([tree.find(x) is not None for x in range(1000)], [x % 2 == 0 for x in range(1000)])
+        # every find was served by walk along the chain from the previous one
+        self.assertEqual((tree._node.key, tree._skip, tree._backoff), (998, 0, 1))
+        # far key is searched from the root and the next find does not walk
+        self.assertEqual(tree.find(500).key, 500)
+        self.assertEqual((tree._node.key, tree._skip, tree._backoff), (500, 1, 2))
+        self.assertEqual(tree.find(5000), None)
+        tree.delete(500)
+        self.assertEqual(tree._node, None)
+        tree.insert(500, 500)
+        tree.delete_many(range(0, 500))
+        self.assertEqual(tree._path, [])
+        self.assertEqual(tree.find(500).key, 500)
+        self.assertEqual(tree.find(498), None)
+        self.assertEqual(tree.rank(600), 50)
+
+    def test_unsupported_tree(self):
+        self.assertRaises(TypeError, FingerTree, BPlusTree(2, 4))
+        self.assertRaises(TypeError, FingerTree, PooledAvlTree())
+
+    def test_restructuring_is_not_delegated(self):
+        tree = FingerTree(ABTree.from_sorted(((x, x) for x in range(100)), 2, 4))
+        self.assertEqual(tree.find(50).key, 50)
+        for name in ["split", "join", "join_with_key", "_rebuild"]:
+            with self.assertRaises(AttributeError):
+                getattr(tree, name)
+        self.assertEqual(tree.find(51).key, 51)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def run_operations(self, tree: ATree):
+        rnd = Random(3)
+        for _ in range(2000):
+            key = rnd.randrange(500)
+            if rnd.random() < 0.6:
+                tree.insert(key, key)
+            else:
+                tree.delete(key)
+            tree.find(rnd.randrange(500))
+
+    def check_instrumented(self, make_tree, counters):
+        tree, plain = make_tree(), make_tree()
+        stats = instrument(tree)
+        self.run_operations(tree)
+        self.run_operations(plain)
+        self.assertEqual([node.key for node in tree.range(0, 500)], [node.key for node in plain.range(0, 500)])
+        # stored keys are plain keys, not the counting wrappers
+        self.assertTrue(all(type(node.key) is int for node in tree.range(0, 500)))
+        self.assertTrue(tree.validate())
+
+        self.assertEqual(stats.counters["descents"], 4000)
+        self.assertEqual(stats.latency["find"].count, 2000)
+        self.assertGreater(stats.counters["comparisons"], 4000)
+        for name, counter in stats.counters.items():
+            if name in counters:
+                self.assertGreater(counter, 0, name)
+            elif name not in ("comparisons", "descents", "neighbour_searches"):
+                self.assertEqual(counter, 0, name)
+
+        uninstrument(tree)
+        tree.find(1)
+        self.assertEqual(stats.counters["descents"], 4000)
+        self.assertNotIn("find", vars(tree))
+
+    def test_avl(self):
+        self.check_instrumented(AvlTree, {"rotations", "double_rotations"})
+
+    def test_rb(self):
+        self.check_instrumented(RBTree, {"rotations", "color_flips", "move_red_left", "move_red_right"})
+
+    def test_ab(self):
+        self.check_instrumented(lambda: ABTree(2, 4), {"splits", "merges", "borrows"})
+
+    def test_bplus(self):
+        self.check_instrumented(lambda: BPlusTree(2, 4), {"splits"})
+
+    def test_insert_comparisons(self):
+        # comparisons of instrumented insert are the comparisons made by insert
+        # of keys which count their comparisons themselves
+        class Key:
+            comparisons = 0
+
+            def __init__(self, key):
+                self.key = key
+
+            def __lt__(self, other):
+                Key.comparisons += 1
+                return self.key < other.key
+
+            def __eq__(self, other):
+                Key.comparisons += 1
+                return self.key == other.key
+
+        for make_tree in [AvlTree, RBTree, PooledAvlTree, lambda: ABTree(2, 4), lambda: BPlusTree(3, 5)]:
+            tree, counting = make_tree(), make_tree()
+            stats = instrument(tree)
+            Key.comparisons = 0
+            for key in Random(5).choices(range(300), k=500):
+                tree.insert(key, key)
+                counting.insert(Key(key), key)
+            self.assertEqual(stats.counters["comparisons"], Key.comparisons)
+            self.assertEqual(stats.counters["descents"], 500)
+            self.assertTrue(all(type(node.key) is int for node in tree.range(0, 300)))
+
+    def test_unsupported_tree(self):
+        with self.assertRaises(TypeError):
+            instrument(CachedTree(AvlTree()))
+        if np is not None:
+            with self.assertRaises(TypeError):
+                instrument(NumpyBPlusTree(2, 4))
+
+    def test_export(self):
+        tree = AvlTree()
+        stats = instrument(tree, TreeStats())
+        for key in range(10):
+            tree.insert(key, key)
+        self.assertEqual(list(tree.range(3, 5, reverse=True))[0].key, 4)
+        self.assertEqual(stats.counters["neighbour_searches"], 1)
+
+        exported = stats.as_dict()
+        self.assertEqual(exported["counters"]["rotations"], stats.counters["rotations"])
+        self.assertEqual(list(exported["latency"]), ["insert"])
+        self.assertEqual(sum(count for _, count in exported["latency"]["insert"]["buckets"]), 10)
+
+        text = stats.prometheus(labels={"tree": "avl"})
+        self.assertIn("# TYPE tree_rotations_total counter", text)
+        self.assertIn(f'tree_rotations_total{{tree="avl"}} {stats.counters["rotations"]}', text)
+        self.assertIn('tree_operation_seconds_bucket{tree="avl",operation="insert",le="+Inf"} 10', text)
+        self.assertIn('tree_operation_seconds_count{tree="avl",operation="insert"} 10', text)
+
+        stats.reset()
+        tree.find(3)
+        self.assertEqual(stats.counters["descents"], 1)
+        self.assertEqual(stats.latency["find"].count, 1)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,190 @@
+""" Write-ahead log for durable tree mutations
+
+Log is an append-only file of fixed size records (operation, key, value),
+value of delete record is 0. Record layout is given by `struct` format
+"=B" + key typecode + value typecode.
+"""
+
+from generic import RESTRUCTURING_METHODS, ATree
+from struct import Struct
+from typing import Iterable, List, Optional, Tuple
+import os
+import snapshot
+import time
+
+
+INSERT = 0
+DELETE = 1
+
+
+class WalTree:
+    """ Wrapper which logs insert and delete of the tree before they are applied
+
+    Every mutation is applied to the tree and then its records are appended
+    to the log buffer. The buffer is flushed and fsynced once for a group of
+    records (group commit): when group_size records wait for it or group_window
+    seconds passed since the first waiting record. The window is checked only
+    on the next mutation (there is no timer), so the last group of a writer
+    which stops writing is durable only after sync() or close(). Uncommitted
+    records may be lost on crash, but the log stays readable (torn record at
+    the end is dropped). Compaction runs after the records are committed, so
+    the snapshot contains every record it removes from the log.
+
+    On open, the tree content is replaced by the snapshot (if there is any) and
+    the log is replayed by batch operations. compact() folds the log into the
+    snapshot. Other methods except split and join (they are not logged) are
+    delegated to the tree, the tree must be modified only through this wrapper.
+
+    log_path - path of log file
+    snapshot_path - path of snapshot for compaction
+    compact_every - compact automatically after this number of records in log, 0 means never
+    fsync - if False, records are only flushed to OS (no durability against power loss)
+    key_type, value_type - `struct` typecodes of keys and values, one of snapshot.TYPECODES
+    """
+    def __init__(self, tree: ATree, log_path: str, snapshot_path: Optional[str] = None,
+                 group_size: int = 64, group_window: float = 0.01, compact_every: int = 0,
+                 fsync: bool = True, key_type: str = 'q', value_type: str = 'q'):
+        if key_type not in snapshot.TYPECODES or value_type not in snapshot.TYPECODES:
+            raise ValueError(f"unsupported typecode, use one of {snapshot.TYPECODES}")
+        self.tree = tree
+        self.log_path = log_path
+        self.snapshot_path = snapshot_path
+        self.group_size = group_size
+        self.group_window = group_window
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.key_type = key_type
+        self.value_type = value_type
+        self.record = Struct("=B" + key_type + value_type)
+
+        if snapshot_path is not None and os.path.exists(snapshot_path):
+            snapshot.load_into(tree, snapshot_path)
+        # number of records in log, records waiting for commit and time of the first one
+        self.records = self._replay()
+        self.pending = 0
+        self.pending_since = 0.0
+        self.syncs = 0
+        self._log = open(log_path, "ab")
+
+    def _replay(self) -> int:
+        """ Apply records of log to the tree, return number of records """
+        if not os.path.exists(self.log_path):
+            return 0
+        with open(self.log_path, "rb") as fin:
+            data = fin.read()
+        size = len(data) - len(data) % self.record.size
+        if size != len(data):
+            with open(self.log_path, "r+b") as fout:
+                fout.truncate(size)
+
+        # runs of the same operation are applied as one batch
+        batch: List[Tuple] = []
+        batch_op = INSERT
+        for op, key, value in self.record.iter_unpack(memoryview(data)[:size]):
+            if op != batch_op:
+                self._apply(batch_op, batch)
+                batch, batch_op = [], op
+            batch.append((key, value))
+        self._apply(batch_op, batch)
+        return size // self.record.size
+
+    def _apply(self, op: int, batch: List[Tuple]) -> None:
+        if not batch:
+            return
+        if op == INSERT:
+            self.tree.insert_many(batch)
+        else:
+            self.tree.delete_many(key for key, _ in batch)
+
+    def insert(self, key, value=None) -> None:
+        if value is None:
+            value = key
+        # records are packed first, so keys which cannot be logged do not reach the tree
+        records = [self.record.pack(INSERT, key, value)]
+        self.tree.insert(key, value)
+        self._append(records)
+
+    def delete(self, key) -> None:
+        records = [self.record.pack(DELETE, key, 0)]
+        self.tree.delete(key)
+        self._append(records)
+
+    def insert_many(self, pairs: Iterable[Tuple]) -> None:
+        pairs = list(pairs)
+        records = [self.record.pack(INSERT, key, value) for key, value in pairs]
+        self.tree.insert_many(pairs)
+        self._append(records)
+
+    def delete_many(self, keys: Iterable) -> None:
+        keys = list(keys)
+        records = [self.record.pack(DELETE, key, 0) for key in keys]
+        self.tree.delete_many(keys)
+        self._append(records)
+
+    def _append(self, records: List[bytes]) -> None:
+        """ Write records of mutation applied to the tree to log, commit the group
+        if it is full or its window passed and compact if the log is long """
+        self._log.write(b"".join(records))
+        if self.pending == 0:
+            self.pending_since = time.monotonic()
+        self.pending += len(records)
+        self.records += len(records)
+        if self.pending >= self.group_size or time.monotonic() - self.pending_since >= self.group_window:
+            self.sync()
+        if self.compact_every and self.records >= self.compact_every:
+            self.compact()
+
+    def sync(self) -> None:
+        """ Commit all written records """
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        self.pending = 0
+        self.syncs += 1
+
+    def compact(self) -> None:
+        """ Save the tree to snapshot and clear the log
+
+        Snapshot is written to temporary file, renamed and the directory is
+        fsynced before the log is truncated, so crash leaves the old snapshot
+        with the whole log or the new one.
+        """
+        if self.snapshot_path is None:
+            raise ValueError("WalTree was created without snapshot path")
+        tmp_path = self.snapshot_path + ".tmp"
+        snapshot.save(self.tree, tmp_path, self.key_type, self.value_type)
+        if self.fsync:
+            with open(tmp_path, "rb") as fin:
+                os.fsync(fin.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        if self.fsync:
+            # the rename must be durable before the log is truncated
+            fd = os.open(os.path.dirname(os.path.abspath(self.snapshot_path)), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        self._log.flush()
+        self._log.truncate(0)
+        self.pending = 0
+        self.records = 0
+        self.sync()
+
+    def close(self) -> None:
+        self.sync()
+        self._log.close()
+
+    def __enter__(self) -> 'WalTree':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.tree)
+
+    def __getattr__(self, name):
+        if name in RESTRUCTURING_METHODS:
+            raise AttributeError(f"WalTree does not log {name}, use insert_many and delete_many")
+        return getattr(self.tree, name)